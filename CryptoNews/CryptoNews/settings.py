@@ -68,11 +68,13 @@ ACCOUNT_EMAIL_REQUIRED = True
 
 
 MIDDLEWARE = [
+    'Website.instrumentation.InstrumentationMiddleware',  # first, so its timings cover the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Website.profiling.ProfilingMiddleware',  # after authentication, which its staff check needs
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -100,11 +102,73 @@ TEMPLATES = [
 WSGI_APPLICATION = 'CryptoNews.wsgi.application'
 
 CACHES = {
+    # A short-lived per-process L1 in front of the shared L2 below (Website/tiered_cache.py).
     'default': {
+        'BACKEND': 'Website.tiered_cache.TieredCache',
+        'LOCATION': 'cryptonews',
+        'VERSION': 1,  # bump when the shape of cached objects changes
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_TIMEOUT': 2,  # longest a worker serves its local copy without asking L2
+            'L1_MAX_ENTRIES': 1000,
+        },
+    },
+    # Set REDIS_URL so all workers share one copy of the market data and publish
+    # invalidations; without it the L2 is local to each process.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if os.environ.get('REDIS_URL') else {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
 }
+
+# CoinGecko market data
+COINGECKO_API_URL = 'https://api.coingecko.com/api/v3'
+COINGECKO_TIMEOUT = 10  # seconds per upstream request
+COINGECKO_RETRIES = 3  # extra attempts on connection errors, 429 and 5xx
+COINGECKO_BACKOFF = 0.5  # base seconds for jittered exponential backoff
+COINGECKO_BACKOFF_MAX = 30  # cap on a single backoff or Retry-After wait
+COINGECKO_MAX_CONCURRENCY = 16  # parallel upstream calls per fan-out
+COINGECKO_RATE_LIMIT_PER_MINUTE = 30  # token-bucket refill rate, per process
+COINGECKO_RATE_LIMIT_BURST = 15  # calls allowed back to back before throttling
+COINGECKO_CIRCUIT_FAILURES = 5  # consecutive failed attempts that open the circuit breaker
+COINGECKO_CIRCUIT_RESET = 30  # seconds the circuit stays open before a single probe call is let through
+# 'thread' keeps the snapshot warm from a worker thread inside each web process;
+# 'command' leaves it to `manage.py ingest_market_data` (needs a shared cache).
+MARKET_DATA_INGESTER = 'thread'
+MARKET_DATA_REFRESH_INTERVAL = 60  # seconds between snapshot refreshes
+MARKET_DATA_MAX_AGE = 60 * 30  # oldest snapshot still served (flagged stale) while CoinGecko is down
+MARKET_DATA_UNIVERSE_SIZE = 500  # top coins by market cap kept in the snapshot (250 per upstream page)
+HOME_COIN_LIMIT = 30  # coins the home page shows, of the whole snapshot
+PRICE_CACHE_TTL = 300  # per-symbol prices for coins outside the snapshot
+PRICE_HISTORY_DAYS = 365  # daily candles backfilled for a newly held coin
+PRICE_HISTORY_SYNC_INTERVAL = 60 * 60  # minimum seconds between incremental syncs of a coin
+PRICE_HISTORY_MAX_GAP_DAYS = 7  # how far back a point-in-time lookup may reach for a candle
+COIN_REGISTRY_REFRESH_INTERVAL = 24 * 60 * 60  # seconds between diffs of /coins/list into the coin registry
+
+CHART_CACHE_MAX_BYTES = 16 * 1024 * 1024  # rendered chart PNGs kept per process (LRU)
+# 'client' draws portfolio charts in the browser with Plotly from JSON;
+# 'server' renders PNGs with matplotlib. Override per request with ?charts=.
+PORTFOLIO_CHART_MODE = 'client'
+PRICE_STREAM_POLL_INTERVAL = 1  # seconds between snapshot checks by each process's price stream
+PRICE_STREAM_HEARTBEAT = 15  # seconds of silence before a keep-alive comment is sent
+# Route the market-data and portfolio views to their async versions (Website/async_views.py).
+# Enable when serving CryptoNews.asgi; under WSGI every async view pays for its own event loop.
+ASYNC_VIEWS = False
+SERVER_TIMING = True  # per-request upstream/cache/db/chart breakdown in a Server-Timing header
+# /metrics is served to staff users, to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`,
+# and to METRICS_ALLOWED_IPS. Behind a reverse proxy every request arrives from the proxy's
+# address (usually 127.0.0.1), so only list addresses the proxy cannot forward traffic from.
+METRICS_TOKEN = os.environ.get('CRYPTONEWS_METRICS_TOKEN')
+METRICS_ALLOWED_IPS = ()
+# Request profiling (Website/profiling.py): staff send `X-Profile: 1` or `?profile=1` (cProfile)
+# or `sample` (sampled stacks); captures are listed in the admin under Profile captures.
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_MAX_CAPTURES = 50  # oldest captures and their files are deleted beyond this
+PROFILE_SAMPLE_RATE = 0  # also profile 1 in N requests with the stack sampler; 0 disables
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
@@ -115,6 +179,12 @@ DATABASES = {
     }
 }
 
+# Website/logs.py: records go through a queue so handlers write from a listener thread.
+LOGGING_CONFIG = 'Website.logs.configure_logging'
+LOG_LEVEL = os.environ.get('CRYPTONEWS_LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+LOG_DEBUG_SAMPLE_RATE = int(os.environ.get('CRYPTONEWS_LOG_DEBUG_SAMPLE_RATE', 1 if DEBUG else 100))  # keep 1 in N debug records per message
+LOG_FILE = os.environ.get('CRYPTONEWS_LOG_FILE', 'debug.log')  # empty: no log file, e.g. CRYPTONEWS_LOG_FILE= for test runs
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,  # This ensures that Django's default logging configuration is not disabled
@@ -122,6 +192,13 @@ LOGGING = {
         'require_debug_true': {
             '()': 'django.utils.log.RequireDebugTrue',
         },
+        'redact': {
+            '()': 'Website.logs.RedactingFilter',
+        },
+        'sample_debug': {
+            '()': 'Website.logs.SamplingFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
+        },
     },
     'formatters': {
         'verbose': {
@@ -136,30 +213,38 @@ LOGGING = {
     'handlers': {
         'console': {
             'level': 'DEBUG',
-            'filters': ['require_debug_true'],
+            'filters': ['require_debug_true', 'redact'],
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
         'file': {
             'level': 'DEBUG',
+            'filters': ['redact'],
             'class': 'logging.FileHandler',
-            'filename': 'debug.log',
+            'filename': LOG_FILE,
             'formatter': 'verbose',
+        } if LOG_FILE else {
+            'class': 'logging.NullHandler',
+        },
+        'queue': {
+            'class': 'Website.logs.QueueHandler',
+            'handlers': ['console', 'file'],
         },
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',  # Change this to 'ERROR' or 'WARNING' to reduce verbosity
         },
         'django.request': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'ERROR',  # Only log errors
             'propagate': False,
         },
         'CryptoNews': {  # Replace 'myapp' with the actual name of your app
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'filters': ['sample_debug'],
+            'level': LOG_LEVEL,
         },
     },
 }
@@ -1,10 +1,55 @@
+import os
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import CustomUser, ProfileCapture
+from .profiling import capture_path
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
     # Customize display fields if needed
     list_display = ['username', 'email', 'is_staff', 'is_superuser']
 
-admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
+class ProfileCaptureAdmin(admin.ModelAdmin):
+    # Captures are written by ProfilingMiddleware; the admin only browses, downloads and deletes them.
+    list_display = ['created', 'method', 'path', 'user', 'status_code', 'duration_ms', 'mode', 'trigger', 'download']
+    list_filter = ['mode', 'trigger']
+    search_fields = ['path', 'user__username']
+    fields = ['created', 'method', 'path', 'user', 'status_code', 'duration_ms', 'mode', 'trigger', 'download', 'summary_text']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:capture_id>/download/', self.admin_site.admin_view(self.download_view),
+                 name='Website_profilecapture_download'),
+        ] + super().get_urls()
+
+    @admin.display(description='Profile')
+    def download(self, capture):
+        return format_html('<a href="{}">{}</a>', reverse('admin:Website_profilecapture_download', args=[capture.pk]), capture.filename)
+
+    @admin.display(description='Summary')
+    def summary_text(self, capture):
+        return format_html('<pre>{}</pre>', capture.summary)
+
+    def download_view(self, request, capture_id):
+        capture = get_object_or_404(ProfileCapture, pk=capture_id)
+        if not self.has_view_permission(request, capture):
+            raise PermissionDenied
+        if not os.path.exists(capture_path(capture)):
+            raise Http404('The profile file is gone.')
+        return FileResponse(open(capture_path(capture), 'rb'), as_attachment=True, filename=capture.filename)
+
+admin.site.register(CustomUser, CustomUserAdmin)
+admin.site.register(ProfileCapture, ProfileCaptureAdmin)
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class WebsiteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Website'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, pre_save
+
+        from .instrumentation import instrument_connection
+        from .models import Portfolio, ProfileCapture
+        from .portfolio_history import discard_lot_snapshots
+        from .profiling import remove_capture_file
+
+        connection_created.connect(instrument_connection)
+        post_delete.connect(remove_capture_file, sender=ProfileCapture)
+        pre_save.connect(discard_lot_snapshots, sender=Portfolio)
+        post_delete.connect(discard_lot_snapshots, sender=Portfolio)
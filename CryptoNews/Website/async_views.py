@@ -0,0 +1,87 @@
+"""ASGI-native versions of the market-data and portfolio views.
+
+They read the snapshot through the async cache API, load holdings with the
+async ORM and price them over a non-blocking HTTP client, so an ASGI worker
+does not park a thread for every request that waits on CoinGecko. urls.py
+routes to them when ASYNC_VIEWS is enabled; the page logic is shared with
+views.py.
+"""
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render
+
+from . import views
+from .coin_registry import acoin_map
+from .market_data import aget_snapshot
+from .models import Portfolio
+from .prices import aresolve_prices
+from .stream import broadcaster
+from .valuation import lots_query, value_portfolio
+
+logger = logging.getLogger('CryptoNews')
+
+
+def async_login_required(view):
+    # login_required for coroutine views: the user is loaded with request.auser().
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def snapshot_coin_map(snapshot):
+    if snapshot is None:
+        logger.warning('Market snapshot not available yet')
+        return await acoin_map({})
+    return await acoin_map(snapshot.coin_map)
+
+
+async def portfolio_valuation(user, snapshot):
+    rows = [lot async for lot in lots_query(Portfolio.objects.filter(user=user))]
+    symbols = {row[2] for row in rows}
+    prices = await aresolve_prices(
+        symbols, views.held_coin_data(snapshot, symbols), await snapshot_coin_map(snapshot), stale=views.is_stale(snapshot))
+    return value_portfolio(rows, prices)
+
+
+async def get_crypto_data(request):
+    return views.crypto_data_response(request, await aget_snapshot())
+
+
+async def price_stream(request):
+    return views.event_stream_response(broadcaster.aevents())
+
+
+@async_login_required
+async def get_portfolio_data(request):
+    snapshot = await aget_snapshot()
+    valuation = await portfolio_valuation(await request.auser(), snapshot)
+    return JsonResponse({
+        'data': views.top_coins(snapshot), 'portfolio': views.portfolio_api_rows(valuation), **views.price_status(valuation)})
+
+
+@async_login_required
+async def portfolio_view(request):
+    try:
+        days = views._requested_days(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e), content_type='text/plain')
+    user = await request.auser()
+    valuation = await portfolio_valuation(user, await aget_snapshot())
+    chart_mode = views._chart_mode(request)
+
+    context = views.portfolio_context(valuation, chart_mode)
+    if chart_mode == 'client':
+        context.update(views.client_chart_context(request))
+    else:
+        # Server-side charts read the price-history store, which stays synchronous.
+        context.update(await sync_to_async(views.server_chart_context)(user, valuation, days))
+
+    return render(request, 'portfolio.html', context)
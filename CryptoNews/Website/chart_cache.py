@@ -0,0 +1,87 @@
+"""Content-addressed cache for rendered portfolio charts.
+
+A chart is identified by a hash of its inputs. The inputs are kept in the
+Django cache so any worker can render the image on demand; the PNG bytes live
+in a per-process LRU bounded by CHART_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import instrumentation
+
+CHART_INPUTS_TTL = 60 * 60 * 24
+
+
+class LRUByteCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+images = LRUByteCache(getattr(settings, 'CHART_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+
+def chart_key(kind, inputs):
+    payload = json.dumps([kind, inputs], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def register_chart(kind, inputs):
+    """Remember the inputs of a chart and return the key its image is served under."""
+    key = chart_key(kind, inputs)
+    cache.add(f'chart_inputs:{key}', {'kind': kind, 'inputs': inputs}, timeout=CHART_INPUTS_TTL)
+    return key
+
+
+def get_or_render(kind, key, render):
+    """Return the PNG bytes for a registered chart, calling render(inputs) only on a miss."""
+    image = images.get(key)
+    instrumentation.record_cache('chart_image', image is not None)
+    if image is not None:
+        return image
+    registered = cache.get(f'chart_inputs:{key}')
+    if registered is None or registered['kind'] != kind:
+        return None
+    with instrumentation.timed('chart', kind):
+        image = render(registered['inputs'])
+    images.put(key, image)
+    return image
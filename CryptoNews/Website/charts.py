@@ -0,0 +1,64 @@
+"""Server-side matplotlib rendering of the portfolio charts.
+
+Imported lazily by the views: workers that never render a chart never pay for
+loading matplotlib. Each chart is drawn on its own Figure, never through
+pyplot, whose current-figure state is shared by every thread rendering at once.
+"""
+import io
+from datetime import date, timedelta
+
+import matplotlib.dates as mdates
+from matplotlib.artist import setp
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+
+
+def render_pie_chart(slices):
+    labels = [label for label, _ in slices]
+    sizes = [float(value) for _, value in slices]
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def render_valuation_chart(inputs):
+    current_date = date.fromisoformat(inputs['as_of'])
+    dates = []
+    values = []
+
+    # Oldest point first; points are [days ago, value]
+    for days, value in sorted(inputs['points'], reverse=True):
+        dates.append(current_date - timedelta(days=days))
+        values.append(float(value))
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(dates, values, marker='o', linestyle='-', color='b')
+
+    ax.set(xlabel='Date', ylabel='Total Value (USD)',
+           title='Portfolio Valuation Over Time')
+    ax.grid()
+
+    # Format x-axis
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
+
+    # Keep labels horizontal and adjust font size if needed
+    setp(ax.xaxis.get_majorticklabels(), rotation=0, ha='center', fontsize=8)
+
+    # Format y-axis to use commas as thousand separators
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: format(int(x), ',')))
+
+    # Adjust layout
+    fig.tight_layout()
+    fig.subplots_adjust(bottom=0.15)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
@@ -0,0 +1,186 @@
+"""Single-flight request coalescing for cached upstream calls.
+
+Only one caller per key runs the loader at a time: other threads wait on a
+per-key lock, other processes on a lock entry in the (shared) cache. Once a
+value exists, callers are served the stale copy while a single leader
+refreshes it. Coroutines use aget_or_refresh, which coalesces on one task
+per key instead of blocking the event loop on a lock.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any
+
+from django.core.cache import cache
+
+logger = logging.getLogger('CryptoNews')
+
+LOCK_TIMEOUT = 60  # seconds before a crashed leader's cross-process lock expires
+POLL_INTERVAL = 0.05
+
+
+@dataclass(frozen=True)
+class CachedValue:
+    value: Any
+    stored_at: float
+    fresh_until: float
+
+
+class SingleFlight:
+    def __init__(self, lock_timeout=LOCK_TIMEOUT):
+        self.lock_timeout = lock_timeout
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._stats = defaultdict(Counter)
+        self._stats_guard = threading.Lock()
+        self._tasks = {}
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _count(self, key, outcome):
+        namespace = key.split(':', 1)[0]
+        with self._stats_guard:
+            self._stats[namespace][outcome] += 1
+
+    def stats(self):
+        with self._stats_guard:
+            return {namespace: dict(counter) for namespace, counter in self._stats.items()}
+
+    def reset_stats(self):
+        with self._stats_guard:
+            self._stats.clear()
+
+    def _acquire_shared(self, key):
+        token = uuid.uuid4().hex
+        if cache.add(f'{key}:lock', token, timeout=self.lock_timeout):
+            return token
+        return None
+
+    def _release_shared(self, key, token):
+        if cache.get(f'{key}:lock') == token:
+            cache.delete(f'{key}:lock')
+
+    def _load(self, key, loader, ttl, stale_ttl):
+        value = loader()
+        now = time.time()
+        cache.set(key, CachedValue(value, now, now + ttl), timeout=max(ttl, stale_ttl or 0))
+        self._count(key, 'leader')
+        return value
+
+    def peek(self, key):
+        entry = cache.get(key)
+        return entry.value if isinstance(entry, CachedValue) else None
+
+    async def apeek(self, key):
+        entry = await cache.aget(key)
+        return entry.value if isinstance(entry, CachedValue) else None
+
+    def get_or_refresh(self, key, loader, ttl, stale_ttl=None, refresh_ahead=0):
+        """Return the cached value for `key`, calling `loader` at most once across all callers.
+
+        Entries stay fresh for `ttl` seconds and are kept for `stale_ttl` seconds so
+        they can be served while a refresh is in flight. A fresh entry is refreshed
+        early once it has less than `refresh_ahead` seconds left.
+        """
+        entry = cache.get(key)
+        if isinstance(entry, CachedValue):
+            if entry.fresh_until - time.time() > refresh_ahead:
+                self._count(key, 'hits')
+                return entry.value
+            return self._refresh_stale(key, loader, ttl, stale_ttl, entry)
+        return self._load_cold(key, loader, ttl, stale_ttl)
+
+    def _refresh_stale(self, key, loader, ttl, stale_ttl, entry):
+        lock = self._lock_for(key)
+        if not lock.acquire(blocking=False):
+            self._count(key, 'coalesced')
+            return entry.value
+        try:
+            token = self._acquire_shared(key)
+            if token is None:
+                self._count(key, 'coalesced')
+                return entry.value
+            try:
+                return self._load(key, loader, ttl, stale_ttl)
+            except Exception as e:
+                logger.warning('Refresh of %s failed, serving stale value: %s', key, e)
+                self._count(key, 'stale_on_error')
+                return entry.value
+            finally:
+                self._release_shared(key, token)
+        finally:
+            lock.release()
+
+    def _load_cold(self, key, loader, ttl, stale_ttl):
+        with self._lock_for(key):
+            # Another thread may have filled the entry while we waited for the lock.
+            entry = cache.get(key)
+            if isinstance(entry, CachedValue):
+                self._count(key, 'coalesced')
+                return entry.value
+
+            token = self._acquire_shared(key)
+            deadline = time.monotonic() + self.lock_timeout
+            while token is None and time.monotonic() < deadline:
+                # Another process is leading: wait for its result instead of calling upstream too.
+                time.sleep(POLL_INTERVAL)
+                entry = cache.get(key)
+                if isinstance(entry, CachedValue):
+                    self._count(key, 'coalesced')
+                    return entry.value
+                token = self._acquire_shared(key)
+
+            try:
+                return self._load(key, loader, ttl, stale_ttl)
+            finally:
+                if token is not None:
+                    self._release_shared(key, token)
+
+    async def _aload(self, key, loader, ttl, stale_ttl):
+        value = await loader()
+        now = time.time()
+        await cache.aset(key, CachedValue(value, now, now + ttl), timeout=max(ttl, stale_ttl or 0))
+        self._count(key, 'leader')
+        return value
+
+    async def aget_or_refresh(self, key, loader, ttl, stale_ttl=None, refresh_ahead=0):
+        """Async get_or_refresh for a coroutine `loader`.
+
+        Coroutines on the same event loop share one in-flight load per key; a stale
+        entry is served to all of them while that load runs.
+        """
+        entry = await cache.aget(key)
+        if isinstance(entry, CachedValue) and entry.fresh_until - time.time() > refresh_ahead:
+            self._count(key, 'hits')
+            return entry.value
+
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(self._aload(key, loader, ttl, stale_ttl))
+            self._tasks[task_key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+
+        if not leader:
+            self._count(key, 'coalesced')
+            if isinstance(entry, CachedValue):
+                return entry.value
+            return await asyncio.shield(task)
+
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            if not isinstance(entry, CachedValue):
+                raise
+            logger.warning('Refresh of %s failed, serving stale value: %s', key, e)
+            self._count(key, 'stale_on_error')
+            return entry.value
+
+singleflight = SingleFlight()
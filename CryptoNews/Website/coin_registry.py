@@ -0,0 +1,191 @@
+"""Persistent registry of CoinGecko coins, for symbol, id and name lookups.
+
+The full /coins/list is downloaded at most once per COIN_REGISTRY_REFRESH_INTERVAL
+and diffed against the Coin table, so a refresh only writes the coins that were
+added, renamed or delisted. Each process keeps an in-memory index of the table
+and reloads it when another process publishes a new registry version.
+
+Several coins often share a symbol. A symbol resolves to the coin in
+KNOWN_COINS first, then to the coin with the best market-cap rank, then to the
+smallest coin id, so every process picks the same coin.
+"""
+import logging
+import threading
+import time
+from collections import ChainMap
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Coin
+from .upstream import get_json
+
+logger = logging.getLogger('CryptoNews')
+
+VERSION_CACHE_KEY = 'coin_registry:version'
+SYNC_CLAIM_KEY = 'coin_registry:sync'
+BATCH_SIZE = 500
+
+# Symbols whose canonical coin is not the one a rank or id ordering would pick.
+KNOWN_COINS = {
+    'BTC': 'bitcoin',
+    'ETH': 'ethereum',
+    'LTC': 'litecoin',
+    'XRP': 'ripple',
+    'BCH': 'bitcoin-cash',
+    'ADA': 'cardano',
+    'DOT': 'polkadot',
+    'LINK': 'chainlink',
+    'BNB': 'binancecoin',
+    'USDT': 'tether',
+    'DOGE': 'dogecoin',
+}
+
+
+def refresh_interval():
+    return getattr(settings, 'COIN_REGISTRY_REFRESH_INTERVAL', 24 * 60 * 60)
+
+
+def _preference(symbol, coin_id, rank):
+    return (KNOWN_COINS.get(symbol) != coin_id, rank is None, rank or 0, coin_id)
+
+
+class CoinIndex:
+    """Dictionaries over the registry rows: every lookup is a single hash probe."""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.names = {}  # coin id -> name
+        self.ranks = {}  # coin id -> market-cap rank, for ranked coins
+        self.coin_ids = {}  # symbol -> the coin id it resolves to
+        self.candidates = {}  # symbol -> every coin id with that symbol, preferred first
+        ranked = {}
+        for coin_id, symbol, name, rank in rows:
+            self.names[coin_id] = name
+            if rank is not None:
+                self.ranks[coin_id] = rank
+            ranked.setdefault(symbol, []).append(_preference(symbol, coin_id, rank))
+        for symbol, preferences in ranked.items():
+            preferences.sort()
+            self.candidates[symbol] = [preference[-1] for preference in preferences]
+            self.coin_ids[symbol] = self.candidates[symbol][0]
+        for symbol, coin_id in KNOWN_COINS.items():
+            self.coin_ids.setdefault(symbol, coin_id)
+
+    def __len__(self):
+        return len(self.names)
+
+    def coin_id(self, symbol):
+        return self.coin_ids.get(symbol.upper())
+
+    def name(self, coin_id):
+        return self.names.get(coin_id)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _load_index(version):
+    rows = Coin.objects.values_list('coin_id', 'symbol', 'name', 'market_cap_rank').iterator(chunk_size=2000)
+    index = CoinIndex(rows, version)
+    logger.debug('Loaded coin registry version %s with %s coins', version, len(index))
+    return index
+
+
+def get_registry():
+    """The process's CoinIndex, reloaded from the database when the registry has changed."""
+    global _index
+    version = cache.get(VERSION_CACHE_KEY, 0)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = _load_index(version)
+        return _index
+
+
+async def aget_registry():
+    version = await cache.aget(VERSION_CACHE_KEY, 0)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    return await sync_to_async(get_registry)()
+
+
+def coin_map(snapshot_coin_map, index=None):
+    """Symbol -> coin id for every registered coin, with the snapshot's own ids taking precedence."""
+    return ChainMap(snapshot_coin_map, (index or get_registry()).coin_ids)
+
+
+async def acoin_map(snapshot_coin_map):
+    return coin_map(snapshot_coin_map, await aget_registry())
+
+
+def coin_id_for(symbol):
+    return get_registry().coin_id(symbol)
+
+
+def market_cap_ranks(snapshot_coin_map):
+    # The markets snapshot lists coins by market cap, best first.
+    return {coin_id: rank for rank, coin_id in enumerate(snapshot_coin_map.values(), start=1)}
+
+
+def fetch_coin_list():
+    return get_json('/coins/list')
+
+
+def sync_registry(coins=None, ranks=None):
+    """Apply the difference between `coins` (default: the upstream list) and the Coin table.
+
+    `ranks` maps coin id to market-cap rank; coins without one are unranked. Returns
+    the number of coins added, updated and removed.
+    """
+    if coins is None:
+        coins = fetch_coin_list()
+    ranks = ranks or {}
+    wanted = {}
+    for coin in coins:
+        if coin.get('id') and coin.get('symbol'):
+            wanted[coin['id']] = (coin['symbol'].upper()[:50], (coin.get('name') or coin['id'])[:200], ranks.get(coin['id']))
+
+    existing = {
+        coin_id: (symbol, name, rank)
+        for coin_id, symbol, name, rank in Coin.objects.values_list('coin_id', 'symbol', 'name', 'market_cap_rank').iterator()
+    }
+    added = [Coin(coin_id=coin_id, symbol=symbol, name=name, market_cap_rank=rank)
+             for coin_id, (symbol, name, rank) in wanted.items() if coin_id not in existing]
+    changed = {coin_id: values for coin_id, values in wanted.items()
+               if coin_id in existing and existing[coin_id] != values}
+    removed = [coin_id for coin_id in existing if coin_id not in wanted]
+
+    with transaction.atomic():
+        Coin.objects.bulk_create(added, batch_size=BATCH_SIZE)
+        if changed:
+            updated = list(Coin.objects.filter(coin_id__in=list(changed)))
+            for coin in updated:
+                coin.symbol, coin.name, coin.market_cap_rank = changed[coin.coin_id]
+            Coin.objects.bulk_update(updated, ['symbol', 'name', 'market_cap_rank'], batch_size=BATCH_SIZE)
+        for start in range(0, len(removed), BATCH_SIZE):
+            Coin.objects.filter(coin_id__in=removed[start:start + BATCH_SIZE]).delete()
+
+    result = {'added': len(added), 'updated': len(changed), 'removed': len(removed)}
+    if any(result.values()):
+        cache.set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+    logger.info("Coin registry synced: %s added, %s updated, %s removed", result['added'], result['updated'], result['removed'])
+    return result
+
+
+def sync_if_due(ranks=None):
+    """Sync the registry unless another process or thread did so within the refresh interval."""
+    if not cache.add(SYNC_CLAIM_KEY, True, timeout=refresh_interval()):
+        return None
+    try:
+        return sync_registry(ranks=ranks)
+    except Exception as e:
+        cache.delete(SYNC_CLAIM_KEY)  # let the next check retry it
+        logger.error('Error syncing the coin registry: %s', e)
+        return None
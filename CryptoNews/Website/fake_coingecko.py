@@ -0,0 +1,218 @@
+"""A local stand-in for the CoinGecko API, used by the tests and benchmarks.
+
+Responses are generated from the coin's rank unless the stub is given recorded
+fixtures: a JSON object keyed by endpoint (see FIXTURE_ENDPOINTS) holding the
+bodies to replay, with market charts keyed by coin id.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_ENDPOINTS = ('/coins/markets', '/coins/list', '/simple/price', '/coins/{id}/market_chart')
+
+
+def price_for(coin_id):
+    rank = int(coin_id.rsplit('-', 1)[-1])
+    return round(1000.0 / rank, 4)
+
+
+def historical_price_for(coin_id, day):
+    return round(price_for(coin_id) * (1 + (day.toordinal() % 10) / 100), 4)
+
+
+def make_market_chart(coin_id, days):
+    # Daily points at midnight UTC, oldest first, plus a final point for "now".
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    prices = []
+    for days_back in range(int(days), -1, -1):
+        day = today - timedelta(days=days_back)
+        midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        prices.append([int(midnight.timestamp() * 1000), historical_price_for(coin_id, day)])
+    prices.append([int(now.timestamp() * 1000), price_for(coin_id)])
+    return {'prices': prices}
+
+
+def make_markets(count=30):
+    markets = []
+    for rank in range(1, count + 1):
+        markets.append({
+            'id': f'coin-{rank}',
+            'symbol': f'c{rank}',
+            'name': f'Coin {rank}',
+            'image': f'https://coin-images.coingecko.com/coins/images/{rank}/large/coin.png',
+            'current_price': price_for(f'coin-{rank}'),
+            'market_cap': 10_000_000_000 // rank,
+            'market_cap_rank': rank,
+            'price_change_percentage_24h': round((rank % 7) - 3.5, 2),
+        })
+    return markets
+
+
+def make_coin_list(count=100):
+    # Every market coin plus unranked ones, and a second coin sharing C1's symbol.
+    coins = [{'id': f'coin-{rank}', 'symbol': f'c{rank}', 'name': f'Coin {rank}'} for rank in range(1, count + 1)]
+    coins.append({'id': 'wrapped-coin-1', 'symbol': 'c1', 'name': 'Wrapped Coin 1'})
+    return coins
+
+
+def load_fixtures(path):
+    with open(path) as f:
+        fixtures = json.load(f)
+    unknown = set(fixtures) - set(FIXTURE_ENDPOINTS)
+    if unknown:
+        raise ValueError(f'Unknown fixture endpoints: {", ".join(sorted(unknown))}')
+    return fixtures
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_GET(self):
+        fake = self.server.fake
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        fake.record(parsed.path, params, self.client_address)
+        if fake.latency:
+            fake.track_in_flight(1)
+            time.sleep(fake.latency)
+            fake.track_in_flight(-1)
+
+        status = fake.next_failure()
+        if status is not None:
+            self.send_response(status)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status, body = fake.respond(parsed.path, params)
+        payload = json.dumps(body).encode('utf-8')
+        etag = '"%s"' % hashlib.md5(payload).hexdigest()
+        if status == 200 and fake.etags and self.headers.get('If-None-Match') == etag:
+            fake.record_not_modified()
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            payload = gzip.compress(payload)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', 'gzip')
+        if status == 200 and fake.etags:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCoinGecko:
+    def __init__(self, latency=0.0, markets=None, etags=False, coin_list=None, fixtures=None):
+        fixtures = fixtures or {}
+        self.latency = latency
+        self.markets = markets if markets is not None else fixtures.get('/coins/markets', make_markets())
+        self.coin_list = coin_list if coin_list is not None else fixtures.get('/coins/list', make_coin_list())
+        self.prices = fixtures.get('/simple/price')  # {coin id: {'usd': price}}
+        self.market_charts = fixtures.get('/coins/{id}/market_chart', {})
+        self.etags = etags
+        self.failures = []  # statuses returned, in order, before normal responses resume
+        self.calls = Counter()
+        self.requests = []
+        self.connections = set()
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # most calls waiting out `latency` at once
+        self._calls_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def record(self, path, params, client_address=None):
+        if path.startswith('/coins/') and path.endswith('/market_chart'):
+            path = '/coins/{id}/market_chart'
+        with self._calls_lock:
+            self.calls[path] += 1
+            self.requests.append((path, params))
+            self.connections.add(client_address)
+
+    def track_in_flight(self, change):
+        with self._calls_lock:
+            self.in_flight += change
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def record_not_modified(self):
+        with self._calls_lock:
+            self.not_modified += 1
+
+    def next_failure(self):
+        with self._calls_lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def respond(self, path, params):
+        if path == '/coins/markets':
+            per_page = int(params.get('per_page', 100))
+            start = (int(params.get('page', 1)) - 1) * per_page
+            return 200, self.markets[start:start + per_page]
+        if path == '/coins/list':
+            return 200, self.coin_list
+        if path == '/simple/price':
+            ids = params.get('ids', '').split(',')
+            if self.prices is not None:
+                return 200, {coin_id: self.prices[coin_id] for coin_id in ids if coin_id in self.prices}
+            return 200, {coin_id: {'usd': price_for(coin_id)} for coin_id in ids if coin_id.startswith('coin-')}
+        if path.startswith('/coins/') and path.endswith('/market_chart'):
+            coin_id = path.split('/')[2]
+            if coin_id in self.market_charts:
+                return 200, self.market_charts[coin_id]
+            if coin_id.startswith('coin-'):
+                return 200, make_market_chart(coin_id, params.get('days', 1))
+        return 404, {'error': 'not found'}
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def serve(ready, stop, **options):
+    """Run a FakeCoinGecko until `stop` is set, reporting its URL on the `ready` queue.
+
+    Meant as a multiprocessing target, so benchmarks can keep the stub's threads
+    out of the process being measured.
+    """
+    with FakeCoinGecko(**options) as fake:
+        ready.put(fake.url)
+        stop.wait()
@@ -0,0 +1,116 @@
+"""Bounded concurrent fan-out for upstream calls, and the rate limit every CoinGecko call draws from."""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger('CryptoNews')
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self):
+        # 0 once a token is taken, else the wait until the next one.
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while wait_for := self._take():
+            if deadline is not None and time.monotonic() + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+        return True
+
+    async def aacquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while wait_for := self._take():
+            if deadline is not None and time.monotonic() + wait_for > deadline:
+                return False
+            await asyncio.sleep(wait_for)
+        return True
+
+
+_coingecko_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def coingecko_bucket():
+    # Shared by every upstream call in the process, so page fetches, retries and fan-outs respect one budget.
+    global _coingecko_bucket
+    rate = getattr(settings, 'COINGECKO_RATE_LIMIT_PER_MINUTE', 30) / 60
+    burst = getattr(settings, 'COINGECKO_RATE_LIMIT_BURST', 15)
+    with _bucket_lock:
+        if _coingecko_bucket is None or (_coingecko_bucket.rate, _coingecko_bucket.capacity) != (rate, burst):
+            _coingecko_bucket = TokenBucket(rate, burst)
+        return _coingecko_bucket
+
+
+class FetchTimeout(Exception):
+    pass
+
+
+class RateLimited(requests.RequestException):
+    pass
+
+
+class ConcurrentFetcher:
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers or getattr(settings, 'COINGECKO_MAX_CONCURRENCY', 16)
+        self.timeout = timeout or getattr(settings, 'COINGECKO_TIMEOUT', 10)
+
+    def fetch_all(self, fn, items):
+        """Call fn(item) for every item concurrently.
+
+        Returns (results, errors), both keyed by item: a failure, timeout or rate-limit
+        wait only affects its own item. The calls take their rate-limit tokens in the
+        upstream client, one per HTTP attempt.
+        """
+        items = list(dict.fromkeys(items))
+        results, errors = {}, {}
+        if not items:
+            return results, errors
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)), thread_name_prefix='upstream-fetch')
+        try:
+            # Each call runs in a copy of the caller's context, so it reports into the request's metrics.
+            futures = {executor.submit(contextvars.copy_context().run, fn, item): item for item in items}
+            # Each call already has an HTTP timeout; this bounds the fan-out as a whole.
+            done, not_done = wait(futures, timeout=2 * self.timeout + len(items) / coingecko_bucket().rate)
+            for future in done:
+                item = futures[future]
+                try:
+                    results[item] = future.result()
+                except Exception as e:
+                    errors[item] = e
+            for future in not_done:
+                future.cancel()
+                errors[futures[future]] = FetchTimeout(f'{futures[future]} did not finish in time')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for item, error in errors.items():
+            logger.error('Fetch for %s failed: %s', item, error)
+        return results, errors
@@ -0,0 +1,163 @@
+"""Local store of daily historical prices, backfilled once and then extended incrementally."""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .fetcher import ConcurrentFetcher
+from .models import HistoricalPrice, Portfolio
+from .upstream import get_json
+
+logger = logging.getLogger('CryptoNews')
+
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='price-history')
+
+
+def history_days():
+    return getattr(settings, 'PRICE_HISTORY_DAYS', 365)
+
+
+def sync_interval():
+    return getattr(settings, 'PRICE_HISTORY_SYNC_INTERVAL', 60 * 60)
+
+
+def fetch_daily_prices(coin_id, days):
+    params = {
+        'vs_currency': 'usd',
+        'days': days,
+        'interval': 'daily'
+    }
+    data = get_json(f'/coins/{coin_id}/market_chart', params, endpoint='/coins/{id}/market_chart')
+
+    candles = {}
+    for timestamp_ms, price in data.get('prices', []):
+        day = datetime.fromtimestamp(timestamp_ms / 1000, tz=dt_timezone.utc).date()
+        candles[day] = price  # The last point of a day wins, so today's live price replaces its open
+    return candles
+
+
+def _days_to_fetch(latest, today):
+    if latest is None:
+        return history_days()
+    # The latest stored day is fetched again because its candle may still have been open.
+    return (today - latest).days + 1
+
+
+def _store_candles(coin_id, candles, latest):
+    if latest is not None:
+        candles = {day: price for day, price in candles.items() if day >= latest}
+    HistoricalPrice.objects.bulk_create(
+        [HistoricalPrice(coin_id=coin_id, date=day, price=price) for day, price in candles.items()],
+        update_conflicts=True,
+        unique_fields=['coin_id', 'date'],
+        update_fields=['price'],
+    )
+    logger.debug("Stored %s daily prices for %s", len(candles), coin_id)
+    return len(candles)
+
+
+def sync_coin_history(coin_id, today=None):
+    """Backfill a coin's history, or fetch only the days since its latest stored candle."""
+    today = today or timezone.now().date()
+    latest = HistoricalPrice.objects.filter(coin_id=coin_id).order_by('-date').values_list('date', flat=True).first()
+    return _store_candles(coin_id, fetch_daily_prices(coin_id, _days_to_fetch(latest, today)), latest)
+
+
+def sync_history(coin_ids, today=None):
+    """Sync many coins, downloading their candles concurrently.
+
+    Returns {coin_id: stored candle count} for the coins that were synced; a coin that
+    fails does not affect the others.
+    """
+    today = today or timezone.now().date()
+    # Claim each coin for one interval so other threads and processes skip it.
+    claimed = [coin_id for coin_id in dict.fromkeys(coin_ids)
+               if cache.add(f'history_sync:{coin_id}', True, timeout=sync_interval())]
+    if not claimed:
+        return {}
+
+    latest = dict(
+        HistoricalPrice.objects.filter(coin_id__in=claimed)
+        .values('coin_id').annotate(latest=Max('date')).values_list('coin_id', 'latest')
+    )
+    candles, errors = ConcurrentFetcher().fetch_all(
+        lambda coin_id: fetch_daily_prices(coin_id, _days_to_fetch(latest.get(coin_id), today)), claimed)
+
+    for coin_id in errors:
+        cache.delete(f'history_sync:{coin_id}')  # let the next sync retry it
+    # Rows are written from this thread; only the downloads run in parallel.
+    return {coin_id: _store_candles(coin_id, candles[coin_id], latest.get(coin_id)) for coin_id in claimed if coin_id in candles}
+
+
+def in_background(function, *args):
+    """Run function(*args) on the price-history worker, after any work queued before it."""
+    def run():
+        try:
+            return function(*args)
+        except Exception:
+            logger.exception('Background %s failed', function.__name__)
+        finally:
+            close_old_connections()
+
+    return _background.submit(run)
+
+
+def schedule_sync(coin_ids):
+    return in_background(sync_history, coin_ids)
+
+
+def held_coin_ids(coin_map):
+    symbols = Portfolio.objects.values_list('crypto_symbol', flat=True).distinct()
+    return sorted({coin_map[symbol] for symbol in symbols if symbol in coin_map})
+
+
+def max_gap_days():
+    return getattr(settings, 'PRICE_HISTORY_MAX_GAP_DAYS', 7)
+
+
+def prices_as_of(coin_ids, target_dates):
+    """Point-in-time prices for every coin and target date, resolved in one vectorized pass.
+
+    Returns a (len(coin_ids), len(target_dates)) float array holding the last stored
+    price on or before each date, or NaN when the store has nothing within
+    PRICE_HISTORY_MAX_GAP_DAYS before it.
+    """
+    import numpy as np
+
+    coin_ids = list(coin_ids)
+    targets = np.array([day.toordinal() for day in target_dates], dtype=np.int64)
+    result = np.full((len(coin_ids), len(targets)), np.nan)
+    if not coin_ids or not len(targets):
+        return result
+
+    gap = max_gap_days()
+    rows = list(HistoricalPrice.objects.filter(
+        coin_id__in=coin_ids,
+        date__gte=min(target_dates) - timedelta(days=gap),
+        date__lte=max(target_dates),
+    ).values_list('coin_id', 'date', 'price'))
+    if not rows:
+        return result
+
+    index = {coin_id: position for position, coin_id in enumerate(coin_ids)}
+    coins = np.array([index[coin_id] for coin_id, _, _ in rows], dtype=np.int64)
+    days = np.array([day.toordinal() for _, day, _ in rows], dtype=np.int64)
+    prices = np.array([price for _, _, price in rows], dtype=np.float64)
+
+    # Every (coin, day) pair becomes one sortable key, so a single searchsorted
+    # resolves all coins and dates at once.
+    span = int(max(days.max(), targets.max())) + 1
+    keys = coins * span + days
+    order = np.argsort(keys, kind='stable')
+    keys, prices = keys[order], prices[order]
+
+    wanted = (np.arange(len(coin_ids), dtype=np.int64)[:, None] * span + targets[None, :]).ravel()
+    positions = np.searchsorted(keys, wanted, side='right') - 1
+    found = np.clip(positions, 0, None)
+    valid = (positions >= 0) & (keys[found] // span == wanted // span) & (wanted - keys[found] <= gap)
+    return np.where(valid, prices[found], np.nan).reshape(result.shape)
@@ -0,0 +1,216 @@
+"""Where a request's time goes: upstream calls, cache lookups, SQL and chart rendering.
+
+InstrumentationMiddleware gives each request a RequestMetrics in a context
+variable (copied into sync_to_async threads and ConcurrentFetcher workers), and
+the code that talks to CoinGecko, the cache, the database and matplotlib
+reports into it through record(), timed() and record_cache(). The request's
+figures go out as a Server-Timing header; process-wide totals, together with
+the single-flight, tiered-cache and upstream client counters, are served in
+the Prometheus text format by the /metrics view.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+_current = ContextVar('request_metrics', default=None)
+
+# Server-Timing name -> (unit counted in its description, Prometheus metric, label name)
+TIMINGS = {
+    'upstream': ('calls', 'cryptonews_upstream_request_duration_seconds', 'endpoint'),
+    'db': ('queries', 'cryptonews_db_query_duration_seconds', None),
+    'chart': ('renders', 'cryptonews_chart_render_duration_seconds', 'kind'),
+}
+
+_totals_lock = threading.Lock()
+_durations = {}  # (name, label) -> [count, seconds]
+_cache_lookups = Counter()  # (key namespace, 'hits' or 'misses')
+_requests = Counter()  # (route, method, status)
+_request_seconds = {}  # route -> [count, seconds]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.timings = {}  # name -> [count, seconds]
+        self.cache = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.timings.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def server_timing(self, total):
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="{count} {TIMINGS[name][0]}"'
+            for name, (count, seconds) in self.timings.items()
+        ]
+        for namespace in dict.fromkeys(namespace for namespace, _ in self.cache):
+            hits, misses = self.cache[(namespace, 'hits')], self.cache[(namespace, 'misses')]
+            parts.append(f'cache-{namespace.replace("_", "-")};desc="hits={hits} misses={misses}"')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current():
+    return _current.get()
+
+
+def record(name, seconds, label=''):
+    """Count one `name` operation (see TIMINGS) that took `seconds`."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(name, seconds)
+    with _totals_lock:
+        entry = _durations.setdefault((name, label), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+@contextmanager
+def timed(name, label=''):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, label)
+
+
+def record_cache(key, hit, count=1):
+    # Keys are counted by namespace: 'crypto_data', 'price' for price:BTC, 'chart_inputs', ...
+    namespace, outcome = key.split(':', 1)[0], 'hits' if hit else 'misses'
+    metrics = _current.get()
+    if metrics is not None:
+        with metrics._lock:
+            metrics.cache[(namespace, outcome)] += count
+    with _totals_lock:
+        _cache_lookups[(namespace, outcome)] += count
+
+
+def _time_query(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def instrument_connection(sender=None, connection=None, **kwargs):
+    """Time every query on `connection`; connected to the connection_created signal."""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def reset():
+    with _totals_lock:
+        _durations.clear()
+        _cache_lookups.clear()
+        _requests.clear()
+        _request_seconds.clear()
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        from django.db import connection
+        instrument_connection(connection=connection)
+        token, started = _current.set(RequestMetrics()), time.perf_counter()
+        try:
+            response = self.get_response(request)
+            return self.finish(request, response, time.perf_counter() - started)
+        finally:
+            _current.reset(token)
+
+    async def __acall__(self, request):
+        token, started = _current.set(RequestMetrics()), time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            return self.finish(request, response, time.perf_counter() - started)
+        finally:
+            _current.reset(token)
+
+    def finish(self, request, response, elapsed):
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        with _totals_lock:
+            _requests[(route, request.method, response.status_code)] += 1
+            entry = _request_seconds.setdefault(route, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = _current.get().server_timing(elapsed)
+        return response
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def prometheus_text():
+    """Process-wide counters in the Prometheus text exposition format."""
+    from django.core.cache import caches
+
+    from .coalesce import singleflight
+    from .upstream import client
+
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{suffix}{_labels(**labels)} {value}' for suffix, labels, value in samples)
+
+    with _totals_lock:
+        requests = sorted(_requests.items())
+        request_seconds = sorted(_request_seconds.items())
+        durations = sorted(_durations.items())
+        cache_lookups = sorted(_cache_lookups.items())
+
+    family('cryptonews_http_requests_total', 'counter', 'Requests served, by route and status.', [
+        ('', {'route': route, 'method': method, 'status': status}, count)
+        for (route, method, status), count in requests])
+    family('cryptonews_http_request_duration_seconds', 'summary', 'Time spent serving requests.', [
+        sample for route, (count, seconds) in request_seconds
+        for sample in (('_count', {'route': route}, count), ('_sum', {'route': route}, seconds))])
+    for name, (_, metric, label_name) in TIMINGS.items():
+        samples = []
+        for (recorded, label), (count, seconds) in durations:
+            if recorded == name:
+                labels = {label_name: label} if label_name else {}
+                samples += [('_count', labels, count), ('_sum', labels, seconds)]
+        family(metric, 'summary', f'Time spent in {name} operations.', samples)
+    family('cryptonews_cache_lookups_total', 'counter', 'Cache lookups by key namespace and outcome.', [
+        ('', {'key': namespace, 'outcome': outcome}, count) for (namespace, outcome), count in cache_lookups])
+
+    upstream = sorted(client.metrics().items())
+    for field in ('errors', 'retries', 'not_modified', 'short_circuited'):
+        family(f'cryptonews_upstream_{field}_total', 'counter', f'CoinGecko calls counted as {field}.', [
+            ('', {'endpoint': endpoint}, metrics[field]) for endpoint, metrics in upstream])
+    family('cryptonews_upstream_circuit_open', 'gauge', '1 while the CoinGecko circuit breaker refuses calls.', [
+        ('', {}, int(client.breaker.state != client.breaker.CLOSED))])
+    family('cryptonews_upstream_circuit_opened_total', 'counter', 'Times the CoinGecko circuit breaker opened.', [
+        ('', {}, client.breaker.times_opened)])
+    family('cryptonews_singleflight_total', 'counter', 'Single-flight cache outcomes by key namespace.', [
+        ('', {'key': namespace, 'outcome': outcome}, count)
+        for namespace, outcomes in sorted(singleflight.stats().items()) for outcome, count in sorted(outcomes.items())])
+    tiered = [(alias, caches[alias]) for alias in settings.CACHES if hasattr(caches[alias], 'stats')]
+    family('cryptonews_tiered_cache_total', 'counter', 'Tiered cache L1/L2 hits, misses and invalidations.', [
+        ('', {'cache': alias, 'outcome': outcome}, count)
+        for alias, backend in tiered for outcome, count in sorted(backend.stats().items())])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,126 @@
+"""Logging that stays off the request path.
+
+configure_logging() is Django's LOGGING_CONFIG callable. It accepts the usual
+dictConfig plus one extension (the same one Python 3.12 added): a handler whose
+class is Website.logs.QueueHandler may list `handlers`. Records logged through it
+are put on an in-process queue and a QueueListener thread hands them to the
+listed handlers, so formatting, redaction and disk writes happen on that thread.
+
+SamplingFilter keeps one in `rate` low-level records per message, which is why
+the app logs with %-style arguments: the message template stays constant and
+is only formatted for the records that survive.
+"""
+import atexit
+import copy
+import logging
+import logging.config
+import logging.handlers
+import re
+from queue import Full, Queue
+
+REDACTED = '[REDACTED]'
+QUEUE_SIZE = 10_000
+
+_listeners = []
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records without formatting them; drops them rather than block when the queue is full."""
+
+    def __init__(self, queue=None, maxsize=QUEUE_SIZE):
+        super().__init__(Queue(maxsize) if queue is None else queue)
+        self.listener = None
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record needs no flattening for pickling.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def start(self, handlers):
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        _listeners.append(self)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()  # handles whatever is still queued first
+            self.listener = None
+
+    def flush(self):
+        # Wait until the listener has handled everything enqueued so far.
+        if self.listener is not None:
+            self.queue.join()
+
+
+class RedactingFilter(logging.Filter):
+    """Masks credentials, tokens and cookies in the formatted message."""
+
+    FIELDS = ('password', 'passwd', 'secret', 'token', 'api_key', 'apikey', 'x_cg_pro_api_key',
+              'authorization', 'cookie', 'sessionid', 'csrftoken', 'csrfmiddlewaretoken')
+
+    def __init__(self, fields=FIELDS):
+        super().__init__()
+        names = '|'.join(re.escape(field) for field in fields)
+        # name=value, name: value and 'name': 'value', the last one quoted or up to a separator.
+        self.pattern = re.compile(
+            rf"""(?i)(\b(?:{names})['"]?\s*[:=]\s*)('[^']*'|"[^"]*"|[^\s,;&'"}}]+)""")
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = self.pattern.sub(rf'\1{REDACTED}', message)
+        if redacted != message:
+            record.msg, record.args = redacted, None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Passes one in `rate` records at or below `level` for each logger and message template."""
+
+    def __init__(self, rate=100, level=logging.DEBUG):
+        super().__init__()
+        self.rate = int(rate)
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        self._seen = {}
+
+    def filter(self, record):
+        if record.levelno > self.level or self.rate <= 1:
+            return True
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        return seen % self.rate == 0
+
+
+def _handler_by_name(name):
+    get = getattr(logging, 'getHandlerByName', None)  # Python 3.12+
+    return get(name) if get else logging._handlers.get(name)
+
+
+def configure_logging(config):
+    if not config:
+        return
+    config = copy.deepcopy(config)
+    queued = {
+        name: handler.pop('handlers')
+        for name, handler in config.get('handlers', {}).items()
+        if handler.get('class') == f'{__name__}.QueueHandler' and 'handlers' in handler
+    }
+    stop_listeners()
+    logging.config.dictConfig(config)
+    for name, targets in queued.items():
+        _handler_by_name(name).start([_handler_by_name(target) for target in targets])
+
+
+def stop_listeners():
+    """Flush and stop the listener threads; registered to run at exit."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_listeners)
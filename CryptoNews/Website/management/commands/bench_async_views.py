@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import statistics
+import threading
+import time
+import types
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import path
+
+from Website import async_views, fake_coingecko, views
+from Website.coalesce import singleflight
+from Website.market_data import SNAPSHOT_CACHE_KEY, MarketSnapshot
+from Website.models import CustomUser, Portfolio
+from Website.upstream import client as upstream_client
+
+SCENARIOS = {
+    'sync': views.get_portfolio_data,
+    'async': async_views.get_portfolio_data,
+}
+
+
+def urlconf_for(view):
+    # The benchmark mounts one view; ROOT_URLCONF accepts a module object.
+    module = types.ModuleType(f'bench_urls_{view.__module__.replace(".", "_")}')
+    module.urlpatterns = [path('api/portfolio/', view)]
+    return module
+
+
+async def asgi_get(app, url, cookie):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url,
+        'raw_path': url.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    sent = asyncio.Event()
+    received = []
+    status = None
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await sent.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif not message.get('more_body'):
+            sent.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+class Command(BaseCommand):
+    help = ('Load-test the sync and async portfolio API views under ASGI against a local stub '
+            'upstream, and report throughput, latency and threads used per worker.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200],
+                            help='Concurrent in-flight requests to test.')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per scenario and concurrency level.')
+        parser.add_argument('--latency', type=float, default=0.1, help='Seconds the stub upstream waits per call.')
+        parser.add_argument('--users', type=int, default=50, help='Users, each holding a coin priced upstream.')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    async def run_level(self, app, cookies, total, concurrency):
+        latencies, failures = [], 0
+        counter = iter(range(total))
+        peak_threads = threading.active_count()
+
+        async def worker():
+            nonlocal failures, peak_threads
+            for i in counter:
+                started = time.perf_counter()
+                status = await asgi_get(app, '/api/portfolio/', cookies[i % len(cookies)])
+                latencies.append(time.perf_counter() - started)
+                failures += status != 200
+                peak_threads = max(peak_threads, threading.active_count())
+
+        started, cpu_started = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        latencies.sort()
+        return {
+            'requests_per_second': total / elapsed,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p95_ms': latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+            'cpu_ms_per_request': cpu / total * 1000,
+            'failures': failures,
+            'peak_threads': peak_threads,
+        }
+
+    def seed(self, users):
+        # Every user holds a different coin that is missing from the snapshot, and prices
+        # are not cached, so each request waits on one upstream /simple/price call.
+        coin_map = {f'C{rank}': f'coin-{rank}' for rank in range(1, users + 1)}
+        singleflight.get_or_refresh(
+            SNAPSHOT_CACHE_KEY, lambda: MarketSnapshot([], coin_map, time.time()), ttl=24 * 60 * 60)
+        cookies = []
+        for rank in range(1, users + 1):
+            user = CustomUser.objects.create_user(
+                username=f'bench{rank}', email=f'bench{rank}@example.com', phone_number=f'{rank}')
+            Portfolio.objects.create(user=user, crypto_symbol=f'C{rank}', crypto_name=f'Coin {rank}',
+                                     amount_owned=1, purchase_price=1)
+            http = Client()
+            http.force_login(user)
+            cookies.append(f"sessionid={http.cookies['sessionid'].value}")
+        return cookies
+
+    def start_upstream(self, latency):
+        # The stub runs in its own process so its threads do not compete with the worker.
+        context = multiprocessing.get_context('spawn')
+        ready, stop = context.Queue(), context.Event()
+        process = context.Process(target=fake_coingecko.serve, args=(ready, stop),
+                                  kwargs={'latency': latency, 'markets': []}, daemon=True)
+        process.start()
+        return ready.get(timeout=30), stop, process
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        upstream_url, stop_upstream, upstream = self.start_upstream(options['latency'])
+        logger = logging.getLogger('CryptoNews')
+        log_level = logger.level
+        logger.setLevel(logging.WARNING)  # per-request debug logging would dominate the timings
+        try:
+            with override_settings(
+                COINGECKO_API_URL=upstream_url,
+                MARKET_DATA_INGESTER='command',
+                PRICE_CACHE_TTL=0,
+                COINGECKO_MAX_CONCURRENCY=max(options['concurrency']),
+            ):
+                cookies = self.seed(options['users'])
+                results = {}
+                for name, view in SCENARIOS.items():
+                    with override_settings(ROOT_URLCONF=urlconf_for(view)):
+                        app = ASGIHandler()
+                        results[name] = {}
+                        for concurrency in options['concurrency']:
+                            async def run():
+                                try:
+                                    return await self.run_level(app, cookies, options['requests'], concurrency)
+                                finally:
+                                    await upstream_client.aclose()
+                            results[name][concurrency] = asyncio.run(run())
+        finally:
+            logger.setLevel(log_level)
+            stop_upstream.set()
+            upstream.join(timeout=10)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"Stub upstream latency {options['latency'] * 1000:.0f} ms, {options['requests']} requests per level")
+        for name, levels in results.items():
+            self.stdout.write(f'{name}:')
+            for concurrency, result in levels.items():
+                self.stdout.write(
+                    f"  concurrency {concurrency:>4}: {result['requests_per_second']:7.1f} req/s  "
+                    f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+                    f"CPU {result['cpu_ms_per_request']:5.1f} ms/req  "
+                    f"peak threads {result['peak_threads']:>4}  failures {result['failures']}")
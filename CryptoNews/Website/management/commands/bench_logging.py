@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from Website.fake_coingecko import make_markets
+from Website.logs import QueueHandler, RedactingFilter, SamplingFilter
+from Website.market_data import transform_markets
+
+FORMAT = '{levelname} {asctime} {module} {message}'
+
+
+def make_payloads(coins):
+    _, coin_map = transform_markets(make_markets(coins))
+    day = 24 * 60 * 60 * 1000
+    series = [[i * day, 100.0 + i] for i in range(365)]
+    return {
+        'coin_map': coin_map,
+        'market_chart': {'prices': series, 'market_caps': series, 'total_volumes': series},
+        'historical': {symbol: [1.0, 2.0, 3.0, 4.0] for symbol in list(coin_map)[:20]},
+        'headers': {'Cookie': 'sessionid=abc; csrftoken=def', 'User-Agent': 'bench', 'Accept': 'text/html'},
+    }
+
+
+def former_request(logger, payloads):
+    # What one portfolio request used to log: eager f-strings, whole payloads included.
+    logger.debug(f"Request method: {'POST'}")
+    logger.debug(f"Request headers: {payloads['headers']}")
+    logger.debug("Starting portfolio view")
+    logger.debug(f"Response data for BTC: {payloads['market_chart']}")
+    logger.debug(f"Coin map: {payloads['coin_map']}")
+    logger.debug(f"Fetching historical data for symbols: {list(payloads['historical'])} over days: {[7, 30, 180, 365]}")
+    logger.debug(f"Final historical prices: {payloads['historical']}")
+
+
+def current_request(logger, payloads):
+    logger.debug("Login method not allowed: %s", 'POST')
+    logger.debug("Starting portfolio view")
+    logger.debug("Fetching historical data for %s symbols over days: %s", len(payloads['historical']), [7, 30, 180, 365])
+    logger.debug("Resolved historical prices for %s symbols", len(payloads['historical']))
+
+
+class Command(BaseCommand):
+    help = ('Measure the logging cost a request pays on its own thread: the former eager, synchronous '
+            'setup against lazy, sampled logging through the queue listener (Website/logs.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Simulated requests per scenario.')
+        parser.add_argument('--coins', type=int, default=10_000, help='Size of the coin map the former code logged.')
+        parser.add_argument('--sample-rate', type=int, default=100, help='Debug records kept per message, 1 in N.')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    def scenario(self, name, path, level, queued, sample_rate):
+        file_handler = logging.FileHandler(path)
+        file_handler.setFormatter(logging.Formatter(FORMAT, style='{'))
+        logger = logging.getLogger(f'bench_logging.{name}')
+        logger.propagate = False
+        logger.setLevel(level)
+        if not queued:
+            logger.addHandler(file_handler)
+            return logger, file_handler, None
+        file_handler.addFilter(RedactingFilter())
+        handler = QueueHandler()
+        handler.start([file_handler])
+        logger.addHandler(handler)
+        if sample_rate > 1:
+            logger.addFilter(SamplingFilter(rate=sample_rate))
+        return logger, file_handler, handler
+
+    def measure(self, name, request, level, queued, sample_rate, options, payloads, directory):
+        path = os.path.join(directory, f'{name}.log')
+        logger, file_handler, handler = self.scenario(name, path, level, queued, sample_rate)
+        try:
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                request(logger, payloads)
+            on_request_thread = time.perf_counter() - started
+            if handler is not None:
+                handler.flush()
+            total = time.perf_counter() - started
+        finally:
+            if handler is not None:
+                handler.stop()
+            logger.handlers.clear()
+            file_handler.close()
+        return {
+            'request_thread_us_per_request': on_request_thread / options['requests'] * 1e6,
+            'total_us_per_request': total / options['requests'] * 1e6,
+            'log_bytes_per_request': os.path.getsize(path) / options['requests'],
+        }
+
+    def handle(self, *args, **options):
+        payloads = make_payloads(options['coins'])
+        sample_rate = options['sample_rate']
+        scenarios = {
+            'former (eager, sync file)': (former_request, logging.DEBUG, False, 1),
+            'lazy, sync file': (current_request, logging.DEBUG, False, 1),
+            'lazy, queued': (current_request, logging.DEBUG, True, 1),
+            'lazy, sampled, queued': (current_request, logging.DEBUG, True, sample_rate),
+            'lazy, INFO level': (current_request, logging.INFO, True, sample_rate),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            results = {
+                name: self.measure(f'scenario{position}', *scenario, options, payloads, directory)
+                for position, (name, scenario) in enumerate(scenarios.items())
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:>26}: {result['request_thread_us_per_request']:9.1f} us/request on the request thread  "
+                f"{result['total_us_per_request']:9.1f} us/request including the listener  "
+                f"{result['log_bytes_per_request']:9.0f} bytes logged")
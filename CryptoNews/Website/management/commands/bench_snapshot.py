@@ -0,0 +1,92 @@
+import json
+import pickle
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from Website.fake_coingecko import make_markets
+from Website.market_data import MarketSnapshot, transform_markets
+from Website.payloads import dump_json
+
+CAROUSEL_FIELDS = ('symbol', 'name', 'price', 'image')
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def loaded_bytes(blob):
+    # Memory held by a freshly unpickled copy, which is what every cache read builds.
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = pickle.loads(blob)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del value
+    return used
+
+
+class Command(BaseCommand):
+    help = ('Compare the column-wise market snapshot with the former list of dicts: memory, '
+            'cached size, and the cost of loading, serializing and filtering it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--coins', type=int, nargs='+', default=[1000, 5000], help='Universe sizes to test.')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement (best is reported).')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    def measure(self, coins, repeat):
+        data, coin_map = transform_markets(make_markets(coins))
+        layouts = {
+            'rows': (data, coin_map),
+            'columns': MarketSnapshot(data, coin_map, time.time()),
+        }
+        held = random.Random(coins).sample(list(coin_map), min(20, coins))
+        results = {}
+        for name, value in layouts.items():
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if name == 'rows':
+                rows = lambda: value[0]
+                carousel = lambda: [{field: crypto.get(field) for field in CAROUSEL_FIELDS} for crypto in value[0][:10]]
+                prices = lambda: {crypto['symbol']: crypto['price'] for crypto in value[0] if crypto['symbol'] in held}
+            else:
+                rows = value.rows
+                carousel = lambda: value.rows(CAROUSEL_FIELDS, 10)
+                prices = lambda: {symbol: price for symbol, price in zip(value.column('symbol'), value.column('price'))
+                                  if symbol in held}
+            per_thousand = 1000 / coins
+            results[name] = {
+                'memory_kb_per_1000_coins': loaded_bytes(blob) / 1024 * per_thousand,
+                'pickled_kb_per_1000_coins': len(blob) / 1024 * per_thousand,
+                'unpickle_ms': best_of(repeat, lambda: pickle.loads(blob)) * 1000,
+                'serialize_ms': best_of(repeat, lambda: dump_json(rows())) * 1000,
+                'carousel_projection_ms': best_of(repeat, carousel) * 1000,
+                'held_prices_ms': best_of(repeat, prices) * 1000,
+            }
+        return results
+
+    def handle(self, *args, **options):
+        results = {coins: self.measure(coins, options['repeat']) for coins in options['coins']}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for coins, layouts in results.items():
+            self.stdout.write(f'{coins} coins:')
+            for name, result in layouts.items():
+                self.stdout.write(
+                    f"  {name:>7}: {result['memory_kb_per_1000_coins']:7.1f} KB/1000 coins in memory  "
+                    f"{result['pickled_kb_per_1000_coins']:6.1f} KB/1000 cached  "
+                    f"load {result['unpickle_ms']:6.2f} ms  serialize {result['serialize_ms']:6.2f} ms  "
+                    f"top-10 projection {result['carousel_projection_ms']:6.3f} ms  "
+                    f"held prices {result['held_prices_ms']:6.3f} ms")
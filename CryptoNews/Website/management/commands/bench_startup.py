@@ -0,0 +1,76 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# What a fresh worker imports before serving its first request.
+WORKER_IMPORTS = 'import django; django.setup(); import Website.urls'
+
+# The plotting/data libraries views.py used to import at module level.
+SCENARIOS = {
+    'lazy': '',
+    'eager': 'import matplotlib; matplotlib.use("Agg"); import matplotlib.pyplot, plotly.express, plotly.graph_objects, pandas, numpy',
+}
+
+CHILD = '''
+import json, resource, time
+started = time.perf_counter()
+{worker}
+{extra}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"import_seconds": elapsed, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Measure worker import time (-X importtime) and RSS with lazy vs. eager chart/data imports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per scenario (median is reported).')
+        parser.add_argument('--top', type=int, default=8, help='Slowest top-level imports to list per scenario.')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    def run_child(self, extra):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'CryptoNews.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD.format(worker=WORKER_IMPORTS, extra=extra)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        top_level = {}
+        for line in result.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if match and not match.group(3):
+                top_level[match.group(4)] = int(match.group(2)) / 1_000_000
+        measurement['top_level_imports'] = top_level
+        return measurement
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, extra in SCENARIOS.items():
+            runs = [self.run_child(extra) for _ in range(options['repeat'])]
+            slowest = sorted(runs[-1]['top_level_imports'].items(), key=lambda item: item[1], reverse=True)
+            results[name] = {
+                'import_seconds': statistics.median(run['import_seconds'] for run in runs),
+                'max_rss_mb': statistics.median(run['max_rss_kb'] for run in runs) / 1024,
+                'slowest_imports': dict(slowest[:options['top']]),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for name, result in results.items():
+            self.stdout.write(f"{name}: {result['import_seconds'] * 1000:.0f} ms, {result['max_rss_mb']:.1f} MB max RSS")
+            for module, seconds in result['slowest_imports'].items():
+                self.stdout.write(f'    {seconds * 1000:8.1f} ms  {module}')
+        saved_ms = (results['eager']['import_seconds'] - results['lazy']['import_seconds']) * 1000
+        saved_mb = results['eager']['max_rss_mb'] - results['lazy']['max_rss_mb']
+        self.stdout.write(self.style.SUCCESS(f'Lazy imports save {saved_ms:.0f} ms and {saved_mb:.1f} MB per worker.'))
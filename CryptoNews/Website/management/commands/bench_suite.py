@@ -0,0 +1,366 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from Website import coin_registry, fake_coingecko
+from Website.history import history_days, sync_history
+from Website.market_data import MarketDataIngester
+from Website.models import CustomUser, Portfolio
+from Website.portfolio_history import materialize_snapshots
+from Website.upstream import client as upstream_client
+
+PASSWORD = 'bench-password'
+PERCENTILES = {'p50_ms': 0.50, 'p95_ms': 0.95, 'p99_ms': 0.99}
+
+
+def percentile(ordered, q):
+    # Nearest rank on an already sorted list.
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def upstream_calls():
+    return {endpoint: metrics['requests'] for endpoint, metrics in upstream_client.metrics().items()}
+
+
+def calls_since(before):
+    calls = {endpoint: count - before.get(endpoint, 0) for endpoint, count in upstream_calls().items()}
+    return {endpoint: count for endpoint, count in sorted(calls.items()) if count}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Browser:
+    """One virtual user: a cookie jar and the CSRF header a page's JavaScript would send."""
+
+    def __init__(self, app, cookies=None):
+        self.app = app
+        self.cookies = dict(cookies or {})
+
+    async def request(self, method, url, data=None, ajax=False):
+        body = urlencode(data).encode() if data is not None else b''
+        headers = [(b'host', b'testserver')]
+        if self.cookies:
+            headers.append((b'cookie', '; '.join(f'{k}={v}' for k, v in self.cookies.items()).encode()))
+        if data is not None:
+            headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+            headers.append((b'x-csrftoken', self.cookies.get('csrftoken', '').encode()))
+        if ajax:
+            headers.append((b'x-requested-with', b'XMLHttpRequest'))
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': headers,
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        sent = asyncio.Event()
+        received = []
+        status = None
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await sent.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                for name, value in message['headers']:
+                    if name.lower() == b'set-cookie':
+                        cookie = SimpleCookie()
+                        cookie.load(value.decode('latin-1'))
+                        self.cookies.update((key, morsel.value) for key, morsel in cookie.items())
+            elif not message.get('more_body'):
+                sent.set()
+
+        await self.app(scope, receive, send)
+        return status
+
+
+# Each flow is what one user action costs; it returns whether the action succeeded.
+
+async def crypto_data(browser, user):
+    return await browser.request('GET', '/api/crypto-data/') == 200
+
+
+async def portfolio(browser, user):
+    return await browser.request('GET', '/portfolio/') == 200
+
+
+async def add_to_portfolio(browser, user):
+    symbol = user.symbols[user.adds % len(user.symbols)]
+    user.adds += 1
+    data = {'crypto_symbol': symbol, 'amount_owned': '0.5', 'purchase_price': '10'}
+    return await browser.request('POST', '/add_to_portfolio/', data) == 302
+
+
+async def login(browser, user):
+    # A fresh visitor: load the login page for its CSRF cookie, then sign in the way home.html does.
+    if await browser.request('GET', '/login/') != 200:
+        return False
+    data = {'username': user.username, 'password': PASSWORD}
+    return await browser.request('POST', '/ajax_login/', data, ajax=True) == 200 and 'sessionid' in browser.cookies
+
+
+class Command(BaseCommand):
+    help = ('Load-test the crypto-data API, the portfolio page, adding a holding and the login flow over ASGI '
+            'against a local CoinGecko stand-in, with synthetic users holding 1-500 lots. Reports latency '
+            'percentiles, throughput and upstream calls as JSON that can be compared between commits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10], help='Concurrent virtual users.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level.')
+        parser.add_argument('--login-requests', type=int, default=10,
+                            help='Logins per concurrency level; each one hashes the password.')
+        parser.add_argument('--lots', type=int, nargs='+', default=[1, 10, 100, 500],
+                            help='Lots held by each synthetic user, one portfolio scenario per size.')
+        parser.add_argument('--users', type=int, default=10, help='Synthetic users per lot count.')
+        parser.add_argument('--coins', type=int, default=250, help='Coins the stub upstream lists.')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stub upstream waits per call.')
+        parser.add_argument('--fixtures', help='JSON file of recorded upstream responses to replay.')
+        parser.add_argument('--charts', choices=['client', 'server'], help='Portfolio chart mode to measure.')
+        parser.add_argument('--output', help='Also write the JSON results to this file.')
+        parser.add_argument('--compare', help='Earlier JSON results to report changes against.')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    async def run_level(self, flow, users, browser_for, total, concurrency):
+        latencies, failures = [], 0
+        counter = iter(range(total))
+
+        async def worker():
+            nonlocal failures
+            for i in counter:
+                started = time.perf_counter()
+                ok = await flow(browser_for(i), users[i % len(users)])
+                latencies.append(time.perf_counter() - started)
+                failures += not ok
+
+        before, started = upstream_calls(), time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        calls = calls_since(before)
+        result = {'requests': total, 'failures': failures, 'requests_per_second': total / elapsed}
+        result.update({name: percentile(latencies, q) * 1000 for name, q in PERCENTILES.items()})
+        result['max_ms'] = latencies[-1] * 1000
+        result['upstream_calls'] = calls
+        result['upstream_calls_per_request'] = sum(calls.values()) / total
+        return result
+
+    def seed(self, options):
+        # Warm up the way a deployment does: one markets snapshot, the coin registry, the price
+        # history of every held coin and the materialized daily valuations.
+        ingester = MarketDataIngester()
+        snapshot = ingester.refresh()
+        if snapshot is None:
+            raise CommandError('Could not load the market snapshot from the stub upstream.')
+        coin_registry.sync_if_due(ranks=coin_registry.market_cap_ranks(snapshot.coin_map))
+        coin_map = snapshot.coin_map
+        symbols = list(coin_map)
+
+        password = make_password(PASSWORD)
+        users = {}
+        for lots in options['lots']:
+            users[lots] = []
+            for n in range(options['users']):
+                username = f'bench{lots}x{n}'
+                user = CustomUser.objects.create(username=username, email=f'{username}@example.com',
+                                                 phone_number=f'{lots}-{n}', password=password)
+                held = [symbols[(n + i) % len(symbols)] for i in range(lots)]
+                Portfolio.objects.bulk_create([
+                    Portfolio(user=user, crypto_symbol=symbol, crypto_name=symbol, amount_owned=1 + i % 7,
+                              purchase_price=1 + i % 13)
+                    for i, symbol in enumerate(held)
+                ])
+                user.symbols, user.adds = list(dict.fromkeys(held)), 0
+                users[lots].append(user)
+        Portfolio.objects.update(purchase_date=timezone.now() - timedelta(days=history_days()))
+        held_ids = sorted({coin_map[symbol] for symbol in Portfolio.objects.values_list('crypto_symbol', flat=True)})
+        sync_history(held_ids)
+        materialize_snapshots(coin_map)
+        return users
+
+    def sessions(self, users):
+        cookies = []
+        for user in users:
+            http = Client()
+            http.force_login(user)
+            cookies.append({'sessionid': http.cookies['sessionid'].value, 'csrftoken': get_random_string(32)})
+        return cookies
+
+    def start_upstream(self, options, fixtures):
+        # The stub runs in its own process so its threads do not compete with the worker.
+        stub = {'latency': options['latency'], 'fixtures': fixtures}
+        if '/coins/markets' not in fixtures:
+            stub['markets'] = fake_coingecko.make_markets(options['coins'])
+        if '/coins/list' not in fixtures:
+            stub['coin_list'] = fake_coingecko.make_coin_list(options['coins'])
+        context = multiprocessing.get_context('spawn')
+        ready, stop = context.Queue(), context.Event()
+        process = context.Process(target=fake_coingecko.serve, args=(ready, stop), kwargs=stub, daemon=True)
+        process.start()
+        return ready.get(timeout=30), stop, process
+
+    def run(self, options, users):
+        app = ASGIHandler()
+        everyone = [user for level in users.values() for user in level]
+
+        def fresh(i):
+            return Browser(app)  # an anonymous visitor per request
+
+        def logged_in(level):
+            browsers = [Browser(app, cookies) for cookies in self.sessions(level)]
+            return lambda i: browsers[i % len(browsers)]
+
+        scenarios = {'crypto-data': (crypto_data, everyone, fresh, options['requests'])}
+        for lots, level in users.items():
+            scenarios[f'portfolio lots={lots}'] = (portfolio, level, logged_in(level), options['requests'])
+        for lots, level in users.items():
+            scenarios[f'add_to_portfolio lots={lots}'] = (add_to_portfolio, level, logged_in(level), options['requests'])
+        scenarios['login'] = (login, everyone, fresh, options['login_requests'])
+
+        results = {}
+        for name, (flow, level, browser_for, total) in scenarios.items():
+            results[name] = {}
+            for concurrency in options['concurrency']:
+                async def run():
+                    try:
+                        return await self.run_level(flow, level, browser_for, total, concurrency)
+                    finally:
+                        await upstream_client.aclose()
+                results[name][str(concurrency)] = asyncio.run(run())
+        return results
+
+    def handle(self, *args, **options):
+        fixtures = fake_coingecko.load_fixtures(options['fixtures']) if options['fixtures'] else {}
+        coins = len(fixtures.get('/coins/markets', ())) or options['coins']
+        if max(options['lots']) > 500 or min(options['lots']) < 1:
+            raise CommandError('--lots must be between 1 and 500.')
+
+        setup_test_environment()
+        directory = tempfile.TemporaryDirectory()
+        # A file database, so the price-history thread add_to_portfolio starts can write alongside requests.
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory.name, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        upstream_url, stop_upstream, upstream = self.start_upstream(options, fixtures)
+        logger = logging.getLogger('CryptoNews')
+        log_level = logger.level
+        logger.setLevel(logging.WARNING)  # per-request debug logging would dominate the timings
+        overrides = {
+            'COINGECKO_API_URL': upstream_url,
+            'MARKET_DATA_INGESTER': 'command',
+            'MARKET_DATA_REFRESH_INTERVAL': 60 * 60,  # one snapshot stays fresh for the whole run
+            'MARKET_DATA_UNIVERSE_SIZE': coins,
+            # The stub has no rate limit; the real one is not what is being measured.
+            'COINGECKO_RATE_LIMIT_PER_MINUTE': 60_000,
+            'COINGECKO_RATE_LIMIT_BURST': 1_000,
+        }
+        if options['charts']:
+            overrides['PORTFOLIO_CHART_MODE'] = options['charts']
+        try:
+            with override_settings(**overrides):
+                upstream_client.reset_metrics()
+                started = time.perf_counter()
+                users = self.seed(options)
+                setup = {'seconds': time.perf_counter() - started, 'upstream_calls': calls_since({})}
+                scenarios = self.run(options, users)
+        finally:
+            logger.setLevel(log_level)
+            stop_upstream.set()
+            upstream.join(timeout=10)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            directory.cleanup()
+            teardown_test_environment()
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'async_views': getattr(settings, 'ASYNC_VIEWS', False),
+                'chart_mode': options['charts'] or getattr(settings, 'PORTFOLIO_CHART_MODE', 'server'),
+                'upstream_latency_ms': options['latency'] * 1000,
+                'fixtures': options['fixtures'],
+                'coins': coins,
+                'users_per_lot_count': options['users'],
+            },
+            'setup': setup,
+            'scenarios': scenarios,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), results)
+
+    def report(self, results):
+        meta = results['meta']
+        self.stdout.write(f"Commit {meta['commit']}, stub upstream latency {meta['upstream_latency_ms']:.0f} ms, "
+                          f"{meta['coins']} coins, {meta['chart_mode']} charts")
+        self.stdout.write(f"Setup: {results['setup']['seconds']:.1f} s, upstream calls {results['setup']['upstream_calls']}")
+        for name, levels in results['scenarios'].items():
+            self.stdout.write(f'{name}:')
+            for concurrency, result in levels.items():
+                self.stdout.write(
+                    f"  concurrency {concurrency:>4}: {result['requests_per_second']:7.1f} req/s  "
+                    f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+                    f"upstream {result['upstream_calls_per_request']:5.2f}/req  failures {result['failures']}")
+
+    def compare(self, baseline, results):
+        self.stdout.write(f"Change against {baseline['meta'].get('commit')} (negative latency is faster):")
+        for name, levels in results['scenarios'].items():
+            for concurrency, result in levels.items():
+                before = baseline['scenarios'].get(name, {}).get(concurrency)
+                if before is None:
+                    continue
+                changes = '  '.join(
+                    f"{field[:-3]} {(result[field] / before[field] - 1) * 100:+6.1f}%"
+                    for field in PERCENTILES if before[field])
+                throughput = (result['requests_per_second'] / before['requests_per_second'] - 1) * 100
+                self.stdout.write(f"  {name} @ {concurrency}: {changes}  throughput {throughput:+6.1f}%  "
+                                  f"upstream calls {sum(before['upstream_calls'].values())} -> "
+                                  f"{sum(result['upstream_calls'].values())}")
@@ -0,0 +1,105 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from Website.valuation import value_portfolio
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def make_lots(count, symbols=200, seed=0):
+    rng = random.Random(seed)
+    lots = []
+    for i in range(count):
+        amount, purchase_price = Decimal(rng.randint(1, 10_000)) / 100, Decimal(rng.randint(1, 1_000_000)) / 100
+        lots.append((i, f'Coin {i % symbols}', f'C{i % symbols}', amount, purchase_price, amount * purchase_price))
+    return lots
+
+
+def make_prices(symbols=200, seed=0):
+    rng = random.Random(seed + 1)
+    return {f'C{i}': Decimal(rng.randint(1, 1_000_000)) / 100 for i in range(symbols)}
+
+
+def per_row_valuation(lots, prices):
+    # The Decimal loop the portfolio views ran once per lot before the valuation engine.
+    portfolio_data = []
+    total_value = Decimal('0')
+    total_profit_loss = Decimal('0')
+    for lot_id, name, symbol, amount, purchase_price, _ in lots:
+        current_price = Decimal(prices[symbol])
+        current_value = current_price * amount
+        profit_loss = current_value - purchase_price * amount
+        portfolio_data.append({
+            'id': lot_id,
+            'crypto_name': name,
+            'crypto_symbol': symbol,
+            'amount_owned': amount,
+            'purchase_price': purchase_price,
+            'current_price': current_price,
+            'current_value': current_value,
+            'profit_loss': profit_loss,
+            'profit_loss_percentage': profit_loss / (purchase_price * amount) * 100,
+        })
+        total_value += current_value
+        total_profit_loss += profit_loss
+    portfolio_data.sort(key=lambda x: x['current_value'], reverse=True)
+    allocation = {}
+    for entry in portfolio_data:
+        allocation[entry['crypto_symbol']] = allocation.get(entry['crypto_symbol'], 0) + float(entry['current_value'])
+    return portfolio_data, total_value, total_profit_loss, allocation
+
+
+def engine_valuation(lots, prices):
+    # The same outputs from the engine: one entry per lot, the totals and the allocation.
+    valuation = value_portfolio(lots, prices)
+    return valuation.entries, valuation.total_value, valuation.total_profit_loss, valuation.allocation()
+
+
+class Command(BaseCommand):
+    help = ('Time the portfolio valuation engine against the former per-lot Decimal loop, '
+            'for portfolios of 10, 1,000 and 100,000 lots.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lots', type=int, nargs='+', default=[10, 1000, 100_000], help='Portfolio sizes to test.')
+        parser.add_argument('--symbols', type=int, default=200, help='Distinct coins the lots are spread over.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement (best is reported).')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results.')
+
+    def measure(self, count, symbols, repeat):
+        lots = make_lots(count, symbols)
+        prices = make_prices(symbols)
+        value_portfolio(lots, prices)  # import numpy outside the timings
+        per_row_ms = best_of(repeat, lambda: per_row_valuation(lots, prices)) * 1000
+        vectorized_ms = best_of(repeat, lambda: engine_valuation(lots, prices)) * 1000
+        return {
+            'per_row_ms': per_row_ms,
+            'vectorized_ms': vectorized_ms,
+            # Like for like: both build an entry per lot, as the portfolio table and API render them.
+            'speedup': per_row_ms / vectorized_ms,
+            # Totals, weights and allocation only: what the charts and the summary line need.
+            'totals_only_ms': best_of(repeat, lambda: value_portfolio(lots, prices).allocation()) * 1000,
+        }
+
+    def handle(self, *args, **options):
+        results = {count: self.measure(count, options['symbols'], options['repeat']) for count in options['lots']}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for count, result in results.items():
+            self.stdout.write(
+                f"{count:>7} lots: per-row {result['per_row_ms']:9.2f} ms  "
+                f"vectorized {result['vectorized_ms']:9.2f} ms ({result['speedup']:.2f}x)  "
+                f"totals only {result['totals_only_ms']:8.2f} ms")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Website.market_data import MarketDataIngester
+
+
+class Command(BaseCommand):
+    help = 'Keep the CoinGecko markets snapshot warm in the configured cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Refresh the snapshot once and exit.')
+        parser.add_argument('--interval', type=float, help='Seconds between refreshes (defaults to MARKET_DATA_REFRESH_INTERVAL).')
+
+    def handle(self, *args, **options):
+        ingester = MarketDataIngester(interval=options['interval'], sync_registry=True)
+
+        if options['once']:
+            snapshot = ingester.refresh()
+            if snapshot is None:
+                raise CommandError('Could not refresh the market snapshot.')
+            self.stdout.write(self.style.SUCCESS(f'Published snapshot with {len(snapshot)} coins.'))
+            return
+
+        self.stdout.write(f'Refreshing market snapshot every {ingester.interval}s. Press Ctrl+C to stop.')
+        try:
+            ingester.run_forever()
+        except KeyboardInterrupt:
+            ingester.stop()
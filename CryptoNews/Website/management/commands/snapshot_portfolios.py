@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Website.coin_registry import coin_map
+from Website.market_data import MarketDataIngester
+from Website.models import CustomUser
+from Website.portfolio_history import materialize_snapshots
+
+
+class Command(BaseCommand):
+    help = ('Materialize daily portfolio values into PortfolioSnapshot. Run nightly, after '
+            'sync_price_history, so the valuation charts read history instead of recomputing it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', help='Username to snapshot (repeatable). Defaults to every holder.')
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every day instead of resuming from the latest snapshot.')
+
+    def handle(self, *args, **options):
+        snapshot = MarketDataIngester().refresh()
+        if snapshot is None:
+            raise CommandError('No market snapshot available to map held symbols to coin ids.')
+
+        users = None
+        if options['users']:
+            users = list(CustomUser.objects.filter(username__in=options['users']))
+            missing = set(options['users']) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        written = materialize_snapshots(coin_map(snapshot.coin_map), users=users, rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {written} portfolio snapshots.'))
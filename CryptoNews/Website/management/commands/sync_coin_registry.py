@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Website.coin_registry import market_cap_ranks, sync_registry
+from Website.market_data import MarketDataIngester
+
+
+class Command(BaseCommand):
+    help = 'Diff the CoinGecko coin list into the coin registry.'
+
+    def handle(self, *args, **options):
+        snapshot = MarketDataIngester().refresh()
+        try:
+            result = sync_registry(ranks=market_cap_ranks(snapshot.coin_map) if snapshot else None)
+        except Exception as e:
+            raise CommandError(f'Could not sync the coin registry: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Coin registry synced: {result['added']} added, {result['updated']} updated, {result['removed']} removed."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Website.coin_registry import coin_map
+from Website.history import held_coin_ids, sync_history
+from Website.market_data import MarketDataIngester
+
+
+class Command(BaseCommand):
+    help = 'Backfill and incrementally extend the stored daily price history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--coin', action='append', dest='coins', help='CoinGecko id to sync (repeatable). Defaults to every held coin.')
+
+    def handle(self, *args, **options):
+        coin_ids = options['coins']
+        if not coin_ids:
+            snapshot = MarketDataIngester().refresh()
+            if snapshot is None:
+                raise CommandError('No market snapshot available to map held symbols to coin ids.')
+            coin_ids = held_coin_ids(coin_map(snapshot.coin_map))
+
+        synced = sync_history(coin_ids)
+        for coin_id in coin_ids:
+            if coin_id in synced:
+                self.stdout.write(f'{coin_id}: {synced[coin_id]} daily prices stored')
+            else:
+                self.stderr.write(f'{coin_id}: not synced (failed, or already synced within PRICE_HISTORY_SYNC_INTERVAL)')
+        self.stdout.write(self.style.SUCCESS(f'Synced {len(synced)} of {len(coin_ids)} coins.'))
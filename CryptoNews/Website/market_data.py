@@ -0,0 +1,284 @@
+import logging
+import math
+import re
+import threading
+import time
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+
+from . import coin_registry
+from .coalesce import singleflight
+from .fetcher import ConcurrentFetcher
+from .upstream import get_json
+
+logger = logging.getLogger('CryptoNews')
+
+SNAPSHOT_CACHE_KEY = 'crypto_data'
+MAX_PER_PAGE = 250  # the most coins /coins/markets returns per page
+
+
+def sanitize_price(price_str):
+    if not isinstance(price_str, str):
+        price_str = str(price_str)  # Convert non-string inputs to string
+    # Remove commas and other non-numeric characters
+    cleaned_price = re.sub(r'[^\d.]', '', price_str)
+    try:
+        return Decimal(price_str.replace(',', ''))
+    except Exception as e:
+        logger.error("Error sanitizing price: %s", e)
+        return Decimal('0.00')
+
+
+# Format Market Cap
+def _format_marketcap(market_cap):
+    if market_cap >= 1_000_000_000:
+        return f"{round(market_cap / 1_000_000_000, 1)}B"
+    elif market_cap >= 1_000_000:
+        return f"{round(market_cap / 1_000_000, 1)}M"
+    elif market_cap >= 1_000:
+        return f"{round(market_cap / 1_000, 1)}K"
+    else:
+        return str(market_cap)
+
+
+class MarketSnapshot:
+    """The markets list stored column-wise: one tuple per field rather than one dict per coin.
+
+    Rows share no per-coin dict, so a snapshot of the whole market universe stays
+    small in memory and in the cache, and reading one field (every symbol, every
+    price) never builds the rows. `data` rebuilds the list of dicts for callers
+    that want it; rows_for() builds only those of a few symbols.
+    """
+    __slots__ = ('columns', 'coin_map', 'fetched_at', '_positions')
+
+    def __init__(self, data, coin_map, fetched_at):
+        fields = dict.fromkeys(field for row in data for field in row)
+        self.columns = {field: tuple(row.get(field) for row in data) for field in fields}
+        self.coin_map = coin_map
+        self.fetched_at = fetched_at
+        self._positions = None
+
+    def __getstate__(self):
+        return self.columns, self.coin_map, self.fetched_at
+
+    def __setstate__(self, state):
+        self.columns, self.coin_map, self.fetched_at = state
+        self._positions = None
+
+    def __eq__(self, other):
+        if not isinstance(other, MarketSnapshot):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __repr__(self):
+        return f'<MarketSnapshot of {len(self)} coins at {self.fetched_at}>'
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    @property
+    def stale(self):
+        # Past its refresh: the ingester has not been able to replace it.
+        return self.age > stale_after()
+
+    @property
+    def data(self):
+        return self.rows()
+
+    def column(self, field):
+        return self.columns.get(field) or (None,) * len(self)
+
+    def rows(self, fields=None, limit=None):
+        """The coins as dicts, optionally only the first `limit` coins and only `fields`."""
+        fields = tuple(self.columns) if fields is None else tuple(fields)
+        columns = [self.column(field)[:limit] for field in fields]
+        return [dict(zip(fields, values)) for values in zip(*columns)] if fields else []
+
+    def rows_for(self, symbols, fields=None):
+        """The rows of those of `symbols` the snapshot lists, found through a {symbol: position} index."""
+        if self._positions is None:
+            positions = {}
+            for position, symbol in enumerate(self.column('symbol')):
+                # Like coin_map, a symbol shared by several coins means the largest.
+                positions.setdefault(symbol, position)
+            self._positions = positions
+        fields = tuple(self.columns) if fields is None else tuple(fields)
+        columns = [self.column(field) for field in fields]
+        return [
+            {field: column[position] for field, column in zip(fields, columns)}
+            for position in sorted(self._positions[symbol] for symbol in set(symbols) if symbol in self._positions)
+        ]
+
+
+def transform_markets(markets):
+    transformed_data = []
+    coin_map = {}
+
+    for crypto in markets:
+        symbol = crypto.get('symbol', '').upper()
+        coin_id = crypto.get('id', '')
+        image_url = crypto.get('image', '') or '/static/default_crypto_image.png'
+
+        transformed_data.append({
+            'name': crypto.get('name', 'Unknown'),
+            'symbol': symbol,
+            'price': sanitize_price(crypto.get('current_price', 'N/A')),
+            'price_change_percentage_24h': crypto.get('price_change_percentage_24h', 'N/A'),
+            'marketcap': _format_marketcap(crypto.get('market_cap', 0) or 0),
+            'image': image_url
+        })
+
+        if symbol and coin_id:
+            # Markets come largest first, so a symbol shared by several coins maps to the biggest.
+            coin_map.setdefault(symbol, coin_id)
+
+    return transformed_data, coin_map
+
+
+def stale_after():
+    # Each snapshot is published fresh for two refresh intervals (see MarketDataIngester.refresh).
+    return 2 * getattr(settings, 'MARKET_DATA_REFRESH_INTERVAL', 60)
+
+
+def max_age():
+    return getattr(settings, 'MARKET_DATA_MAX_AGE', 60 * 30)
+
+
+def universe_size():
+    return getattr(settings, 'MARKET_DATA_UNIVERSE_SIZE', 500)
+
+
+def fetch_markets_page(page, per_page):
+    params = {
+        'vs_currency': 'usd',
+        'order': 'market_cap_desc',
+        'per_page': per_page,
+        'page': page,
+        'sparkline': False,
+        'price_change_percentage': '24h'
+    }
+    return get_json('/coins/markets', params)
+
+
+def fetch_markets(size):
+    """The top `size` coins by market cap, paging through /coins/markets.
+
+    The first page is fetched alone; when it comes back full, the remaining pages
+    are fetched concurrently. Any failed page fails the whole fetch, so a snapshot
+    never silently loses part of the universe.
+    """
+    per_page = min(size, MAX_PER_PAGE)
+    # A copy: the page is extended below, and a revalidated page comes from the client's cache.
+    markets = list(fetch_markets_page(1, per_page))
+    pages = range(2, math.ceil(size / per_page) + 1)
+    if len(markets) == per_page and pages:
+        results, errors = ConcurrentFetcher().fetch_all(lambda page: fetch_markets_page(page, per_page), pages)
+        if errors:
+            page = min(errors)
+            raise requests.RequestException(f'Markets page {page} failed: {errors[page]}')
+        for page in pages:
+            markets.extend(results[page])
+
+    # Rankings can shift between page requests, so a coin may show up on two pages.
+    unique = {}
+    for crypto in markets:
+        unique.setdefault(crypto.get('id') or id(crypto), crypto)
+    return list(unique.values())[:size]
+
+
+def fetch_markets_snapshot():
+    markets = fetch_markets(universe_size())
+    if not markets:
+        # Keep serving the last good snapshot rather than replace it with an empty one.
+        raise ValueError('CoinGecko returned no markets')
+    transformed_data, coin_map = transform_markets(markets)
+    return MarketSnapshot(data=transformed_data, coin_map=coin_map, fetched_at=time.time())
+
+
+def get_snapshot():
+    if getattr(settings, 'MARKET_DATA_INGESTER', 'thread') == 'thread':
+        ingester.start()
+    snapshot = singleflight.peek(SNAPSHOT_CACHE_KEY)
+    if not isinstance(snapshot, MarketSnapshot) or snapshot.age > max_age():
+        return None
+    return snapshot
+
+
+async def aget_snapshot():
+    if getattr(settings, 'MARKET_DATA_INGESTER', 'thread') == 'thread':
+        ingester.start()
+    snapshot = await singleflight.apeek(SNAPSHOT_CACHE_KEY)
+    if not isinstance(snapshot, MarketSnapshot) or snapshot.age > max_age():
+        return None
+    return snapshot
+
+
+class MarketDataIngester:
+    """Refreshes the markets snapshot on a fixed interval, ahead of its cache expiry."""
+
+    def __init__(self, interval=None, sync_registry=False):
+        self._interval = interval
+        self._sync_registry = sync_registry  # also keep the coin registry up to date
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, 'MARKET_DATA_REFRESH_INTERVAL', 60)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self):
+        # The snapshot counts as fresh for two intervals and is refreshed once less than one
+        # is left, so ingesters in other processes skip a snapshot that was just published.
+        # A single cache.set swaps the whole snapshot, so readers never see a half-written one.
+        try:
+            return singleflight.get_or_refresh(
+                SNAPSHOT_CACHE_KEY,
+                fetch_markets_snapshot,
+                ttl=2 * self.interval,
+                stale_ttl=max_age(),
+                refresh_ahead=self.interval,
+            )
+        except (requests.RequestException, ValueError) as e:
+            logger.error('Error fetching data from CoinGecko: %s', e)
+            return None
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            snapshot = self.refresh()
+            if snapshot is not None and self._sync_registry:
+                # The snapshot's market-cap order breaks ties between coins sharing a symbol.
+                coin_registry.sync_if_due(ranks=coin_registry.market_cap_ranks(snapshot.coin_map))
+            self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='market-data-ingester', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+ingester = MarketDataIngester(sync_registry=True)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Website', '0006_rename_ccrypto_symbol_portfolio_crypto_symbol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coin_id', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('price', models.FloatField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('coin_id', 'date'), name='unique_coin_price_per_day')],
+            },
+        ),
+    ]
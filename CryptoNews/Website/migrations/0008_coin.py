@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Website', '0007_historicalprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Coin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coin_id', models.CharField(max_length=100, unique=True)),
+                ('symbol', models.CharField(db_index=True, max_length=50)),
+                ('name', models.CharField(max_length=200)),
+                ('market_cap_rank', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+        ),
+    ]
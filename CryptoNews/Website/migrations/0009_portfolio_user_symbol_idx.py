@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Website', '0008_coin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['user', 'crypto_symbol'], name='portfolio_user_symbol_idx'),
+        ),
+    ]
@@ -30,5 +30,74 @@ class Portfolio(models.Model):
     purchase_price = models.DecimalField(max_digits=20, decimal_places=2)
     purchase_date = models.DateTimeField(auto_now_add=True)
     crypto_symbol = models.CharField(max_length=10, default='UNKNOWN')
+
+    class Meta:
+        indexes = [
+            # Holdings are always read per user and summed per symbol.
+            models.Index(fields=['user', 'crypto_symbol'], name='portfolio_user_symbol_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.crypto_name}"
+
+class HistoricalPrice(models.Model):
+    coin_id = models.CharField(max_length=100)
+    date = models.DateField()
+    price = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coin_id', 'date'], name='unique_coin_price_per_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.coin_id} {self.date}: {self.price}"
+
+
+class Coin(models.Model):
+    coin_id = models.CharField(max_length=100, unique=True)
+    symbol = models.CharField(max_length=50, db_index=True)
+    name = models.CharField(max_length=200)
+    market_cap_rank = models.PositiveIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.symbol} ({self.coin_id})"
+
+
+class PortfolioSnapshot(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    date = models.DateField()
+    value = models.DecimalField(max_digits=24, decimal_places=2)
+    cost_basis = models.DecimalField(max_digits=24, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            # Also the index every history lookup reads: one user, a range of dates.
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_portfolio_snapshot_per_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.date}: {self.value}"
+
+
+class ProfileCapture(models.Model):
+    """One profiled request; the profile itself is a file in PROFILE_DIR (see Website/profiling.py)."""
+    MODES = [('cprofile', 'cProfile (pstats)'), ('sampling', 'Sampled stacks (collapsed)')]
+    TRIGGERS = [('staff', 'Requested by staff'), ('sample', '1-in-N sampling')]
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    user = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    mode = models.CharField(max_length=10, choices=MODES)
+    trigger = models.CharField(max_length=10, choices=TRIGGERS)
+    filename = models.CharField(max_length=100)
+    summary = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created', '-id']
+
     def __str__(self):
-        return f"{self.user.username} - {self.crypto_name}"
\ No newline at end of file
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
@@ -0,0 +1,119 @@
+"""Pre-encoded JSON bodies for the markets snapshot.
+
+Each snapshot (and each fields/limit projection of it) is serialized once per
+process and kept as bytes, together with its gzip/brotli encodings and a strong
+ETag, so serving the list is a dictionary lookup instead of a JSON dump of
+Decimal-laden dicts.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FIELDS = ('name', 'symbol', 'price', 'price_change_percentage_24h', 'marketcap', 'image')
+MAX_PAYLOADS = 32  # projections kept per process; old snapshots fall out first
+
+
+def dump_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+class EncodedPayload:
+    def __init__(self, body, last_modified):
+        self.body = body
+        self.last_modified = int(last_modified)
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = {None: body}
+        self._lock = threading.Lock()
+
+    def etag(self, encoding=None):
+        # Each content-coding is a different representation, so it gets its own strong ETag.
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def encoded(self, encoding=None):
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == 'br':
+                    self._encoded[encoding] = brotli.compress(self.body, quality=5)
+                else:
+                    self._encoded[encoding] = gzip.compress(self.body, compresslevel=6, mtime=0)
+            return self._encoded[encoding]
+
+
+_payloads = OrderedDict()
+_payloads_lock = threading.Lock()
+
+
+def parse_projection(params):
+    """Read ?fields=a,b and ?limit=n; raises ValueError for values that cannot be served."""
+    fields = None
+    if params.get('fields'):
+        fields = tuple(field.strip() for field in params['fields'].split(',') if field.strip())
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    limit = None
+    if params.get('limit'):
+        try:
+            limit = int(params['limit'])
+        except ValueError:
+            raise ValueError('limit must be a whole number') from None
+        if limit < 0:
+            raise ValueError('limit must not be negative')
+    return fields, limit
+
+
+def snapshot_payload(snapshot, fields=None, limit=None):
+    key = (snapshot.fetched_at, fields, limit)
+    with _payloads_lock:
+        payload = _payloads.get(key)
+        if payload is not None:
+            _payloads.move_to_end(key)
+            return payload
+
+    payload = EncodedPayload(dump_json(snapshot.rows(fields, limit)), snapshot.fetched_at)
+
+    with _payloads_lock:
+        payload = _payloads.setdefault(key, payload)
+        while len(_payloads) > MAX_PAYLOADS:
+            _payloads.popitem(last=False)
+    return payload
+
+
+def accepted_encoding(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, q = part.strip().partition(';')
+        if q.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def payload_response(request, payload):
+    encoding = accepted_encoding(request)
+    response = HttpResponse(payload.encoded(encoding), content_type='application/json')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = payload.etag(encoding)
+    response['Last-Modified'] = http_date(payload.last_modified)
+    # Clients revalidate every time; an unchanged snapshot costs a 304.
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return get_conditional_response(
+        request, etag=response['ETag'], last_modified=payload.last_modified, response=response)
@@ -0,0 +1,150 @@
+"""Daily portfolio values, materialized per user so history is read rather than recomputed.
+
+materialize_snapshots() (run nightly by `manage.py snapshot_portfolios`) values
+every user's holdings on every day from their first purchase: a lot counts from
+its purchase_date on, at the stored price of its coin on that day. Views then
+read any set of days with one query on the (user, date) index, so a chart of a
+year of daily points costs the same as one of four horizons.
+
+Deleting or editing a lot drops its user's snapshots from the lot's purchase
+date on (see discard_lot_snapshots), so no day keeps a value computed from a
+lot as it no longer is; the next run writes those days again.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Max
+from django.db.models.signals import pre_save
+from django.utils import timezone
+
+from .history import history_days, in_background, prices_as_of
+from .models import Portfolio, PortfolioSnapshot
+from .valuation import COST_BASIS, to_money
+
+logger = logging.getLogger('CryptoNews')
+
+BATCH_SIZE = 1000
+LOT_FIELDS = ('crypto_symbol', 'amount_owned', 'purchase_price', 'purchase_date')  # what a snapshot is computed from
+
+
+def _daily_values(lots, coin_index, prices, first_day):
+    """Value and cost basis per day for one user's lots over the days of `prices`."""
+    import numpy as np
+
+    days = prices.shape[1]
+    coins = np.fromiter((coin_index[lot[0]] for lot in lots), dtype=np.intp, count=len(lots))
+    amounts = np.fromiter((lot[1] for lot in lots), dtype=np.float64, count=len(lots))
+    costs = np.fromiter((lot[2] for lot in lots), dtype=np.float64, count=len(lots))
+    # Lots bought before the window are held from its first day.
+    bought = np.fromiter(
+        (max((lot[3] - first_day).days, 0) for lot in lots), dtype=np.intp, count=len(lots))
+
+    # Amount of each coin held at the end of each day: purchases accumulated over time.
+    held = np.zeros((len(coin_index), days))
+    np.add.at(held, (coins, bought), amounts)
+    held = held.cumsum(axis=1)
+    values = (held * np.nan_to_num(prices)).sum(axis=0)
+    cost_basis = np.bincount(bought, weights=costs, minlength=days).cumsum()
+    return values, cost_basis
+
+
+def materialize_snapshots(coin_map, users=None, rebuild=False, today=None):
+    """Write PortfolioSnapshot rows for `users` (default: every holder) up to `today`.
+
+    Each user resumes from their latest stored day (recomputed, as its prices may
+    have moved since) unless `rebuild` is set; nothing older than the price store
+    (PRICE_HISTORY_DAYS) is written. Returns the number of rows written.
+    """
+    today = today or timezone.now().date()
+    earliest = today - timedelta(days=history_days())
+    holdings = Portfolio.objects.all() if users is None else Portfolio.objects.filter(user__in=users)
+
+    lots = {}
+    skipped = set()
+    for user_id, symbol, amount, cost, purchased in (
+            holdings.annotate(cost_basis=COST_BASIS)
+            .values_list('user_id', 'crypto_symbol', 'amount_owned', 'cost_basis', 'purchase_date')):
+        if symbol not in coin_map:
+            skipped.add(symbol)
+            continue
+        if timezone.localdate(purchased) > today:
+            continue
+        lots.setdefault(user_id, []).append((coin_map[symbol], amount, cost, timezone.localdate(purchased)))
+    for symbol in sorted(skipped):
+        logger.warning("No coin id for %s; its lots are left out of portfolio snapshots", symbol)
+    if not lots:
+        return 0
+
+    resume = {} if rebuild else dict(
+        PortfolioSnapshot.objects.filter(user_id__in=lots).values('user_id')
+        .annotate(latest=Max('date')).values_list('user_id', 'latest'))
+    starts = {
+        user_id: max(min(lot[3] for lot in user_lots), resume.get(user_id, earliest), earliest)
+        for user_id, user_lots in lots.items()
+    }
+    first_day = min(starts.values())
+    if first_day > today:
+        return 0
+
+    # One price lookup serves every user: each held coin on each day of the window.
+    coin_ids = sorted({lot[0] for user_lots in lots.values() for lot in user_lots})
+    coin_index = {coin_id: position for position, coin_id in enumerate(coin_ids)}
+    days = [first_day + timedelta(days=offset) for offset in range((today - first_day).days + 1)]
+    prices = prices_as_of(coin_ids, days)
+
+    snapshots = []
+    for user_id, user_lots in lots.items():
+        values, cost_basis = _daily_values(user_lots, coin_index, prices, first_day)
+        for offset in range((starts[user_id] - first_day).days, len(days)):
+            snapshots.append(PortfolioSnapshot(
+                user_id=user_id, date=days[offset],
+                value=to_money(values[offset]), cost_basis=to_money(cost_basis[offset])))
+
+    PortfolioSnapshot.objects.bulk_create(
+        snapshots,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'date'],
+        update_fields=['value', 'cost_basis'],
+    )
+    logger.debug("Stored %s portfolio snapshots for %s users", len(snapshots), len(lots))
+    return len(snapshots)
+
+
+def invalidate_snapshots(user_id, since):
+    """Drop the user's snapshots from `since` on; materialize_snapshots resumes before them."""
+    PortfolioSnapshot.objects.filter(user_id=user_id, date__gte=since).delete()
+
+
+def discard_lot_snapshots(sender, instance, raw=False, **kwargs):
+    # Connected to pre_save and post_delete of Portfolio. An edit can move the purchase
+    # date either way, so the earlier of the old and new dates is where history goes wrong.
+    if raw or instance.pk is None:
+        return
+    since = instance.purchase_date
+    if kwargs.get('signal') is pre_save:
+        stored = Portfolio.objects.filter(pk=instance.pk).values(*LOT_FIELDS).first()
+        if stored is None or all(stored[field] == getattr(instance, field) for field in LOT_FIELDS):
+            return
+        since = min(stored['purchase_date'], instance.purchase_date or stored['purchase_date'])
+    invalidate_snapshots(instance.user_id, timezone.localdate(since))
+
+
+def schedule_snapshots(coin_map, users):
+    # Queued behind any history sync already scheduled, so a new coin's prices are in first.
+    return in_background(materialize_snapshots, coin_map, users)
+
+
+def valuation_history(user, dates):
+    """{date: value} for each of `dates`, read with one range query on the snapshot index.
+
+    A day without a snapshot is worth nothing: the user held no coins yet, or
+    the nightly job has not reached it.
+    """
+    if not dates:
+        return {}
+    stored = dict(
+        PortfolioSnapshot.objects.filter(user=user, date__gte=min(dates), date__lte=max(dates))
+        .values_list('date', 'value'))
+    return {day: stored.get(day, Decimal('0.00')) for day in dates}
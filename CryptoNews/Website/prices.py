@@ -0,0 +1,163 @@
+"""Batched current-price resolution for portfolio holdings."""
+import logging
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .coalesce import singleflight
+from .coin_registry import acoin_map, coin_map as registry_coin_map
+from .history import prices_as_of
+from .market_data import aget_snapshot, get_snapshot, sanitize_price
+from .upstream import aget_json, get_json
+
+logger = logging.getLogger('CryptoNews')
+
+
+class ResolvedPrices(dict):
+    """{symbol: Decimal price}; `stale` holds the symbols priced from data that is no longer current."""
+
+    def __init__(self, prices=(), stale=()):
+        super().__init__(prices)
+        self.stale = set(stale)
+
+
+def price_ttl():
+    return getattr(settings, 'PRICE_CACHE_TTL', 300)
+
+
+def _price_key(symbol):
+    return f'price:{symbol}'
+
+
+def _fetch_simple_prices(coin_ids):
+    def load():
+        params = {
+            'ids': ','.join(coin_ids),
+            'vs_currencies': 'usd'
+        }
+        return get_json('/simple/price', params)
+
+    return singleflight.get_or_refresh(f"simple_price:{','.join(coin_ids)}", load, ttl=price_ttl())
+
+
+async def _afetch_simple_prices(coin_ids):
+    async def load():
+        params = {
+            'ids': ','.join(coin_ids),
+            'vs_currencies': 'usd'
+        }
+        return await aget_json('/simple/price', params)
+
+    return await singleflight.aget_or_refresh(f"simple_price:{','.join(coin_ids)}", load, ttl=price_ttl())
+
+
+def _snapshot_prices(symbols, crypto_data):
+    return {crypto['symbol']: crypto['price'] for crypto in crypto_data if crypto['symbol'] in symbols}
+
+
+def _cached_prices(symbols, cached):
+    return {symbol: cached[_price_key(symbol)] for symbol in symbols if _price_key(symbol) in cached}
+
+
+def _add_last_known_prices(prices, symbols, coin_map):
+    # CoinGecko is unavailable: fall back to each coin's latest stored daily price, at most
+    # PRICE_HISTORY_MAX_GAP_DAYS old, so holdings keep a value instead of dropping to $0.
+    import numpy as np
+
+    symbols = list(symbols)
+    latest = prices_as_of([coin_map[symbol] for symbol in symbols], [timezone.now().date()])[:, 0]
+    for symbol, price in zip(symbols, latest.tolist()):
+        if not np.isnan(price):
+            prices[symbol] = sanitize_price(price)
+            prices.stale.add(symbol)
+
+
+def _add_fetched_prices(prices, symbols, coin_map, fetched):
+    """Add the fetched prices to `prices` and return the entries to cache."""
+    new_entries = {}
+    for symbol in symbols:
+        usd = fetched.get(coin_map[symbol], {}).get('usd')
+        if usd is not None:
+            prices[symbol] = new_entries[_price_key(symbol)] = sanitize_price(usd)
+    return new_entries
+
+
+def resolve_prices(symbols, crypto_data=None, coin_map=None, stale=False):
+    """Return ResolvedPrices ({symbol: Decimal price}) for every symbol that could be priced.
+
+    Pass the symbols of a whole request (or of many users at once). Prices come from
+    the markets snapshot when it has them, then from the per-symbol cache, and the
+    rest are fetched with a single /simple/price call. Symbols outside the snapshot
+    are mapped to coin ids through the coin registry. When that call fails, the
+    local price history stands in. Pass `stale` when `crypto_data` comes from a
+    stale snapshot; prices from stale sources are listed in the result's `stale`.
+    """
+    symbols = set(symbols)
+    if crypto_data is None or coin_map is None:
+        snapshot = get_snapshot()
+        if crypto_data is None:
+            crypto_data = snapshot.rows_for(symbols) if snapshot else []
+            stale = snapshot is not None and snapshot.stale
+        if coin_map is None:
+            coin_map = registry_coin_map(snapshot.coin_map if snapshot else {})
+
+    prices = ResolvedPrices(_snapshot_prices(symbols, crypto_data))
+    if stale:
+        prices.stale.update(prices)
+    remaining = symbols - prices.keys()
+    if not remaining:
+        return prices
+
+    prices.update(_cached_prices(remaining, cache.get_many([_price_key(symbol) for symbol in remaining])))
+    remaining = [symbol for symbol in remaining if symbol not in prices and coin_map.get(symbol)]
+    if not remaining:
+        return prices
+
+    coin_ids = sorted(set(coin_map[symbol] for symbol in remaining))
+    try:
+        fetched = _fetch_simple_prices(coin_ids)
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Error fetching current prices: %s", e)
+        _add_last_known_prices(prices, remaining, coin_map)
+        return prices
+
+    cache.set_many(_add_fetched_prices(prices, remaining, coin_map, fetched), timeout=price_ttl())
+    return prices
+
+
+async def aresolve_prices(symbols, crypto_data=None, coin_map=None, stale=False):
+    """Async resolve_prices: the same lookup order over the async cache and HTTP client."""
+    symbols = set(symbols)
+    if crypto_data is None or coin_map is None:
+        snapshot = await aget_snapshot()
+        if crypto_data is None:
+            crypto_data = snapshot.rows_for(symbols) if snapshot else []
+            stale = snapshot is not None and snapshot.stale
+        if coin_map is None:
+            coin_map = await acoin_map(snapshot.coin_map if snapshot else {})
+
+    prices = ResolvedPrices(_snapshot_prices(symbols, crypto_data))
+    if stale:
+        prices.stale.update(prices)
+    remaining = symbols - prices.keys()
+    if not remaining:
+        return prices
+
+    prices.update(_cached_prices(remaining, await cache.aget_many([_price_key(symbol) for symbol in remaining])))
+    remaining = [symbol for symbol in remaining if symbol not in prices and coin_map.get(symbol)]
+    if not remaining:
+        return prices
+
+    coin_ids = sorted(set(coin_map[symbol] for symbol in remaining))
+    try:
+        fetched = await _afetch_simple_prices(coin_ids)
+    except (requests.RequestException, ValueError) as e:
+        logger.error("Error fetching current prices: %s", e)
+        await sync_to_async(_add_last_known_prices)(prices, remaining, coin_map)
+        return prices
+
+    await cache.aset_many(_add_fetched_prices(prices, remaining, coin_map, fetched), timeout=price_ttl())
+    return prices
@@ -0,0 +1,270 @@
+"""Opt-in profiling of single requests, kept in a bounded ring buffer on disk.
+
+ProfilingMiddleware profiles a request when a staff user asks for it, with an
+`X-Profile` header or a `?profile=` flag, or for one in PROFILE_SAMPLE_RATE
+requests. `1` (or any other value) runs cProfile and stores a pstats file;
+`sample` runs StackSampler instead and stores collapsed stacks that
+flamegraph.pl or speedscope read directly. Sampled requests always use the
+sampler, whose overhead is small enough to leave on.
+
+Each capture is a ProfileCapture row, browsable in the admin, plus its file
+in PROFILE_DIR; only the newest PROFILE_MAX_CAPTURES are kept. One request is
+profiled at a time per process, so a capture never measures another's
+profiler. Under ASGI the middleware stays async and profiles both the event
+loop and the thread the request's sync code runs on, so a capture there may
+also include other requests' coroutines. From Python 3.12 a single cProfile
+sees every thread (and is the only one allowed), so it is enabled once.
+"""
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .models import ProfileCapture
+
+logger = logging.getLogger('CryptoNews')
+
+SUMMARY_LINES = 25
+# From 3.12 cProfile hooks sys.monitoring: one profiler sees every thread, and a second is refused.
+PER_THREAD_PROFILER = sys.version_info < (3, 12)
+
+_capturing = threading.Lock()
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def max_captures():
+    return getattr(settings, 'PROFILE_MAX_CAPTURES', 50)
+
+
+def sample_rate():
+    return getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+
+
+def capture_path(capture):
+    return os.path.join(profile_dir(), capture.filename)
+
+
+class StackSampler:
+    """Records the stacks of some threads every `interval` seconds, as collapsed-stack counts."""
+
+    def __init__(self, *thread_ids, interval=None):
+        self.thread_ids = set(thread_ids)
+        self.interval = interval or getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005)
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            names.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[self._stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def collapsed(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def sampled_summary(stacks):
+    # Functions by the share of samples they were on the stack for.
+    total = sum(stacks.values())
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        for name in set(stack.split(';')):
+            inclusive[name] += count
+    lines = [f'{total} samples']
+    lines += [f'{count / total:6.1%}  {name}' for name, count in inclusive.most_common(SUMMARY_LINES)]
+    return '\n'.join(lines)
+
+
+def cprofile_summary(*profilers):
+    stream = io.StringIO()
+    pstats.Stats(*profilers, stream=stream).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return stream.getvalue().strip()
+
+
+def save_capture(request, response, trigger, mode, duration, write, summary):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.{'prof' if mode == 'cprofile' else 'collapsed'}"
+    write(os.path.join(directory, filename))
+    user = getattr(request, 'user', None)
+    capture = ProfileCapture.objects.create(
+        method=request.method,
+        path=request.get_full_path()[:500],
+        user=user if user is not None and user.is_authenticated else None,
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        mode=mode,
+        trigger=trigger,
+        filename=filename,
+        summary=summary,
+    )
+    prune()
+    return capture
+
+
+def prune(limit=None):
+    """Drop the oldest captures beyond PROFILE_MAX_CAPTURES, files included."""
+    limit = max_captures() if limit is None else limit
+    stale = ProfileCapture.objects.values_list('pk', flat=True)[limit:]
+    ProfileCapture.objects.filter(pk__in=list(stale)).delete()
+
+
+def remove_capture_file(sender, instance, **kwargs):
+    # Connected to post_delete, so captures deleted in the admin take their file with them.
+    try:
+        os.remove(capture_path(instance))
+    except FileNotFoundError:
+        pass
+
+
+class Capture:
+    """One request's profile, collected on every thread that calls enter()."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.perf_counter()
+        self._profilers = {}
+        self._enabled = set()
+        self._sampler = StackSampler().start() if mode == 'sampling' else None
+
+    def enter(self):
+        if self._sampler is not None:
+            self._sampler.thread_ids.add(threading.get_ident())
+            return
+        # Before 3.12 cProfile only sees the thread it was enabled on, and must be disabled there too.
+        key = threading.get_ident() if PER_THREAD_PROFILER else None
+        if key in self._profilers:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:  # another profiler, e.g. a debugger's, is already running
+            logger.warning('Could not start cProfile: %s', e)
+            return
+        self._profilers[key] = profiler
+        self._enabled.add(key)
+
+    def exit(self):
+        key = threading.get_ident() if PER_THREAD_PROFILER else None
+        if key in self._enabled:
+            self._profilers[key].disable()
+            self._enabled.discard(key)
+
+    def finish(self):
+        """(duration, write, summary) once every thread has exited."""
+        duration = time.perf_counter() - self.started
+        if self._sampler is None:
+            profilers = list(self._profilers.values())
+            return duration, pstats.Stats(*profilers).dump_stats, cprofile_summary(*profilers)
+        stacks = self._sampler.stop()
+
+        def write(path):
+            with open(path, 'w') as f:
+                f.write(collapsed(stacks))
+        summary = sampled_summary(stacks) if stacks else 'No samples: the request finished within one interval.'
+        return duration, write, summary
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._requests = itertools.count(1)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def requested(self, request, is_staff=None):
+        """(trigger, mode) when this request should be profiled, else (None, None)."""
+        flag = request.headers.get('X-Profile') or request.GET.get('profile')
+        if flag and (request.user.is_staff if is_staff is None else is_staff):
+            return 'staff', 'sampling' if flag == 'sample' else 'cprofile'
+        rate = sample_rate()
+        if rate and next(self._requests) % rate == 0:
+            return 'sample', 'sampling'
+        return None, None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger, mode = self.requested(request)
+        if trigger is None or not _capturing.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            capture = Capture(mode)
+            try:
+                capture.enter()
+                response = self.get_response(request)
+            finally:
+                capture.exit()
+            return self.store(request, response, trigger, capture)
+        finally:
+            _capturing.release()
+
+    async def __acall__(self, request):
+        # request.user would query the database on the event loop; auser() does not.
+        is_staff = False
+        if request.headers.get('X-Profile') or request.GET.get('profile'):
+            is_staff = (await request.auser()).is_staff
+        trigger, mode = self.requested(request, is_staff)
+        if trigger is None or not _capturing.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            capture = Capture(mode)
+            try:
+                # Async views run on this thread, sync ones on the request's thread-sensitive executor.
+                capture.enter()
+                await sync_to_async(capture.enter)()
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(capture.exit)()
+                capture.exit()
+            return await sync_to_async(self.store)(request, response, trigger, capture)
+        finally:
+            _capturing.release()
+
+    def store(self, request, response, trigger, capture):
+        duration, write, summary = capture.finish()
+        try:
+            saved = save_capture(request, response, trigger, capture.mode, duration, write, summary)
+        except OSError as e:
+            logger.error('Could not store the profile of %s: %s', request.path, e)
+            return response
+        if trigger == 'staff':
+            response['X-Profile-Id'] = str(saved.pk)
+        return response
@@ -0,0 +1,112 @@
+"""Coin autocomplete over the coin registry.
+
+The index holds one entry per symbol (the coin the registry resolves it to),
+numbered in market-cap order, so every posting list is already sorted by rank
+and the top matches are its first entries. Short queries are answered from
+prefix postings of the symbol and of each word of the name; longer ones filter
+the postings of their first PREFIX_LENGTH characters, and substrings fall back
+to trigram postings. The index is rebuilt only when the registry is reloaded.
+"""
+import re
+import threading
+
+from .coin_registry import get_registry
+
+PREFIX_LENGTH = 4  # longest prefix with its own posting list
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_word = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    return ' '.join(_word.findall(text.lower()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CoinSearchIndex:
+    def __init__(self, registry):
+        self.registry = registry
+        entries = sorted(
+            registry.coin_ids.items(),
+            key=lambda item: (item[1] not in registry.ranks, registry.ranks.get(item[1], 0), item[0]))
+        self.entries = []  # (symbol, name, coin id), best market cap first
+        self._tokens = []  # per entry: the strings a query may be a prefix of
+        self._haystacks = []  # per entry: 'symbol name', for substring matches
+        self._symbols = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        for position, (symbol, coin_id) in enumerate(entries):
+            name = registry.name(coin_id) or coin_id
+            self.entries.append((symbol, name, coin_id))
+            self._symbols[symbol.lower()] = position
+            words = normalize(name)
+            tokens = {symbol.lower(), words, *words.split()}
+            tokens.discard('')
+            self._tokens.append(tokens)
+            for prefix in {token[:length] for token in tokens for length in range(1, PREFIX_LENGTH + 1)}:
+                self._prefixes.setdefault(prefix, []).append(position)
+            haystack = f'{symbol.lower()} {words}'
+            self._haystacks.append(haystack)
+            for trigram in trigrams(haystack):
+                self._trigrams.setdefault(trigram, []).append(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefix_matches(self, query):
+        postings = self._prefixes.get(query[:PREFIX_LENGTH], ())
+        if len(query) <= PREFIX_LENGTH:
+            return postings
+        return (position for position in postings
+                if any(token.startswith(query) for token in self._tokens[position]))
+
+    def _substring_matches(self, query):
+        postings = sorted((self._trigrams.get(trigram, ()) for trigram in trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return sorted(position for position in candidates if query in self._haystacks[position])
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Up to `limit` coins matching `query`: an exact symbol first, then prefixes, then substrings."""
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+        found = dict.fromkeys([self._symbols[query]] if query in self._symbols else [])
+        for position in self._prefix_matches(query):
+            if len(found) >= limit:
+                break
+            found.setdefault(position)
+        if len(found) < limit and len(query) >= 3:
+            for position in self._substring_matches(query):
+                if len(found) >= limit:
+                    break
+                found.setdefault(position)
+        return [
+            {'symbol': symbol, 'name': name, 'id': coin_id}
+            for symbol, name, coin_id in (self.entries[position] for position in found)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    global _index
+    registry = get_registry()
+    index = _index
+    if index is not None and index.registry is registry:
+        return index
+    with _index_lock:
+        if _index is None or _index.registry is not registry:
+            _index = CoinSearchIndex(registry)
+        return _index
+
+
+def search_coins(query, limit=DEFAULT_LIMIT):
+    return get_search_index().search(query, limit)
@@ -0,0 +1,239 @@
+"""Server-Sent Events fan-out of the markets snapshot.
+
+One broadcaster thread per process watches the snapshot and turns each change
+into a single encoded event: a full `snapshot` when the set of coins changes,
+otherwise a `delta` with only the prices and 24h changes that moved. Only the
+top HOME_COIN_LIMIT coins, the ones the home page shows, are streamed. Every
+subscriber receives the same bytes, so the cost of a change does not depend on
+how many clients are connected.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .market_data import get_snapshot
+
+logger = logging.getLogger('CryptoNews')
+
+HOME_FIELDS = ('symbol', 'name', 'image', 'price', 'price_change_percentage_24h', 'marketcap')  # what home.html renders
+DELTA_FIELDS = ('price', 'price_change_percentage_24h')
+MAX_PENDING_EVENTS = 100  # a subscriber further behind than this is disconnected
+RETRY_MS = 5000  # how long browsers wait before reconnecting
+HEARTBEAT = b': keep-alive\n\n'  # an SSE comment keeps idle connections open through proxies
+CLOSED = object()
+
+
+def poll_interval():
+    return getattr(settings, 'PRICE_STREAM_POLL_INTERVAL', 1)
+
+
+def heartbeat_interval():
+    return getattr(settings, 'PRICE_STREAM_HEARTBEAT', 15)
+
+
+def home_coin_limit():
+    return getattr(settings, 'HOME_COIN_LIMIT', 30)
+
+
+def encode_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription:
+    """A blocking queue of encoded events, for sync (WSGI) responses."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        try:
+            self._queue.put_nowait(CLOSED)
+        except queue.Full:
+            pass
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """An asyncio queue of encoded events, fed from the broadcaster thread without a thread per client."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def deliver(self, event):
+        if self._queue.full():
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:  # the client's event loop is gone
+            return False
+        return True
+
+    def close(self):
+        try:
+            self._loop.call_soon_threadsafe(self._put, CLOSED)
+        except RuntimeError:
+            pass
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class PriceBroadcaster:
+    def __init__(self, interval=None):
+        self._interval = interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._prices = None  # {symbol: (price, change)} of the last published snapshot
+        self._fetched_at = None
+        self.snapshot_event = None
+        self.events_published = 0
+
+    @property
+    def interval(self):
+        return self._interval if self._interval is not None else poll_interval()
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self, subscription):
+        """Register `subscription` and return the full snapshot event it should start from (or None)."""
+        if not self._polling():
+            # Nobody was watching, so the cached event may be old. As in run(), the snapshot
+            # is read before taking the lock, which other subscribers must not wait behind.
+            self._check()
+        with self._lock:
+            if not self._polling():
+                self._thread = threading.Thread(target=self.run, name='price-stream', daemon=True)
+                self._thread.start()
+            self._subscribers.add(subscription)
+            return self.snapshot_event
+
+    def _polling(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            # Reading the snapshot may hit the cache backend; subscribers must not wait on it.
+            try:
+                event = self._check()
+            except Exception as e:
+                logger.error('Price stream update failed: %s', e)
+                continue
+            if event is not None:
+                with self._lock:
+                    self._publish(event)
+
+    def poke(self):
+        # Check the snapshot now instead of at the next interval.
+        self._wake.set()
+
+    def events(self):
+        """Sync generator of SSE bytes for one client, for WSGI responses."""
+        subscription = Subscription()
+        initial = self.subscribe(subscription)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'.encode('utf-8')
+            if initial is not None:
+                yield initial
+            while True:
+                event = subscription.get(timeout=heartbeat_interval())
+                if event is CLOSED:
+                    return
+                yield HEARTBEAT if event is None else event
+        finally:
+            self.unsubscribe(subscription)
+
+    async def aevents(self):
+        """Async generator of SSE bytes for one client, for ASGI responses."""
+        subscription = AsyncSubscription()
+        initial = self.subscribe(subscription)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'.encode('utf-8')
+            if initial is not None:
+                yield initial
+            while True:
+                event = await subscription.get(timeout=heartbeat_interval())
+                if event is CLOSED:
+                    return
+                yield HEARTBEAT if event is None else event
+        finally:
+            self.unsubscribe(subscription)
+
+    def _publish(self, event):
+        self.events_published += 1
+        for subscription in list(self._subscribers):
+            if not subscription.deliver(event):
+                logger.warning('Disconnecting a price stream subscriber that fell behind')
+                self._subscribers.discard(subscription)
+                subscription.close()
+
+    def _check(self):
+        """Compare the current snapshot with the last one and return the event to publish, if any."""
+        snapshot = get_snapshot()
+        if snapshot is None or snapshot.fetched_at == self._fetched_at:
+            return None
+        limit = home_coin_limit()
+        prices = dict(zip(snapshot.column('symbol')[:limit],
+                          zip(*(snapshot.column(field)[:limit] for field in DELTA_FIELDS))))
+        previous, self._prices, self._fetched_at = self._prices, prices, snapshot.fetched_at
+        self.snapshot_event = encode_event('snapshot', snapshot.rows(HOME_FIELDS, limit), event_id=snapshot.fetched_at)
+
+        if previous is None or list(previous) != list(prices):
+            return self.snapshot_event
+        changes = [
+            {'symbol': symbol, **dict(zip(DELTA_FIELDS, values))}
+            for symbol, values in prices.items() if previous[symbol] != values
+        ]
+        if not changes:
+            return None
+        return encode_event('delta', changes, event_id=snapshot.fetched_at)
+
+
+broadcaster = PriceBroadcaster()
+
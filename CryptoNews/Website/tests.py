@@ -1,3 +1,1519 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import os
+import pickle
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import async_views, coin_registry, fetcher, instrumentation, logs, payloads, profiling, upstream, views
+from .chart_cache import LRUByteCache, images as chart_images
+from .coalesce import SingleFlight, singleflight
+from .coin_registry import CoinIndex, get_registry, sync_registry
+from .fake_coingecko import FakeCoinGecko, historical_price_for, load_fixtures, make_markets, price_for
+from .fetcher import ConcurrentFetcher, RateLimited, TokenBucket
+from .history import prices_as_of, sync_coin_history, sync_history
+from .market_data import SNAPSHOT_CACHE_KEY, MarketDataIngester, MarketSnapshot, fetch_markets, get_snapshot
+from .models import Coin, CustomUser, HistoricalPrice, Portfolio, PortfolioSnapshot, ProfileCapture
+from .portfolio_history import materialize_snapshots
+from .prices import aresolve_prices, resolve_prices
+from .search import CoinSearchIndex, get_search_index, search_coins
+from .upstream import UpstreamClient
+from .valuation import holding_rows, lot_rows, value_portfolio
+from .stream import PriceBroadcaster
+from .tiered_cache import TieredCache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class FakeUpstreamMixin:
+    """A FakeCoinGecko behind COINGECKO_API_URL, and market snapshots published without it."""
+
+    def start_upstream(self, **options):
+        self.upstream = FakeCoinGecko(**options).start()
+        self.addCleanup(self.upstream.stop)
+        # Every upstream call draws from the process-wide rate limit: each test starts with a full one.
+        fresh_bucket = mock.patch.object(fetcher, '_coingecko_bucket', None)
+        fresh_bucket.start()
+        self.addCleanup(fresh_bucket.stop)
+        settings_override = self.settings(COINGECKO_API_URL=self.upstream.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return self.upstream
+
+    def seed_snapshot(self, data=None, coin_map=None, fetched_at=None):
+        """Publish a snapshot in place of any cached one; by default C1 at 1000."""
+        if data is None:
+            data = [{'symbol': 'C1', 'price': Decimal('1000')}]
+        snapshot = MarketSnapshot(
+            data, {'C1': 'coin-1'} if coin_map is None else coin_map, time.time() if fetched_at is None else fetched_at)
+        cache.delete(SNAPSHOT_CACHE_KEY)
+        singleflight.get_or_refresh(SNAPSHOT_CACHE_KEY, lambda: snapshot, ttl=60)
+        return snapshot
+
+@override_settings(MARKET_DATA_INGESTER='command')
+class MarketDataIngesterTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream(latency=0.3)
+
+    def test_refresh_publishes_snapshot(self):
+        self.assertIsNone(get_snapshot())
+
+        snapshot = MarketDataIngester().refresh()
+
+        self.assertIsInstance(snapshot, MarketSnapshot)
+        self.assertEqual(len(snapshot.data), 30)
+        self.assertEqual(snapshot.coin_map['C1'], 'coin-1')
+        self.assertEqual(get_snapshot(), snapshot)
+
+    def test_views_only_read_the_snapshot(self):
+        response = self.client.get('/api/crypto-data/')
+
+        self.assertEqual(response.json(), [])
+        self.assertEqual(self.upstream.calls['/coins/markets'], 0)
+
+    @override_settings(MARKET_DATA_UNIVERSE_SIZE=600)
+    def test_universe_beyond_one_page_is_fetched_in_pages(self):
+        self.upstream.markets = make_markets(700)
+        self.upstream.latency = 0
+
+        snapshot = MarketDataIngester().refresh()
+
+        self.assertEqual(len(snapshot), 600)
+        self.assertEqual(snapshot.coin_map['C600'], 'coin-600')
+        self.assertEqual(sorted((params['page'], params['per_page']) for _, params in self.upstream.requests),
+                         [('1', '250'), ('2', '250'), ('3', '250')])
+
+    @override_settings(MARKET_DATA_UNIVERSE_SIZE=300)
+    def test_coins_shifting_between_pages_are_counted_once(self):
+        markets = make_markets(300)
+        self.upstream.markets = markets[:250] + markets[249:]
+        self.upstream.latency = 0
+
+        snapshot = MarketDataIngester().refresh()
+
+        self.assertEqual(len(snapshot), 300)
+        self.assertEqual(len(set(snapshot.column('symbol'))), 300)
+
+    def test_revalidated_first_page_still_fetches_the_later_ones(self):
+        self.upstream.markets = make_markets(600)
+        self.upstream.latency = 0
+        self.upstream.etags = True
+        fetch_markets(600)
+
+        self.upstream.markets[300] = {**self.upstream.markets[300], 'current_price': 12345}
+        markets = fetch_markets(600)
+
+        self.assertEqual(self.upstream.calls['/coins/markets'], 6)
+        self.assertEqual(self.upstream.not_modified, 2)  # pages 1 and 3
+        self.assertEqual(len(markets), 600)
+        self.assertEqual(markets[300]['current_price'], 12345)
+
+    def test_snapshot_is_stored_column_wise(self):
+        snapshot = MarketSnapshot([{'symbol': 'C1', 'price': Decimal('1')}, {'symbol': 'C2', 'name': 'Coin 2'}], {}, 1.0)
+
+        self.assertEqual(snapshot.columns, {'symbol': ('C1', 'C2'), 'price': (Decimal('1'), None), 'name': (None, 'Coin 2')})
+        self.assertEqual(snapshot.rows(['symbol'], limit=1), [{'symbol': 'C1'}])
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot)), snapshot)
+
+    def test_requests_are_served_while_the_snapshot_refreshes(self):
+        ingester = MarketDataIngester(interval=0.1)
+        ingester.refresh()
+        ingester.start()
+        self.addCleanup(ingester.stop, 5)
+
+        served_during_refresh = 0
+        deadline = time.monotonic() + 10  # only a guard against a stuck ingester
+        while self.upstream.calls['/coins/markets'] < 4 and time.monotonic() < deadline:
+            refreshing = self.upstream.in_flight
+            response = self.client.get('/api/crypto-data/')
+            self.assertEqual(len(response.json()), 30)
+            served_during_refresh += bool(refreshing and self.upstream.in_flight)
+            time.sleep(0.02)
+
+        # Requests are answered while the ingester waits on CoinGecko, and never call it themselves.
+        self.assertGreaterEqual(self.upstream.calls['/coins/markets'], 4)
+        self.assertGreater(served_during_refresh, 0)
+        self.assertEqual(self.upstream.max_in_flight, 1)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight()
+        self.calls = 0
+
+    def slow_loader(self, value='fresh'):
+        def load():
+            self.calls += 1
+            time.sleep(0.2)
+            return value
+        return load
+
+    def run_concurrently(self, count, target):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_cold_misses_share_one_call(self):
+        results = self.run_concurrently(
+            10, lambda: self.flight.get_or_refresh('prices:btc', self.slow_loader(), ttl=60))
+
+        self.assertEqual(results, ['fresh'] * 10)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.stats()['prices'], {'leader': 1, 'coalesced': 9})
+
+    def test_stale_value_served_while_leader_refreshes(self):
+        self.flight.get_or_refresh('prices:btc', lambda: 'old', ttl=0, stale_ttl=60)
+
+        results = self.run_concurrently(
+            5, lambda: self.flight.get_or_refresh('prices:btc', self.slow_loader('new'), ttl=60, stale_ttl=60))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), ['new'] + ['old'] * 4)
+        self.assertEqual(self.flight.peek('prices:btc'), 'new')
+
+    def test_failed_refresh_keeps_serving_stale_value(self):
+        self.flight.get_or_refresh('prices:btc', lambda: 'old', ttl=0, stale_ttl=60)
+
+        def fail():
+            raise ValueError('upstream down')
+
+        self.assertEqual(self.flight.get_or_refresh('prices:btc', fail, ttl=60), 'old')
+        self.assertEqual(self.flight.stats()['prices']['stale_on_error'], 1)
+
+
+@override_settings(MARKET_DATA_INGESTER='command')
+class PriceResolutionTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream(markets=[])
+        self.crypto_data = [{'symbol': 'C1', 'price': Decimal('1000')}]
+        self.coin_map = {'C1': 'coin-1', 'C2': 'coin-2', 'C4': 'coin-4', 'C5': 'coin-5'}
+
+    def test_snapshot_prices_need_no_upstream_call(self):
+        prices = resolve_prices(['C1'], self.crypto_data, self.coin_map)
+
+        self.assertEqual(prices, {'C1': Decimal('1000')})
+        self.assertEqual(self.upstream.calls['/simple/price'], 0)
+
+    def test_missing_symbols_fetched_in_one_call_and_cached_per_symbol(self):
+        prices = resolve_prices(['C1', 'C2', 'C4'], self.crypto_data, self.coin_map)
+
+        self.assertEqual(prices, {'C1': Decimal('1000'), 'C2': Decimal('500.0'), 'C4': Decimal('250.0')})
+        self.assertEqual(self.upstream.calls['/simple/price'], 1)
+
+        # A later request for a different combination reuses the per-symbol entries.
+        prices = resolve_prices(['C2', 'C5'], self.crypto_data, self.coin_map)
+
+        self.assertEqual(prices, {'C2': Decimal('500.0'), 'C5': Decimal('200.0')})
+        self.assertEqual(self.upstream.calls['/simple/price'], 2)
+        self.assertEqual(cache.get('price:C4'), Decimal('250.0'))
+
+    def test_portfolio_view_prices_every_holding_in_one_pass(self):
+        self.seed_snapshot(self.crypto_data, self.coin_map)
+        user = CustomUser.objects.create_user(username='holder', email='holder@example.com', phone_number='1', password='pw')
+        for symbol in ['C1', 'C2', 'C4', 'C5']:
+            Portfolio.objects.create(user=user, crypto_symbol=symbol, crypto_name=symbol, amount_owned=1, purchase_price=100)
+        self.client.force_login(user)
+
+        response = self.client.get('/portfolio/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.upstream.calls['/simple/price'], 1)
+        self.assertEqual(
+            {entry['crypto_symbol']: entry['current_price'] for entry in response.context['portfolio_data']},
+            {'C1': Decimal('1000'), 'C2': Decimal('500.0'), 'C4': Decimal('250.0'), 'C5': Decimal('200.0')})
+
+    @override_settings(HOME_COIN_LIMIT=5)
+    def test_portfolio_views_build_only_the_held_coins_rows(self):
+        market = [{'name': f'Coin {rank}', 'symbol': f'C{rank}', 'price': Decimal(rank)} for rank in range(1, 101)]
+        self.seed_snapshot(market, {row['symbol']: f"coin-{row['symbol'][1:]}" for row in market})
+        user = CustomUser.objects.create_user(username='holder', email='holder@example.com', phone_number='1', password='pw')
+        Portfolio.objects.create(user=user, crypto_symbol='C40', crypto_name='Coin 40', amount_owned=2, purchase_price=10)
+        self.client.force_login(user)
+
+        with mock.patch.object(MarketSnapshot, 'data', new_callable=mock.PropertyMock, side_effect=AssertionError), \
+                mock.patch.object(views, 'schedule_sync'), mock.patch.object(views, 'schedule_snapshots'):
+            page = self.client.get('/portfolio/?charts=client')
+            data = self.client.get('/api/portfolio/').json()
+            self.client.post('/add_to_portfolio/', {'crypto_symbol': 'C70', 'amount_owned': 1, 'purchase_price': 10})
+            self.client.get(f"/delete_portfolio/{Portfolio.objects.get(crypto_symbol='C40').pk}/")
+
+        self.assertEqual(page.context['total_value'], Decimal('80.00'))
+        self.assertEqual([row['current_value'] for row in data['portfolio']], ['80.00'])
+        self.assertEqual([row['symbol'] for row in data['data']], ['C1', 'C2', 'C3', 'C4', 'C5'])
+        self.assertEqual(list(Portfolio.objects.values_list('crypto_symbol', 'crypto_name')), [('C70', 'Coin 70')])
+        self.assertEqual(self.upstream.calls['/simple/price'], 0)
+
+
+class ValuationTests(TestCase):
+    def lots(self):
+        return [
+            (1, 'Coin 1', 'C1', Decimal('2'), Decimal('500'), Decimal('1000')),
+            (2, 'Coin 2', 'C2', Decimal('4'), Decimal('100'), Decimal('400')),
+            (3, 'Coin 1', 'C1', Decimal('1'), Decimal('1500'), Decimal('1500')),
+            (4, 'Airdrop', 'C2', Decimal('1'), Decimal('0'), Decimal('0')),
+        ]
+
+    def test_totals_weights_and_entries_in_one_pass(self):
+        valuation = value_portfolio(self.lots(), {'C1': Decimal('1000'), 'C2': Decimal('50')})
+
+        self.assertEqual(valuation.total_value, Decimal('3250.00'))
+        self.assertEqual(valuation.total_cost, Decimal('2900.00'))
+        self.assertEqual(valuation.total_profit_loss, Decimal('350.00'))
+        self.assertEqual(valuation.total_profit_loss_percentage, Decimal('12.07'))
+        self.assertEqual([entry['id'] for entry in valuation.entries], [1, 3, 2, 4])
+        self.assertEqual(valuation.entries[0]['profit_loss_percentage'], Decimal('100.00'))
+        self.assertEqual(valuation.entries[1]['profit_loss'], Decimal('-500.00'))
+        self.assertAlmostEqual(sum(entry['weight'] for entry in valuation.entries), 1.0)
+        # A lot bought for nothing has no meaningful percentage gain.
+        self.assertIsNone(valuation.entries[3]['profit_loss_percentage'])
+
+    def test_entries_are_rounded_to_cents_like_the_totals(self):
+        lots = [(1, 'Coin 1', 'C1', Decimal('0.333'), Decimal('3.01'), Decimal('1.00233'))]
+        valuation = value_portfolio(lots, {'C1': Decimal('3.0123')})
+
+        entry = valuation.entries[0]
+        self.assertEqual(entry['current_value'], valuation.total_value)
+        self.assertEqual(entry['cost_basis'], valuation.total_cost)
+        self.assertEqual(entry['profit_loss'], valuation.total_profit_loss)
+        self.assertEqual(entry['profit_loss_percentage'], valuation.total_profit_loss_percentage)
+        self.assertEqual([str(entry[key]) for key in ('current_value', 'profit_loss')], ['1.00', '0.00'])
+
+    def test_allocation_sums_lots_per_symbol(self):
+        valuation = value_portfolio(self.lots(), {'C1': Decimal('1000'), 'C2': Decimal('50')})
+
+        self.assertEqual(valuation.allocation(), [{'symbol': 'C1', 'value': 3000.0}, {'symbol': 'C2', 'value': 250.0}])
+
+    def test_lots_without_a_price_are_left_out(self):
+        valuation = value_portfolio(self.lots(), {'C1': Decimal('1000')})
+
+        self.assertEqual(valuation.missing, ['C2'])
+        self.assertEqual(len(valuation), 2)
+        self.assertEqual(valuation.total_value, Decimal('3000.00'))
+
+    def test_empty_portfolio_values_to_zero(self):
+        valuation = value_portfolio([], {})
+
+        self.assertEqual(valuation.total_value, Decimal('0.00'))
+        self.assertEqual(valuation.total_profit_loss_percentage, Decimal('0.00'))
+        self.assertEqual(valuation.entries, [])
+        self.assertEqual(valuation.allocation(), [])
+
+    def test_positions_are_summed_by_the_database(self):
+        user = CustomUser.objects.create_user(username='holder', email='holder@example.com', phone_number='1', password='pw')
+        for lot_id, name, symbol, amount, purchase_price, _ in self.lots():
+            Portfolio.objects.create(
+                user=user, crypto_name=name, crypto_symbol=symbol, amount_owned=amount, purchase_price=purchase_price)
+        prices = {'C1': Decimal('1000'), 'C2': Decimal('50')}
+
+        with self.assertNumQueries(1):
+            rows = holding_rows(Portfolio.objects.filter(user=user))
+        by_lot = value_portfolio(lot_rows(Portfolio.objects.filter(user=user)), prices)
+        by_coin = value_portfolio(rows, prices)
+
+        self.assertEqual(len(by_coin), 2)
+        self.assertEqual(sorted(row[4] for row in rows), [Decimal('80.00'), Decimal('833.33')])
+        self.assertEqual(by_coin.total_value, by_lot.total_value)
+        self.assertEqual(by_coin.total_profit_loss, by_lot.total_profit_loss)
+        self.assertEqual(by_coin.allocation(), by_lot.allocation())
+
+
+@override_settings(MARKET_DATA_INGESTER='command')
+class CoinRegistryTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream(markets=make_markets(3))
+
+    def test_holdings_outside_the_snapshot_are_priced_through_the_registry(self):
+        snapshot = MarketDataIngester().refresh()
+        sync_registry(ranks=coin_registry.market_cap_ranks(snapshot.coin_map))
+        user = CustomUser.objects.create_user(username='registry', email='registry@example.com', phone_number='3')
+        Portfolio.objects.create(user=user, crypto_symbol='C75', crypto_name='Coin 75', amount_owned=2, purchase_price=1)
+        self.client.force_login(user)
+
+        response = self.client.get('/api/portfolio/')
+
+        self.assertEqual(response.json()['portfolio'][0]['current_value'], str(round(Decimal(str(price_for('coin-75'))) * 2, 2)))
+        self.assertEqual(self.upstream.calls['/coins/list'], 1)
+
+    def test_resync_only_writes_the_difference(self):
+        self.assertEqual(sync_registry(), {'added': 101, 'updated': 0, 'removed': 0})
+        self.assertEqual(sync_registry(), {'added': 0, 'updated': 0, 'removed': 0})
+
+        self.upstream.coin_list = self.upstream.coin_list[1:] + [{'id': 'coin-101', 'symbol': 'c101', 'name': 'Coin 101'}]
+        self.upstream.coin_list[0] = {**self.upstream.coin_list[0], 'name': 'Coin Two'}
+
+        self.assertEqual(sync_registry(), {'added': 1, 'updated': 1, 'removed': 1})
+        registry = get_registry()
+        self.assertEqual(registry.name('coin-2'), 'Coin Two')
+        self.assertEqual(registry.coin_id('c101'), 'coin-101')
+        self.assertEqual(registry.coin_id('C1'), 'wrapped-coin-1')  # coin-1 was delisted
+
+    def test_ambiguous_symbols_resolve_deterministically(self):
+        coins = [
+            {'id': 'bitcoin-on-another-chain', 'symbol': 'btc', 'name': 'Bridged Bitcoin'},
+            {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+            {'id': 'zeta', 'symbol': 'zz', 'name': 'Zeta'},
+            {'id': 'alpha', 'symbol': 'zz', 'name': 'Alpha'},
+            {'id': 'beta', 'symbol': 'zz', 'name': 'Beta'},
+        ]
+        sync_registry(coins, ranks={'bitcoin-on-another-chain': 1, 'zeta': 40})
+
+        registry = get_registry()
+        self.assertEqual(registry.coin_id('BTC'), 'bitcoin')  # a known mapping beats rank
+        self.assertEqual(registry.candidates['ZZ'], ['zeta', 'alpha', 'beta'])  # then rank, then id
+        self.assertEqual(CoinIndex(reversed(list(Coin.objects.values_list(
+            'coin_id', 'symbol', 'name', 'market_cap_rank')))).coin_ids, registry.coin_ids)
+
+    def test_lookups_do_not_query_the_database(self):
+        sync_registry()
+        get_registry()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(coin_registry.coin_id_for('c42'), 'coin-42')
+            self.assertEqual(get_registry().name('coin-42'), 'Coin 42')
+            self.assertEqual(coin_registry.coin_map({'C42': 'override'})['C42'], 'override')
+
+
+@override_settings(MARKET_DATA_INGESTER='command')
+class CoinSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        coins = [
+            {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+            {'id': 'bitcoin-cash', 'symbol': 'bch', 'name': 'Bitcoin Cash'},
+            {'id': 'wrapped-bitcoin', 'symbol': 'wbtc', 'name': 'Wrapped Bitcoin'},
+            {'id': 'bitdao', 'symbol': 'bit', 'name': 'BitDAO'},
+            {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ethereum'},
+        ]
+        sync_registry(coins, ranks={'bitcoin': 1, 'ethereum': 2, 'wrapped-bitcoin': 15, 'bitcoin-cash': 18, 'bitdao': 90})
+
+    def symbols(self, query, limit=10):
+        return [coin['symbol'] for coin in search_coins(query, limit)]
+
+    def test_matches_rank_by_market_cap_after_an_exact_symbol(self):
+        self.assertEqual(self.symbols('bit'), ['BIT', 'BTC', 'WBTC', 'BCH'])
+        self.assertEqual(self.symbols('bitc'), ['BTC', 'WBTC', 'BCH'])
+        self.assertEqual(self.symbols('bitcoin c'), ['BCH'])
+        self.assertEqual(self.symbols('cash'), ['BCH'])
+        self.assertEqual(self.symbols('herEUM'), ['ETH'])  # substring, through trigrams
+        self.assertEqual(self.symbols('b', limit=2), ['BTC', 'WBTC'])
+
+    def test_index_is_rebuilt_only_when_the_registry_changes(self):
+        index = get_search_index()
+        self.assertIs(get_search_index(), index)
+
+        sync_registry([{'id': 'solana', 'symbol': 'sol', 'name': 'Solana'}])
+
+        self.assertIsNot(get_search_index(), index)
+        self.assertEqual(self.symbols('sol'), ['SOL'])
+        self.assertEqual(self.symbols('wrapped'), [])
+
+    def test_search_endpoint(self):
+        response = self.client.get('/api/coins/search', {'q': 'Bitcoin', 'limit': 2})
+
+        self.assertEqual(response.json(), {'query': 'Bitcoin', 'results': [
+            {'symbol': 'BTC', 'name': 'Bitcoin', 'id': 'bitcoin'},
+            {'symbol': 'WBTC', 'name': 'Wrapped Bitcoin', 'id': 'wrapped-bitcoin'},
+        ]})
+        self.assertEqual(self.client.get('/api/coins/search', {'q': 'b', 'limit': 'x'}).status_code, 400)
+
+    def test_queries_on_a_large_registry_never_scan_it(self):
+        rows = [(f'coin-{rank}', f'C{rank}', f'Coin {rank} Token', rank) for rank in range(1, 15001)]
+        index = CoinSearchIndex(CoinIndex(rows))
+        checked = []
+
+        class CountingList(list):
+            def __getitem__(self, position):
+                checked.append(position)
+                return super().__getitem__(position)
+
+        # Every entry a query looks at goes through one of these.
+        index._tokens, index._haystacks = CountingList(index._tokens), CountingList(index._haystacks)
+        examined = {}
+        for query in ['c', 'c1', 'coin 12', 'token', '999', 'oin 14', 'zzz']:
+            checked.clear()
+            index.search(query)
+            examined[query] = len(checked)
+
+        self.assertEqual([coin['symbol'] for coin in index.search('c1', limit=3)], ['C1', 'C10', 'C11'])
+        # Short queries are answered from postings alone; the rest check only the candidates their postings leave.
+        self.assertEqual([examined[query] for query in ['c', 'c1', '999', 'zzz']], [0, 0, 0, 0])
+        self.assertLess(max(examined.values()), len(index) // 10)
+
+    def test_add_to_portfolio_accepts_any_registered_coin(self):
+        user = CustomUser.objects.create_user(username='search', email='search@example.com', phone_number='4')
+        self.client.force_login(user)
+
+        with mock.patch.object(views, 'schedule_sync') as schedule, mock.patch.object(views, 'schedule_snapshots') as snapshots:
+            response = self.client.post('/add_to_portfolio/', {'crypto_symbol': 'wbtc', 'amount_owned': 1, 'purchase_price': 10})
+            rejected = self.client.post('/add_to_portfolio/', {'crypto_symbol': 'NOPE', 'amount_owned': 1, 'purchase_price': 10})
+
+        self.assertRedirects(response, '/portfolio/', fetch_redirect_response=False)
+        schedule.assert_called_once_with(['wrapped-bitcoin'])
+        self.assertEqual(snapshots.call_args.args[1], [user])
+        self.assertEqual(rejected.status_code, 200)
+        # The lot is stored under the coin's name, which the portfolio table shows.
+        self.assertEqual(list(Portfolio.objects.filter(user=user).values_list('crypto_symbol', 'crypto_name')),
+                         [('WBTC', 'Wrapped Bitcoin')])
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PRICE_HISTORY_DAYS=365, COINGECKO_RATE_LIMIT_BURST=20)
+class PriceHistoryStoreTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream()
+        self.today = timezone.now().date()
+
+    def test_backfill_once_then_fetch_only_newest_candles(self):
+        sync_coin_history('coin-2')
+
+        self.assertEqual(HistoricalPrice.objects.filter(coin_id='coin-2').count(), 366)
+        self.assertEqual(self.upstream.requests[-1][1]['days'], '365')
+        self.assertEqual(HistoricalPrice.objects.get(coin_id='coin-2', date=self.today).price, price_for('coin-2'))
+
+        HistoricalPrice.objects.filter(date__gt=self.today - timedelta(days=3)).delete()
+        sync_coin_history('coin-2')
+
+        self.assertEqual(self.upstream.requests[-1][1]['days'], '4')
+        self.assertEqual(HistoricalPrice.objects.filter(coin_id='coin-2').count(), 366)
+
+    def test_historical_lookup_makes_no_upstream_calls(self):
+        coin_map = {f'C{rank}': f'coin-{rank}' for rank in range(1, 21)}
+        sync_history(coin_map.values())
+        self.assertEqual(self.upstream.calls['/coins/{id}/market_chart'], 20)
+
+        dates = [self.today - timedelta(days=days) for days in [7, 30, 180, 365]]
+        historical_prices = prices_as_of(list(coin_map.values()), dates)
+
+        self.assertEqual(self.upstream.calls['/coins/{id}/market_chart'], 20)
+        self.assertEqual(historical_prices.shape, (20, 4))
+        self.assertEqual(list(historical_prices[2]), [historical_price_for('coin-3', date) for date in dates])
+
+
+def store_sparse_history(today):
+    # coin-a has a candle every third day; coin-b was only listed five days ago.
+    for days_ago in range(0, 60, 3):
+        HistoricalPrice.objects.create(coin_id='coin-a', date=today - timedelta(days=days_ago), price=100 + days_ago)
+    for days_ago in range(0, 5):
+        HistoricalPrice.objects.create(coin_id='coin-b', date=today - timedelta(days=days_ago), price=10)
+
+
+class PointInTimeLookupTests(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+        store_sparse_history(self.today)
+
+    def test_resolves_last_price_on_or_before_each_date(self):
+        targets = [self.today - timedelta(days=days) for days in [1, 3, 7, 30]]
+
+        matrix = prices_as_of(['coin-a', 'coin-b', 'coin-missing'], targets)
+
+        self.assertEqual(matrix.shape, (3, 4))
+        self.assertEqual(matrix[0].tolist(), [103, 103, 109, 130])
+        self.assertEqual(matrix[1, :2].tolist(), [10, 10])
+        self.assertTrue(all(value != value for value in matrix[1, 2:]))  # NaN before listing
+        self.assertTrue(all(value != value for value in matrix[2]))
+
+
+
+class PortfolioSnapshotTests(FakeUpstreamMixin, TestCase):
+    coin_map = {'A': 'coin-a', 'B': 'coin-b'}
+
+    def setUp(self):
+        self.today = timezone.now().date()
+        store_sparse_history(self.today)
+        self.user = CustomUser.objects.create_user(username='history', email='history@example.com', phone_number='5')
+        # Two lots of A bought 10 and 2 days ago; B bought 20 days ago, before it had a price.
+        for symbol, amount, price, days_ago in [('A', 2, 100, 10), ('A', 1, 100, 2), ('B', 5, 1, 20)]:
+            lot = Portfolio.objects.create(
+                user=self.user, crypto_symbol=symbol, crypto_name=symbol, amount_owned=amount, purchase_price=price)
+            Portfolio.objects.filter(pk=lot.pk).update(purchase_date=timezone.now() - timedelta(days=days_ago))
+
+    def history(self, *days_ago):
+        return {days: value for days, value in views.valuation_over_time(self.user, days_ago).items()}
+
+    def test_lots_count_from_their_purchase_date(self):
+        written = materialize_snapshots(self.coin_map, today=self.today)
+
+        self.assertEqual(written, 21)
+        with self.assertNumQueries(1):
+            history = self.history(1, 4, 7, 10, 11, 30)
+        self.assertEqual(history, {
+            1: Decimal('359.00'),  # 3 A at 103 + 5 B at 10
+            4: Decimal('262.00'),  # 2 A at 106 + 5 B at 10
+            7: Decimal('218.00'),
+            10: Decimal('224.00'),  # B had no price yet
+            11: Decimal('0.00'),  # A not bought yet, B without a price
+            30: Decimal('0.00'),
+        })
+        self.assertEqual(
+            PortfolioSnapshot.objects.get(user=self.user, date=self.today - timedelta(days=1)).cost_basis, Decimal('305.00'))
+
+    def test_editing_or_deleting_a_lot_rewrites_the_days_it_was_held(self):
+        materialize_snapshots(self.coin_map, today=self.today)
+        self.seed_snapshot([], self.coin_map)
+        self.addCleanup(cache.clear)
+
+        recent = Portfolio.objects.get(user=self.user, crypto_symbol='A', amount_owned=1)
+        recent.amount_owned = 3
+        recent.save()
+        # Bought two days ago: the days before it stay, the rest are written again.
+        self.assertEqual(PortfolioSnapshot.objects.filter(user=self.user).latest('date').date, self.today - timedelta(days=3))
+        self.assertEqual(materialize_snapshots(self.coin_map, today=self.today), 4)
+        self.assertEqual(self.history(1), {1: Decimal('565.00')})  # 5 A at 103 + 5 B at 10
+
+        self.client.force_login(self.user)
+        # Run the background rebuild inline, where the test's transaction can see it.
+        with mock.patch.object(views, 'schedule_snapshots', side_effect=materialize_snapshots) as scheduled:
+            self.client.get(f'/delete_portfolio/{Portfolio.objects.get(user=self.user, crypto_symbol="B").pk}/')
+        scheduled.assert_called_once()
+
+        self.assertEqual(self.history(1, 4, 10), {1: Decimal('515.00'), 4: Decimal('212.00'), 10: Decimal('224.00')})
+
+    def test_nightly_runs_resume_from_the_latest_day(self):
+        materialize_snapshots(self.coin_map, today=self.today - timedelta(days=3))
+        HistoricalPrice.objects.filter(coin_id='coin-a', date=self.today - timedelta(days=6)).update(price=200)
+
+        # Only the last stored day and the days after it are (re)written.
+        self.assertEqual(materialize_snapshots(self.coin_map, today=self.today), 4)
+        self.assertEqual(self.history(4, 3), {4: Decimal('262.00'), 3: Decimal('256.00')})
+
+        self.assertEqual(materialize_snapshots(self.coin_map, rebuild=True, today=self.today), 21)
+        self.assertEqual(self.history(4), {4: Decimal('450.00')})
+
+
+@override_settings(COINGECKO_RATE_LIMIT_PER_MINUTE=60, COINGECKO_RATE_LIMIT_BURST=15)
+class ConcurrentFetchTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream(latency=0.3)
+
+    @override_settings(COINGECKO_MAX_CONCURRENCY=5)
+    def test_cold_sync_of_fifteen_coins_overlaps_calls_up_to_the_limit(self):
+        coin_ids = [f'coin-{rank}' for rank in range(1, 15)] + ['delisted-coin']
+
+        synced = sync_history(coin_ids)
+
+        self.assertEqual(self.upstream.calls['/coins/{id}/market_chart'], 15)
+        self.assertEqual(self.upstream.max_in_flight, 5)
+        # The failing coin is isolated and released for the next sync.
+        self.assertEqual(set(synced), set(coin_ids[:-1]))
+        self.assertIsNone(cache.get('history_sync:delisted-coin'))
+        self.assertEqual(HistoricalPrice.objects.values('coin_id').distinct().count(), 14)
+
+    def test_token_bucket_throttles_after_burst(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+
+        started = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    @override_settings(COINGECKO_TIMEOUT=0.2)
+    def test_rate_limit_wait_is_bounded_by_call_timeout(self):
+        http = UpstreamClient(bucket=TokenBucket(rate=0.1, capacity=1))
+        self.addCleanup(http.close)
+        self.upstream.latency = 0
+
+        results, errors = ConcurrentFetcher().fetch_all(
+            lambda page: http.get_json('/coins/markets', {'page': page}), [1, 2])
+
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(*errors.values(), RateLimited)
+        self.assertEqual(self.upstream.calls['/coins/markets'], 1)
+
+    @override_settings(COINGECKO_TIMEOUT=0.2, COINGECKO_BACKOFF=0.01)
+    def test_every_attempt_takes_a_token(self):
+        http = UpstreamClient(bucket=TokenBucket(rate=0.1, capacity=2))
+        self.addCleanup(http.close)
+        self.upstream.latency = 0
+        self.upstream.failures = [503, 503]
+
+        # Outside any fan-out, and the second retry finds the bucket empty.
+        with self.assertRaises(RateLimited):
+            http.get_json('/simple/price', {'ids': 'coin-1', 'vs_currencies': 'usd'})
+        # The async client waits for the same budget.
+        with self.assertRaises(RateLimited):
+            asyncio.run(http.aget_json('/coins/list'))
+
+        self.assertEqual(self.upstream.calls['/simple/price'], 2)
+        self.assertEqual(self.upstream.calls['/coins/list'], 0)
+
+
+@override_settings(COINGECKO_BACKOFF=0.01)
+class UpstreamClientTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        self.start_upstream(etags=True)
+        self.http = UpstreamClient()
+        self.addCleanup(self.http.close)
+
+    def test_reuses_one_keep_alive_connection(self):
+        for _ in range(5):
+            self.http.get_json('/coins/markets', {'page': 1})
+
+        self.assertEqual(self.upstream.calls['/coins/markets'], 5)
+        self.assertEqual(len(self.upstream.connections), 1)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        self.upstream.failures = [429, 503]
+
+        markets = self.http.get_json('/coins/markets')
+
+        self.assertEqual(len(markets), 30)
+        metrics = self.http.metrics()['/coins/markets']
+        self.assertEqual((metrics['requests'], metrics['errors'], metrics['retries']), (3, 2, 2))
+
+    def test_gives_up_after_configured_retries(self):
+        self.upstream.failures = [500] * 3
+
+        with self.settings(COINGECKO_RETRIES=1):
+            with self.assertRaises(requests.HTTPError):
+                self.http.get_json('/coins/markets')
+
+        self.assertEqual(self.upstream.calls['/coins/markets'], 2)
+
+    def test_revalidates_with_etag(self):
+        first = self.http.get_json('/coins/markets')
+        second = self.http.get_json('/coins/markets')
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.upstream.not_modified, 1)
+        self.assertEqual(self.http.metrics()['/coins/markets']['not_modified'], 1)
+
+    def test_revalidated_results_are_the_callers_to_change(self):
+        self.http.get_json('/coins/markets').append({'id': 'extra'})
+        revalidated = self.http.get_json('/coins/markets')
+        revalidated[0]['current_price'] = 0
+
+        self.assertEqual(self.http.get_json('/coins/markets'), self.upstream.markets)
+        self.assertEqual(self.upstream.not_modified, 2)
+
+    def test_stub_replays_recorded_fixtures(self):
+        recorded = {
+            '/coins/markets': [{'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin', 'current_price': 65000.0}],
+            '/simple/price': {'bitcoin': {'usd': 65100.0}},
+            '/coins/{id}/market_chart': {'bitcoin': {'prices': [[1700000000000, 37000.0]]}},
+        }
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'fixtures.json')
+        with open(path, 'w') as f:
+            json.dump(recorded, f)
+
+        with FakeCoinGecko(fixtures=load_fixtures(path)) as fake, self.settings(COINGECKO_API_URL=fake.url):
+            self.assertEqual(self.http.get_json('/coins/markets'), recorded['/coins/markets'])
+            self.assertEqual(self.http.get_json('/simple/price', {'ids': 'bitcoin,coin-1'}), {'bitcoin': {'usd': 65100.0}})
+            self.assertEqual(self.http.get_json('/coins/bitcoin/market_chart', {'days': 1}), recorded['/coins/{id}/market_chart']['bitcoin'])
+            self.assertEqual(len(self.http.get_json('/coins/list')), 101)  # not recorded, so generated
+
+        with open(path, 'w') as f:
+            json.dump({'/coins/trending': []}, f)
+        with self.assertRaises(ValueError):
+            load_fixtures(path)
+
+
+@override_settings(MARKET_DATA_INGESTER='command', COINGECKO_RETRIES=0, COINGECKO_CIRCUIT_FAILURES=3,
+                   COINGECKO_CIRCUIT_RESET=0.2, MARKET_DATA_REFRESH_INTERVAL=0.05)
+class UpstreamOutageTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream()
+        upstream.client.breaker.reset()
+        self.addCleanup(upstream.client.breaker.reset)
+
+    def test_circuit_opens_after_repeated_failures_and_probes_to_recover(self):
+        http = UpstreamClient()
+        self.addCleanup(http.close)
+        self.upstream.failures = [503] * 4
+
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                http.get_json('/coins/markets')
+        with self.assertRaises(upstream.CircuitOpen):
+            http.get_json('/coins/markets')
+        self.assertEqual(self.upstream.calls['/coins/markets'], 3)
+        self.assertEqual(http.metrics()['/coins/markets']['short_circuited'], 1)
+
+        time.sleep(0.25)
+        with self.assertRaises(requests.HTTPError):
+            http.get_json('/coins/markets')  # the probe fails, so the circuit opens again
+        with self.assertRaises(upstream.CircuitOpen):
+            http.get_json('/coins/markets')
+
+        time.sleep(0.25)
+        self.assertEqual(len(http.get_json('/coins/markets')), 30)
+        self.assertEqual(http.breaker.state, http.breaker.CLOSED)
+        self.assertEqual(self.upstream.calls['/coins/markets'], 5)
+
+    def test_a_probe_ending_in_any_other_error_frees_the_slot(self):
+        http = UpstreamClient()
+        self.addCleanup(http.close)
+        self.upstream.failures = [503] * 3
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                http.get_json('/coins/markets')
+
+        time.sleep(0.25)
+        with mock.patch.object(http.session, 'get', side_effect=requests.TooManyRedirects):
+            with self.assertRaises(requests.TooManyRedirects):
+                http.get_json('/coins/markets')
+        self.assertEqual(http.breaker.state, http.breaker.HALF_OPEN)
+
+        with mock.patch.object(upstream.httpx.AsyncClient, 'get', side_effect=upstream.httpx.DecodingError('bad gzip')):
+            with self.assertRaises(upstream.httpx.DecodingError):
+                asyncio.run(http.aget_json('/coins/markets'))
+
+        # Neither probe held on to the slot, so the next call gets through and closes the circuit.
+        self.assertEqual(len(http.get_json('/coins/markets')), 30)
+        self.assertEqual(http.breaker.state, http.breaker.CLOSED)
+
+    def test_last_good_snapshot_is_served_flagged_stale_up_to_its_max_age(self):
+        ingester = MarketDataIngester()
+        ingester.refresh()
+        self.assertNotIn('X-Data-Stale', self.client.get('/api/crypto-data/'))
+
+        self.upstream.failures = [503] * 10
+        self.upstream.markets = []
+        time.sleep(0.15)
+        ingester.refresh()
+
+        response = self.client.get('/api/crypto-data/')
+        self.assertEqual(len(response.json()), 30)
+        self.assertEqual(response['X-Data-Stale'], 'true')
+        with self.settings(MARKET_DATA_MAX_AGE=0.1):
+            self.assertEqual(self.client.get('/api/crypto-data/').json(), [])
+
+        # CoinGecko answers again, but with nothing: the last good snapshot stays.
+        self.upstream.failures = []
+        ingester.refresh()
+        self.assertEqual(len(get_snapshot()), 30)
+
+    def test_portfolio_keeps_its_value_from_stored_prices_during_an_outage(self):
+        user = CustomUser.objects.create_user(username='holder', email='holder@example.com', phone_number='9', password='pw')
+        Portfolio.objects.create(user=user, crypto_symbol='C1', crypto_name='Coin 1', amount_owned=2, purchase_price=400)
+        Portfolio.objects.create(user=user, crypto_symbol='C2', crypto_name='Coin 2', amount_owned=1, purchase_price=0)
+        HistoricalPrice.objects.create(coin_id='coin-1', date=timezone.now().date() - timedelta(days=1), price=900)
+        self.seed_snapshot([], {'C1': 'coin-1', 'C2': 'coin-2'})
+        self.upstream.failures = [503] * 10
+        self.client.force_login(user)
+
+        data = self.client.get('/api/portfolio/').json()
+        page = self.client.get('/portfolio/?charts=client')
+
+        self.assertEqual([(row['crypto_name'], row['current_value']) for row in data['portfolio']], [('Coin 1', '1800.00')])
+        self.assertEqual((data['stale'], data['stale_symbols'], data['unpriced_symbols']), (True, ['C1'], ['C2']))
+        self.assertEqual((page.context['total_value'], page.context['total_profit_loss_percentage']), (Decimal('1800.00'), Decimal('125.00')))
+        self.assertContains(page, 'C1 is valued at the last known price')
+        self.assertContains(page, 'No price is available for C2')
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PORTFOLIO_CHART_MODE='server')
+class ChartCacheTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        chart_images.clear()
+        self.seed_snapshot()
+        self.user = CustomUser.objects.create_user(username='charts', email='charts@example.com', phone_number='2', password='pw')
+        Portfolio.objects.create(user=self.user, crypto_symbol='C1', crypto_name='Coin 1', amount_owned=2, purchase_price=100)
+        self.client.force_login(self.user)
+
+    def test_unchanged_portfolio_reuses_rendered_chart(self):
+        with mock.patch.dict(views.CHART_RENDERERS, pie=mock.Mock(wraps=views.generate_pie_chart)) as renderers:
+            first = self.client.get('/portfolio/')
+            second = self.client.get('/portfolio/')
+            self.assertEqual(first.context['pie_chart'], second.context['pie_chart'])
+
+            for _ in range(2):
+                image = self.client.get(first.context['pie_chart'])
+                self.assertEqual(image['Content-Type'], 'image/png')
+                self.assertTrue(image.content.startswith(b'\x89PNG'))
+
+            self.assertEqual(renderers['pie'].call_count, 1)
+
+    def test_chart_url_supports_conditional_requests(self):
+        chart_url = self.client.get('/portfolio/').context['valuation_chart']
+        etag = self.client.get(chart_url)['ETag']
+
+        response = self.client.get(chart_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/portfolio/chart/pie/unknown.png').status_code, 404)
+
+    def test_charts_rendered_at_once_on_several_threads_stay_apart(self):
+        from . import charts
+
+        jobs = [
+            (charts.render_pie_chart, [('C1', Decimal('200')), ('C2', Decimal('100'))]),
+            (charts.render_valuation_chart, {'as_of': '2026-01-31', 'points': [[0, 300], [7, 250], [30, 100]]}),
+        ]
+        expected = [render(inputs) for render, inputs in jobs]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            rendered = list(pool.map(lambda i: jobs[i % 2][0](jobs[i % 2][1]), range(40)))
+
+        self.assertTrue(rendered == [expected[i % 2] for i in range(40)])
+
+    def test_lru_evicts_oldest_images_beyond_size_bound(self):
+        lru = LRUByteCache(max_bytes=10)
+        lru.put('a', b'1234')
+        lru.put('b', b'1234')
+        lru.get('a')
+        lru.put('c', b'1234')
+
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'1234')
+        self.assertEqual(lru.size, 8)
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PORTFOLIO_CHART_MODE='client')
+class ClientChartModeTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seed_snapshot()
+        self.user = CustomUser.objects.create_user(username='plotly', email='plotly@example.com', phone_number='3', password='pw')
+        Portfolio.objects.create(user=self.user, crypto_symbol='C1', crypto_name='Coin 1', amount_owned=2, purchase_price=100)
+        Portfolio.objects.update(purchase_date=timezone.now() - timedelta(days=60))
+        HistoricalPrice.objects.create(coin_id='coin-1', date=timezone.now().date() - timedelta(days=7), price=900)
+        materialize_snapshots({'C1': 'coin-1'})
+        self.client.force_login(self.user)
+
+    def test_page_renders_no_charts_server_side(self):
+        pie, valuation = mock.Mock(), mock.Mock()
+        with mock.patch.dict(views.CHART_RENDERERS, pie=pie, valuation=valuation):
+            response = self.client.get('/portfolio/')
+
+        self.assertContains(response, 'Plotly.newPlot')
+        self.assertNotIn('pie_chart', response.context)
+        self.assertFalse(pie.called or valuation.called)
+
+    def test_chart_data_endpoint(self):
+        response = self.client.get('/api/portfolio/chart-data/?horizons=7d,30d')
+
+        self.assertEqual(response.json(), {
+            'allocation': [{'symbol': 'C1', 'value': 2000.0}],
+            'valuation': [
+                {'date': (timezone.now().date() - timedelta(days=30)).isoformat(), 'days_ago': 30, 'value': 0.0},
+                {'date': (timezone.now().date() - timedelta(days=7)).isoformat(), 'days_ago': 7, 'value': 1800.0},
+            ],
+            'stale': False,
+            'stale_symbols': [],
+            'unpriced_symbols': [],
+        })
+
+    def test_chart_data_series_at_any_resolution(self):
+        response = self.client.get('/api/portfolio/chart-data/?range=14d&step=1w')
+
+        self.assertEqual([(point['days_ago'], point['value']) for point in response.json()['valuation']],
+                         [(14, 0.0), (7, 1800.0), (0, 1800.0)])
+
+    def test_horizons_are_cut_to_the_price_store_and_validated(self):
+        with self.settings(PRICE_HISTORY_DAYS=365):
+            response = self.client.get('/api/portfolio/chart-data/?horizons=7d,1000000d')
+        self.assertEqual([point['days_ago'] for point in response.json()['valuation']], [365, 7])
+
+        for query in ['horizons=0d', 'horizons=-7d', 'horizons=7x', 'horizons=,', 'range=-1d', 'range=30d&step=0d']:
+            with self.subTest(query):
+                self.assertEqual(self.client.get(f'/api/portfolio/chart-data/?{query}').status_code, 400)
+                self.assertEqual(self.client.get(f'/portfolio/?charts=server&{query}').status_code, 400)
+
+
+@override_settings(MARKET_DATA_INGESTER='command', COINGECKO_BACKOFF=0.01)
+class AsyncViewTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_upstream(markets=[])
+        self.coin_map = {'C1': 'coin-1', 'C2': 'coin-2'}
+        self.seed_snapshot(coin_map=self.coin_map)
+        self.user = CustomUser.objects.create_user(username='async', email='async@example.com', phone_number='4', password='pw')
+        Portfolio.objects.create(user=self.user, crypto_symbol='C1', crypto_name='Coin 1', amount_owned=2, purchase_price=100)
+        Portfolio.objects.create(user=self.user, crypto_symbol='C2', crypto_name='Coin 2', amount_owned=1, purchase_price=100)
+
+    def async_request(self, path, user):
+        request = AsyncRequestFactory().get(path)
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
+    async def test_portfolio_data_matches_sync_view(self):
+        request = RequestFactory().get('/api/portfolio/')
+        request.user = self.user
+        expected = await sync_to_async(views.get_portfolio_data)(request)
+        cache.delete_many(['price:C2', 'simple_price:coin-2'])
+
+        response = await async_views.get_portfolio_data(self.async_request('/api/portfolio/', self.user))
+        await upstream.client.aclose()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, expected.content.decode())
+        self.assertEqual(self.upstream.calls['/simple/price'], 2)
+
+    async def test_portfolio_view_renders(self):
+        response = await async_views.portfolio_view(self.async_request('/portfolio/', self.user))
+
+        self.assertContains(response, 'C2')
+        self.assertContains(response, 'Plotly.newPlot')
+
+    async def test_anonymous_user_is_redirected_to_login(self):
+        response = await async_views.portfolio_view(self.async_request('/portfolio/', AnonymousUser()))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/login/'))
+
+    async def test_concurrent_requests_share_one_upstream_call(self):
+        self.upstream.latency = 0.1
+
+        results = await asyncio.gather(*(aresolve_prices(['C2'], [], self.coin_map) for _ in range(5)))
+        await upstream.client.aclose()
+
+        self.assertEqual(results, [{'C2': Decimal('500.0')}] * 5)
+        self.assertEqual(self.upstream.calls['/simple/price'], 1)
+        self.assertEqual(singleflight.stats()['simple_price']['coalesced'], 4)
+
+    async def test_async_client_retries_like_sync_client(self):
+        self.upstream.failures = [503, 429]
+
+        data = await upstream.aget_json('/simple/price', {'ids': 'coin-2', 'vs_currencies': 'usd'})
+        await upstream.client.aclose()
+
+        self.assertEqual(data, {'coin-2': {'usd': 500.0}})
+        self.assertEqual(self.upstream.calls['/simple/price'], 3)
+        self.assertEqual(upstream.client.metrics()['/simple/price']['retries'], 2)
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(MARKET_DATA_INGESTER='command')
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        shared = {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://fake-redis:6379/0',
+            'OPTIONS': {'connection_class': fakeredis.FakeConnection, 'server': fakeredis.FakeServer()},
+        }
+        settings_override = self.settings(CACHES={**settings.CACHES, 'shared': shared})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(lambda: caches['default'].close_listener(0))
+        # Two backends with their own L1 stand in for two worker processes.
+        self.first = self.tiered('first')
+        self.second = self.tiered('second')
+        self.wait_for(lambda: caches['shared']._cache.get_client().pubsub_numsub('test-invalidation')[0][1] == 2)
+
+    def tiered(self, name, l1_timeout=60, version=1):
+        backend = TieredCache(name, {
+            'VERSION': version,
+            'OPTIONS': {'L2': 'shared', 'L1_TIMEOUT': l1_timeout, 'CHANNEL': 'test-invalidation'},
+        })
+        self.addCleanup(backend.close_listener, 0)
+        backend.l1.clear()
+        backend.reset_stats()
+        return backend
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('condition not met in time')
+            time.sleep(0.01)
+
+    def test_reads_are_served_from_l1(self):
+        self.first.set('greeting', 'hello')
+        caches['shared'].set('greeting', 'changed behind our back', version=1)
+
+        self.assertEqual(self.first.get('greeting'), 'hello')
+        self.assertEqual(self.second.get('greeting'), 'changed behind our back')
+        self.assertEqual(self.first.stats()['l1_hits'], 1)
+        self.assertEqual(self.second.stats()['l2_hits'], 1)
+
+    def test_write_invalidates_l1_of_other_processes(self):
+        self.first.set('greeting', 'hello')
+        self.assertEqual(self.second.get('greeting'), 'hello')
+
+        self.first.set('greeting', 'bonjour')
+
+        self.wait_for(lambda: self.second.get('greeting') == 'bonjour')
+        self.assertGreaterEqual(self.second.stats()['invalidations_received'], 1)
+
+    def test_l1_copy_expires_without_invalidation(self):
+        short = self.tiered('short', l1_timeout=0.1)
+        short.set('greeting', 'hello')
+        caches['shared'].set('greeting', 'bonjour', version=1)
+
+        self.assertEqual(short.get('greeting'), 'hello')
+        time.sleep(0.15)
+        self.assertEqual(short.get('greeting'), 'bonjour')
+
+    def test_version_bump_retires_old_entries(self):
+        self.first.set('greeting', 'hello')
+
+        self.assertIsNone(self.tiered('next-release', version=2).get('greeting'))
+
+    def test_ingested_snapshot_is_shared_across_processes(self):
+        with FakeCoinGecko() as upstream, self.settings(COINGECKO_API_URL=upstream.url):
+            MarketDataIngester(interval=60).refresh()
+
+        snapshot = self.second.get(SNAPSHOT_CACHE_KEY).value
+        self.assertEqual(snapshot.coin_map['C1'], 'coin-1')
+        self.assertEqual(upstream.calls['/coins/markets'], 1)
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PRICE_STREAM_HEARTBEAT=0.05)
+class PriceStreamTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coins = [
+            {'symbol': 'C1', 'price': Decimal('1000'), 'price_change_percentage_24h': 1.5},
+            {'symbol': 'C2', 'price': Decimal('500'), 'price_change_percentage_24h': -2.0},
+        ]
+        self.publish(self.coins)
+        self.broadcaster = PriceBroadcaster(interval=60)
+
+    def publish(self, coins):
+        self.seed_snapshot(coins, {coin['symbol']: coin['symbol'].lower() for coin in coins})
+
+    def next_event(self, events):
+        # Skips the retry hint and keep-alive comments.
+        while True:
+            chunk = next(events)
+            if chunk.startswith(b'event:'):
+                return chunk
+
+    def test_snapshot_then_only_changed_prices(self):
+        events = self.broadcaster.events()
+        snapshot = self.next_event(events)
+        self.assertIn(b'event: snapshot', snapshot)
+        self.assertIn(b'"symbol":"C2"', snapshot)
+
+        self.publish([self.coins[0], {**self.coins[1], 'price': Decimal('510')}])
+        self.broadcaster.poke()
+        delta = self.next_event(events)
+
+        self.assertIn(b'event: delta', delta)
+        self.assertIn(b'"symbol":"C2","price":"510"', delta)
+        self.assertNotIn(b'C1', delta)
+        events.close()
+        self.assertEqual(self.broadcaster.subscriber_count, 0)
+
+    def test_new_coin_set_sends_a_full_snapshot(self):
+        events = self.broadcaster.events()
+        self.next_event(events)
+
+        self.publish(self.coins + [{'symbol': 'C3', 'price': Decimal('333'), 'price_change_percentage_24h': 0.1}])
+        self.broadcaster.poke()
+
+        self.assertIn(b'event: snapshot', self.next_event(events))
+        events.close()
+
+    @override_settings(HOME_COIN_LIMIT=1)
+    def test_only_the_coins_the_home_page_shows_are_streamed(self):
+        events = self.broadcaster.events()
+        snapshot = self.next_event(events)
+        self.assertIn(b'"symbol":"C1"', snapshot)
+        self.assertNotIn(b'C2', snapshot)
+
+        self.publish([self.coins[0], {**self.coins[1], 'price': Decimal('510')}])
+        self.assertIsNone(self.broadcaster._check())
+        self.publish([{**self.coins[0], 'price': Decimal('990')}, self.coins[1]])
+        self.assertIn(b'"symbol":"C1","price":"990"', self.broadcaster._check())
+        events.close()
+
+        self.assertContains(self.client.get('/'), "fetch('/api/crypto-data/?fields=symbol,name,image,price,price_change_percentage_24h,marketcap&limit=1')")
+
+    def test_snapshot_is_read_without_holding_the_subscriber_lock(self):
+        held = []
+
+        def read_snapshot():
+            held.append(self.broadcaster._lock.locked())
+            return get_snapshot()
+
+        with mock.patch('Website.stream.get_snapshot', side_effect=read_snapshot):
+            # The first subscriber reads it on its own thread, then the poller does.
+            events = self.broadcaster.events()
+            self.assertIn(b'event: snapshot', self.next_event(events))
+            self.publish([self.coins[0], {**self.coins[1], 'price': Decimal('510')}])
+            self.broadcaster.poke()
+            self.assertIn(b'event: delta', self.next_event(events))
+        events.close()
+
+        self.assertEqual(held, [False, False])
+
+    def test_home_page_streams_only_with_async_views(self):
+        self.assertFalse(self.client.get('/').context['price_stream'])
+        with self.settings(ASYNC_VIEWS=True):
+            self.assertTrue(self.client.get('/').context['price_stream'])
+
+    def test_every_subscriber_gets_the_same_encoded_event(self):
+        streams = [self.broadcaster.events() for _ in range(3)]
+        for events in streams:
+            self.next_event(events)
+
+        self.publish([{**self.coins[0], 'price': Decimal('990')}, self.coins[1]])
+        self.broadcaster.poke()
+        deltas = [self.next_event(events) for events in streams]
+
+        self.assertTrue(all(delta is deltas[0] for delta in deltas))
+        self.assertEqual(self.broadcaster.events_published, 1)
+        for events in streams:
+            events.close()
+
+    def test_async_subscribers(self):
+        async def first_two_events():
+            events = self.broadcaster.aevents()
+            try:
+                seen = []
+                async for chunk in events:
+                    if chunk.startswith(b'event:'):
+                        seen.append(chunk)
+                        if len(seen) == 1:
+                            await sync_to_async(self.publish)([{**self.coins[0], 'price': Decimal('1001')}, self.coins[1]])
+                            self.broadcaster.poke()
+                        else:
+                            return seen
+            finally:
+                await events.aclose()
+
+        snapshot, delta = asyncio.run(first_two_events())
+
+        self.assertIn(b'event: snapshot', snapshot)
+        self.assertIn(b'"symbol":"C1","price":"1001"', delta)
+
+    def test_stream_endpoint(self):
+        response = self.client.get('/api/stream/prices/')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 5000\n\n')
+        self.assertIn(b'event: snapshot', next(events))
+        response.close()
+
+
+@override_settings(MARKET_DATA_INGESTER='command')
+class CryptoDataPayloadTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coins = [
+            {'name': f'Coin {rank}', 'symbol': f'C{rank}', 'price': Decimal(f'{rank}.50'),
+             'price_change_percentage_24h': 1.0, 'marketcap': '1.00M', 'image': ''}
+            for rank in range(1, 31)
+        ]
+        self.snapshot = self.seed_snapshot(self.coins, {})
+
+    def test_unchanged_snapshot_answers_304(self):
+        first = self.client.get('/api/crypto-data/')
+        self.assertEqual(len(json.loads(first.content)), 30)
+
+        by_etag = self.client.get('/api/crypto-data/', HTTP_IF_NONE_MATCH=first['ETag'])
+        by_date = self.client.get('/api/crypto-data/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+        self.assertEqual(by_etag.content, b'')
+
+    def test_compressed_bodies_match_identity(self):
+        plain = self.client.get('/api/crypto-data/')
+        zipped = self.client.get('/api/crypto-data/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', zipped['Vary'])
+        self.assertNotEqual(zipped['ETag'], plain['ETag'])
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        refused = self.client.get('/api/crypto-data/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', refused)
+
+    @skipUnless(payloads.brotli, 'brotli is not installed')
+    def test_brotli_preferred_when_accepted(self):
+        plain = self.client.get('/api/crypto-data/')
+        response = self.client.get('/api/crypto-data/', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(payloads.brotli.decompress(response.content), plain.content)
+
+    def test_fields_and_limit_projection(self):
+        response = self.client.get('/api/crypto-data/', {'fields': 'symbol,price', 'limit': 3})
+
+        self.assertEqual(response.json(), [
+            {'symbol': 'C1', 'price': '1.50'}, {'symbol': 'C2', 'price': '2.50'}, {'symbol': 'C3', 'price': '3.50'},
+        ])
+        self.assertEqual(self.client.get('/api/crypto-data/', {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/crypto-data/', {'limit': 'all'}).status_code, 400)
+
+    def test_list_alias_serves_the_same_body(self):
+        self.assertEqual(self.client.get('/api/crypto-list-data/').content, self.client.get('/api/crypto-data/').content)
+
+    def test_body_is_serialized_once_per_snapshot(self):
+        with mock.patch.object(payloads, 'dump_json', wraps=payloads.dump_json) as dump:
+            for _ in range(3):
+                self.client.get('/api/crypto-data/')
+                self.client.get('/api/crypto-data/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(dump.call_count, 1)
+
+            self.seed_snapshot(self.coins[:5], {}, self.snapshot.fetched_at + 1)
+            self.assertEqual(len(self.client.get('/api/crypto-data/').json()), 5)
+            self.assertEqual(dump.call_count, 2)
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PORTFOLIO_CHART_MODE='server', COINGECKO_BACKOFF=0.01)
+class InstrumentationTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        chart_images.clear()
+        instrumentation.reset()
+        self.start_upstream(markets=[])
+        self.seed_snapshot(coin_map={'C1': 'coin-1', 'C2': 'coin-2'})
+        self.user = CustomUser.objects.create_user(username='timed', email='timed@example.com', phone_number='6', password='pw')
+        for symbol in ['C1', 'C2']:
+            Portfolio.objects.create(user=self.user, crypto_symbol=symbol, crypto_name=symbol, amount_owned=1, purchase_price=100)
+        self.client.force_login(self.user)
+
+    def timings(self, response):
+        return {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+
+    def test_server_timing_breaks_down_a_portfolio_request(self):
+        timings = self.timings(self.client.get('/portfolio/'))
+
+        self.assertIn('desc="1 calls"', timings['upstream'])  # C2 is priced upstream, C1 from the snapshot
+        self.assertRegex(timings['db'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertEqual(timings['cache-crypto-data'], 'cache-crypto-data;desc="hits=1 misses=0"')
+        self.assertEqual(timings['cache-price'], 'cache-price;desc="hits=0 misses=1"')
+        self.assertIn('total', timings)
+
+    def test_chart_renders_are_timed_once(self):
+        chart = self.client.get('/portfolio/').context['pie_chart']
+
+        first = self.timings(self.client.get(chart))
+        second = self.timings(self.client.get(chart))
+
+        self.assertIn('desc="1 renders"', first['chart'])
+        self.assertEqual(first['cache-chart-image'], 'cache-chart-image;desc="hits=0 misses=1"')
+        self.assertNotIn('chart', second)
+        self.assertEqual(second['cache-chart-image'], 'cache-chart-image;desc="hits=1 misses=0"')
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_endpoint(self):
+        self.client.get('/portfolio/')
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('cryptonews_http_requests_total{route="portfolio",method="GET",status="200"} 1', body)
+        self.assertIn('cryptonews_upstream_request_duration_seconds_count{endpoint="/simple/price"} 1', body)
+        self.assertIn('cryptonews_cache_lookups_total{key="price",outcome="misses"} 1', body)
+        self.assertIn('# TYPE cryptonews_singleflight_total counter', body)
+        # Not even from localhost, which is where a reverse proxy's traffic comes from.
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 404)
+        with self.settings(METRICS_ALLOWED_IPS=('10.0.0.8',)):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.8').status_code, 200)
+
+    async def test_async_requests_are_timed(self):
+        response = await self.async_client.get('/api/crypto-data/')
+
+        self.assertIn('cache-crypto-data', self.timings(response))
+
+
+@override_settings(MARKET_DATA_INGESTER='command', PORTFOLIO_CHART_MODE='server')
+class ProfilingTests(FakeUpstreamMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        settings_override = self.settings(PROFILE_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.seed_snapshot()
+        self.staff = CustomUser.objects.create_user(
+            username='ops', email='ops@example.com', phone_number='7', password='pw', is_staff=True, is_superuser=True)
+        Portfolio.objects.create(user=self.staff, crypto_symbol='C1', crypto_name='Coin 1', amount_owned=1, purchase_price=100)
+
+    def test_staff_flag_captures_a_cprofile(self):
+        self.client.force_login(self.staff)
+
+        response = self.client.get('/portfolio/', {'profile': '1'})
+
+        capture = ProfileCapture.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((capture.mode, capture.trigger, capture.user, capture.status_code), ('cprofile', 'staff', self.staff, 200))
+        self.assertIn('portfolio_view', capture.summary)
+        stats = pstats.Stats(profiling.capture_path(capture))
+        self.assertTrue(any(name == 'valuation_over_time' for _, _, name in stats.stats))
+
+        self.assertContains(self.client.get('/admin/Website/profilecapture/'), capture.filename)
+        download = self.client.get(f'/admin/Website/profilecapture/{capture.pk}/download/')
+        with open(profiling.capture_path(capture), 'rb') as f:
+            self.assertEqual(b''.join(download.streaming_content), f.read())
+
+    async def test_a_refused_profiler_does_not_fail_the_request(self):
+        # What Python 3.12+ raises for a second cProfile while one is running.
+        refused = ValueError('Another profiling tool is already active')
+        await self.async_client.aforce_login(self.staff)
+
+        with mock.patch.object(profiling.cProfile.Profile, 'enable', side_effect=refused):
+            response = await self.async_client.get('/portfolio/', {'profile': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(await ProfileCapture.objects.filter(pk=response['X-Profile-Id']).aexists())
+
+    def test_only_staff_can_ask_for_a_profile(self):
+        user = CustomUser.objects.create_user(username='someone', email='someone@example.com', phone_number='8', password='pw')
+        self.client.force_login(user)
+
+        response = self.client.get('/portfolio/', HTTP_X_PROFILE='1')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileCapture.objects.exists())
+
+    def test_sampled_requests_keep_a_bounded_ring_buffer(self):
+        with self.settings(PROFILE_SAMPLE_RATE=1, PROFILE_MAX_CAPTURES=2):
+            for _ in range(3):
+                self.client.get('/')
+
+        captures = list(ProfileCapture.objects.all())
+        self.assertEqual([(c.mode, c.trigger) for c in captures], [('sampling', 'sample')] * 2)
+        self.assertEqual(sorted(os.listdir(settings.PROFILE_DIR)), sorted(c.filename for c in captures))
+
+        captures[0].delete()
+        self.assertEqual(os.listdir(settings.PROFILE_DIR), [captures[1].filename])
+
+    def test_asgi_middleware_chain_stays_async(self):
+        # Django logs each sync-only middleware it wraps, and each wrapper is a thread switch per request.
+        with self.settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            handler = ASGIHandler()
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+
+    async def test_staff_flag_captures_a_profile_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+
+        response = await self.async_client.get('/portfolio/', {'profile': '1'})
+
+        capture = await ProfileCapture.objects.aget(pk=response['X-Profile-Id'])
+        self.assertEqual((capture.mode, capture.trigger, capture.status_code), ('cprofile', 'staff', 200))
+        self.assertIn('portfolio_view', capture.summary)
+
+    def test_sampler_records_collapsed_stacks(self):
+        def slow_function():
+            time.sleep(0.05)
+
+        sampler = profiling.StackSampler(threading.get_ident(), interval=0.001).start()
+        slow_function()
+        stacks = sampler.stop()
+
+        self.assertTrue(any(stack.endswith('.<locals>.slow_function') for stack in stacks))
+        for line in profiling.collapsed(stacks).splitlines():
+            self.assertRegex(line, r'^\S+(;\S+)* \d+$')
+
+
+class LoggingTests(TestCase):
+    def logger(self, *filters):
+        logger = logging.getLogger(f'CryptoNews.tests.{self._testMethodName}')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        for log_filter in filters:
+            logger.addFilter(log_filter)
+        self.addCleanup(logger.handlers.clear)
+        return logger
+
+    def test_records_are_written_by_the_listener_thread(self):
+        written = []
+
+        class Recorder(logging.Handler):
+            def emit(self, record):
+                written.append((threading.current_thread().name, self.format(record)))
+
+        handler = logs.QueueHandler()
+        handler.start([Recorder()])
+        self.addCleanup(handler.stop)
+        logger = self.logger()
+        logger.addHandler(handler)
+
+        logger.debug('priced %s lots', 3)
+        handler.flush()
+
+        self.assertEqual(len(written), 1)
+        self.assertNotEqual(written[0][0], threading.current_thread().name)
+        self.assertEqual(written[0][1], 'priced 3 lots')
+
+    def test_credentials_are_redacted(self):
+        record = logging.LogRecord(
+            'CryptoNews', logging.INFO, __file__, 1, 'login %s password=%s headers %s', None, None)
+        record.args = ('alice', 'hunter2', {'Cookie': 'sessionid=abc; csrftoken=def', 'Accept': 'text/html'})
+
+        logs.RedactingFilter().filter(record)
+
+        self.assertEqual(
+            record.getMessage(), "login alice password=[REDACTED] headers {'Cookie': [REDACTED], 'Accept': 'text/html'}")
+
+    def test_debug_records_are_sampled_per_message(self):
+        logger = self.logger(logs.SamplingFilter(rate=10))
+        with self.assertLogs(logger, logging.DEBUG) as captured:
+            for i in range(25):
+                logger.debug('hot path %s', i)
+                logger.debug('other path %s', i)
+            logger.warning('always kept')
+
+        self.assertEqual(captured.output[-1], f'WARNING:{logger.name}:always kept')
+        self.assertEqual(len(captured.output), 7)  # 3 + 3 debug records, one warning
+
+    def test_login_never_logs_the_password(self):
+        CustomUser.objects.create_user(username='alice', email='alice@example.com', phone_number='7', password='pw')
+
+        with self.assertLogs('CryptoNews', logging.DEBUG) as captured:
+            self.client.post('/ajax_login/', {'username': 'alice', 'password': 'hunter2'},
+                             HTTP_X_REQUESTED_WITH='XMLHttpRequest', HTTP_COOKIE='sessionid=secret')
+
+        self.assertFalse(any('hunter2' in line or 'sessionid' in line for line in captured.output))
+
+    def test_log_file_is_set_by_the_environment(self):
+        script = 'from django.conf import settings; print(settings.LOGGING["handlers"]["file"].get("filename"))'
+
+        def log_file(value):
+            return subprocess.run(
+                [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'CryptoNews.settings', 'CRYPTONEWS_LOG_FILE': value},
+            ).stdout.strip()
+
+        self.assertEqual(log_file('/var/log/cryptonews.log'), '/var/log/cryptonews.log')
+        # Empty, e.g. for test runs under any runner: no file is opened at all.
+        self.assertEqual(log_file(''), 'None')
+
+
+class LazyImportTests(TestCase):
+    def test_worker_startup_does_not_load_plotting_or_data_libraries(self):
+        script = (
+            'import sys, django; django.setup(); import Website.urls; '
+            'print(",".join(m for m in ("matplotlib", "plotly", "pandas", "numpy") if m in sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'CryptoNews.settings'},
+        )
+
+        self.assertEqual(result.stdout.strip(), '')
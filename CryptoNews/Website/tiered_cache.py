@@ -0,0 +1,265 @@
+"""Two-tier cache backend: a small per-process L1 in front of a shared L2.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'Website.tiered_cache.TieredCache',
+            'LOCATION': 'cryptonews',
+            'OPTIONS': {'L2': 'shared', 'L1_TIMEOUT': 2, 'L1_MAX_ENTRIES': 1000},
+        },
+        'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', ...},
+    }
+
+Reads are answered from L1 for at most L1_TIMEOUT seconds, then from the cache
+alias named by L2. Writes go to L2 and replace the local L1 copy. When L2 is
+Redis, every write also publishes the key on a pub/sub channel, so other
+processes drop their L1 copy at once; without pub/sub, L1_TIMEOUT bounds how
+stale another process can be. Keys carry the cache VERSION into both tiers,
+so bumping it retires every entry written by older code.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+
+from . import instrumentation
+
+logger = logging.getLogger('CryptoNews')
+
+PROCESS_ID = f'{os.getpid()}:{uuid.uuid4().hex}'
+RECONNECT_DELAY = 1.0
+
+_missing = object()
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+class InvalidationListener:
+    """Drops L1 entries that other processes have published as changed."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name=f'cache-invalidation-{cache.name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                client = self.cache.redis_client()
+                if client is None:
+                    return  # L2 is no longer Redis (settings changed)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.cache.channel)
+                try:
+                    while not self._stop.is_set():
+                        message = pubsub.get_message(timeout=RECONNECT_DELAY)
+                        if message is not None:
+                            self.cache.apply_invalidation(message['data'])
+                finally:
+                    pubsub.close()
+            except Exception as e:
+                # Invalidations may have been missed while disconnected.
+                logger.warning('Cache invalidation subscriber for %s failed (%s), reconnecting', self.cache.channel, e)
+                self.cache.l1.clear()
+                self._stop.wait(RECONNECT_DELAY)
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.name = location or 'tiered'
+        self.l2_alias = options.get('L2', 'shared')
+        self.l1_timeout = options.get('L1_TIMEOUT', 2)
+        self.channel = options.get('CHANNEL', f'cache-invalidation:{self.name}')
+        # LocMemCache keeps its data per LOCATION, so the per-thread instances Django
+        # creates for this backend all share one L1.
+        self.l1 = LocMemCache(f'{self.name}:l1', {
+            'TIMEOUT': self.l1_timeout,
+            'OPTIONS': {'MAX_ENTRIES': options.get('L1_MAX_ENTRIES', 1000)},
+        })
+        self._origin = f'{PROCESS_ID}:{self.name}'
+        self._start_listener()
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def redis_client(self):
+        l2 = self.l2
+        if isinstance(l2, RedisCache):
+            return l2._cache.get_client(write=True)
+        return None
+
+    def _start_listener(self):
+        if not isinstance(self.l2, RedisCache):
+            return
+        with _listeners_lock:
+            listener = _listeners.get(self._origin)
+            if listener is None or not listener.running:
+                _listeners[self._origin] = InvalidationListener(self).start()
+
+    def close_listener(self, timeout=None):
+        with _listeners_lock:
+            listener = _listeners.pop(self._origin, None)
+        if listener is not None:
+            listener.stop(timeout)
+
+    def _count(self, outcome, count=1):
+        with _stats_lock:
+            _stats[self.name][outcome] += count
+
+    def stats(self):
+        with _stats_lock:
+            return dict(_stats[self.name])
+
+    def reset_stats(self):
+        with _stats_lock:
+            _stats.pop(self.name, None)
+
+    def _version(self, version):
+        return self.version if version is None else version
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _local_timeout(self, timeout):
+        return self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+
+    def _store_local(self, key, value, timeout, version):
+        if timeout is not None and timeout <= 0:
+            self.l1.delete(key, version=version)
+        else:
+            self.l1.set(key, value, self._local_timeout(timeout), version=version)
+
+    def _publish(self, keys=(), version=None, clear=False):
+        client = self.redis_client()
+        if client is None:
+            return
+        message = {'origin': self._origin, 'version': version, 'keys': list(keys), 'clear': clear}
+        try:
+            client.publish(self.channel, json.dumps(message))
+            self._count('invalidations_sent')
+        except Exception as e:
+            logger.warning('Could not publish cache invalidation on %s: %s', self.channel, e)
+
+    def apply_invalidation(self, raw):
+        message = json.loads(raw)
+        if message['origin'] == self._origin:
+            return
+        if message['clear']:
+            self.l1.clear()
+        else:
+            self.l1.delete_many(message['keys'], version=message['version'])
+        self._count('invalidations_received')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        version, timeout = self._version(version), self._timeout(timeout)
+        if not self.l2.add(key, value, timeout, version=version):
+            return False
+        self._store_local(key, value, timeout, version)
+        self._publish([key], version)
+        return True
+
+    def get(self, key, default=None, version=None):
+        version = self._version(version)
+        value = self.l1.get(key, _missing, version=version)
+        if value is not _missing:
+            self._count('l1_hits')
+            instrumentation.record_cache(key, True)
+            return value
+        value = self.l2.get(key, _missing, version=version)
+        instrumentation.record_cache(key, value is not _missing)
+        if value is _missing:
+            self._count('misses')
+            return default
+        self._count('l2_hits')
+        self.l1.set(key, value, self.l1_timeout, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        version, timeout = self._version(version), self._timeout(timeout)
+        self.l2.set(key, value, timeout, version=version)
+        self._store_local(key, value, timeout, version)
+        self._publish([key], version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, self._timeout(timeout), version=self._version(version))
+
+    def delete(self, key, version=None):
+        version = self._version(version)
+        deleted = self.l2.delete(key, version=version)
+        self.l1.delete(key, version=version)
+        self._publish([key], version)
+        return deleted
+
+    def get_many(self, keys, version=None):
+        version = self._version(version)
+        found = self.l1.get_many(keys, version=version)
+        self._count('l1_hits', len(found))
+        remaining = [key for key in keys if key not in found]
+        if remaining:
+            fetched = self.l2.get_many(remaining, version=version)
+            self._count('l2_hits', len(fetched))
+            self._count('misses', len(remaining) - len(fetched))
+            if fetched:
+                self.l1.set_many(fetched, self.l1_timeout, version=version)
+            found.update(fetched)
+        for key in keys:
+            instrumentation.record_cache(key, key in found)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        version, timeout = self._version(version), self._timeout(timeout)
+        failed = self.l2.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            self._store_local(key, value, timeout, version)
+        if data:
+            self._publish(data.keys(), version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys, version = list(keys), self._version(version)
+        self.l2.delete_many(keys, version=version)
+        self.l1.delete_many(keys, version=version)
+        if keys:
+            self._publish(keys, version)
+
+    def has_key(self, key, version=None):
+        version = self._version(version)
+        return self.l1.has_key(key, version=version) or self.l2.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        version = self._version(version)
+        value = self.l2.incr(key, delta, version=version)
+        self.l1.delete(key, version=version)
+        self._publish([key], version)
+        return value
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+        self._publish(clear=True)
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
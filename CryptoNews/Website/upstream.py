@@ -0,0 +1,401 @@
+"""Shared HTTP client for every CoinGecko call.
+
+One keep-alive Session with a connection pool, gzip, timeouts, retries with
+jittered exponential backoff on 429/5xx, ETag/If-Modified-Since revalidation
+and per-endpoint latency/error metrics. Async views use aget_json, which goes
+through httpx when it is installed and otherwise runs get_json in a worker
+thread.
+
+A circuit breaker shared by every endpoint stops calling CoinGecko once it
+keeps failing: calls then raise CircuitOpen (a requests.ConnectionError, so
+callers already handle it) until one probe call gets through again. Every
+HTTP attempt, retries included, first takes a token from the process's
+CoinGecko rate limit (fetcher.coingecko_bucket), waiting at most
+COINGECKO_TIMEOUT for one before raising RateLimited.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import instrumentation
+from .fetcher import RateLimited, coingecko_bucket
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger('CryptoNews')
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_VALIDATORS = 256  # responses kept for conditional revalidation
+
+
+class CircuitOpen(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failed attempts (connection errors, 429 and 5xx).
+
+    While open, calls are refused for `reset_timeout` seconds. It then half-opens and
+    lets a single probe through: a response closes it, another failure opens it again,
+    and a probe that ends any other way gives its slot to the next call.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=None, reset_timeout=None):
+        self._failures = failures
+        self._reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def failure_threshold(self):
+        return self._failures or getattr(settings, 'COINGECKO_CIRCUIT_FAILURES', 5)
+
+    @property
+    def reset_timeout(self):
+        if self._reset_timeout is not None:
+            return self._reset_timeout
+        return getattr(settings, 'COINGECKO_CIRCUIT_RESET', 30)
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state, self._probing = self.HALF_OPEN, False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('CoinGecko is responding again, circuit closed')
+            self.state, self.consecutive_failures, self._probing = self.CLOSED, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                logger.warning('CoinGecko failed %s times in a row, circuit open for %ss',
+                               self.consecutive_failures, self.reset_timeout)
+                self.state, self._opened_at, self._probing = self.OPEN, time.monotonic(), False
+                self.times_opened += 1
+
+    def release(self):
+        """Free the probe slot of a call that ended without telling whether CoinGecko is back."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self.state, self.consecutive_failures, self._probing = self.CLOSED, 0, False
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.not_modified = 0
+        self.short_circuited = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'not_modified': self.not_modified,
+            'short_circuited': self.short_circuited,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class UpstreamClient:
+    def __init__(self, bucket=None):
+        self._bucket = bucket  # else the process-wide coingecko_bucket()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._validators = OrderedDict()
+        self._validators_lock = threading.Lock()
+        self._metrics = defaultdict(EndpointMetrics)
+        self._metrics_lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+        # httpx.AsyncClient is bound to the event loop it was first used on.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def base_url(self):
+        return getattr(settings, 'COINGECKO_API_URL', 'https://api.coingecko.com/api/v3').rstrip('/')
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                pool_size = getattr(settings, 'COINGECKO_MAX_CONCURRENCY', 16)
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': 'CryptoNews/1.0',
+                })
+                self._session = session
+            return self._session
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        async_client = self._async_clients.get(loop)
+        if async_client is None:
+            pool_size = getattr(settings, 'COINGECKO_MAX_CONCURRENCY', 16)
+            async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                headers={
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': 'CryptoNews/1.0',
+                },
+            )
+            self._async_clients[loop] = async_client
+        return async_client
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    async def aclose(self):
+        async_client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if async_client is not None:
+            await async_client.aclose()
+
+    def _record(self, endpoint, latency=None, error=False, retry=False, not_modified=False, short_circuited=False):
+        if latency is not None:
+            instrumentation.record('upstream', latency, endpoint)
+        with self._metrics_lock:
+            metrics = self._metrics[endpoint]
+            if latency is not None:
+                metrics.requests += 1
+                metrics.total_latency += latency
+                metrics.max_latency = max(metrics.max_latency, latency)
+            metrics.errors += error
+            metrics.retries += retry
+            metrics.not_modified += not_modified
+            metrics.short_circuited += short_circuited
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {endpoint: metrics.as_dict() for endpoint, metrics in self._metrics.items()}
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self._metrics.clear()
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), getattr(settings, 'COINGECKO_BACKOFF_MAX', 30))
+        # Full jitter keeps many workers from retrying in lockstep.
+        base = getattr(settings, 'COINGECKO_BACKOFF', 0.5)
+        return random.uniform(0, min(getattr(settings, 'COINGECKO_BACKOFF_MAX', 30), base * 2 ** attempt))
+
+    def _conditional_headers(self, key):
+        with self._validators_lock:
+            cached = self._validators.get(key)
+            if cached is None:
+                return {}, None
+            self._validators.move_to_end(key)
+        etag, last_modified, body = cached
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers, body
+
+    def _remember(self, key, response):
+        # The raw body, decoded afresh on each 304: callers own (and may change) what they get back.
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        with self._validators_lock:
+            self._validators[key] = (etag, last_modified, response.content)
+            self._validators.move_to_end(key)
+            while len(self._validators) > MAX_VALIDATORS:
+                self._validators.popitem(last=False)
+
+    def _check_circuit(self, endpoint):
+        if not self.breaker.allow():
+            self._record(endpoint, short_circuited=True)
+            raise CircuitOpen(f'CoinGecko circuit is open, not calling {endpoint}')
+
+    @property
+    def bucket(self):
+        return self._bucket or coingecko_bucket()
+
+    def _take_token(self, endpoint, timeout):
+        if not self.bucket.acquire(timeout=timeout):
+            raise RateLimited(f'No rate-limit token for {endpoint} within {timeout}s')
+
+    async def _atake_token(self, endpoint, timeout):
+        if not await self.bucket.aacquire(timeout=timeout):
+            raise RateLimited(f'No rate-limit token for {endpoint} within {timeout}s')
+
+    def _record_outcome(self, status_code):
+        if status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def get_json(self, path, params=None, endpoint=None):
+        """GET base_url + path and return the decoded JSON body.
+
+        `endpoint` names the metrics bucket (defaults to `path`); pass a template such
+        as '/coins/{id}/market_chart' for paths that embed ids. Raises
+        requests.RequestException once retries are exhausted.
+        """
+        try:
+            return self._get_json(path, params, endpoint or path)
+        except CircuitOpen:
+            raise
+        except BaseException:
+            # Bad JSON, redirect loops, a broken body...: the probe must not hold its slot forever.
+            self.breaker.release()
+            raise
+
+    def _get_json(self, path, params, endpoint):
+        url = self.base_url + path
+        key = (url, tuple(sorted((params or {}).items())))
+        headers, cached_body = self._conditional_headers(key)
+        retries = getattr(settings, 'COINGECKO_RETRIES', 3)
+        timeout = getattr(settings, 'COINGECKO_TIMEOUT', 10)
+
+        for attempt in range(retries + 1):
+            self._check_circuit(endpoint)
+            self._take_token(endpoint, timeout)
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.monotonic() - started, error=True)
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise
+                logger.warning('%s request failed (%s), retrying', endpoint, e)
+                self._record(endpoint, retry=True)
+                time.sleep(self._backoff(attempt))
+                continue
+
+            latency = time.monotonic() - started
+            self._record_outcome(response.status_code)
+            if response.status_code == 304 and cached_body is not None:
+                self._record(endpoint, latency, not_modified=True)
+                return json.loads(cached_body)
+            if response.status_code in RETRY_STATUSES:
+                self._record(endpoint, latency, error=True)
+                if attempt == retries:
+                    response.raise_for_status()
+                logger.warning('%s returned %s, retrying', endpoint, response.status_code)
+                self._record(endpoint, retry=True)
+                time.sleep(self._backoff(attempt, response))
+                continue
+
+            self._record(endpoint, latency, error=not response.ok)
+            response.raise_for_status()
+            data = response.json()
+            self._remember(key, response)
+            return data
+
+    async def aget_json(self, path, params=None, endpoint=None):
+        """Async get_json: same retries, revalidation and metrics, without holding a thread.
+
+        Errors are raised as requests exceptions so callers handle both paths alike.
+        """
+        if httpx is None:
+            return await sync_to_async(self.get_json, thread_sensitive=False)(path, params=params, endpoint=endpoint)
+        try:
+            return await self._aget_json(path, params, endpoint or path)
+        except CircuitOpen:
+            raise
+        except BaseException:
+            # Also covers cancellation, e.g. a client disconnecting mid-probe.
+            self.breaker.release()
+            raise
+
+    async def _aget_json(self, path, params, endpoint):
+        url = self.base_url + path
+        key = (url, tuple(sorted((params or {}).items())))
+        headers, cached_body = self._conditional_headers(key)
+        retries = getattr(settings, 'COINGECKO_RETRIES', 3)
+        timeout = getattr(settings, 'COINGECKO_TIMEOUT', 10)
+
+        for attempt in range(retries + 1):
+            self._check_circuit(endpoint)
+            await self._atake_token(endpoint, timeout)
+            started = time.monotonic()
+            try:
+                response = await self.async_client().get(url, params=params, headers=headers, timeout=timeout)
+            except httpx.TransportError as e:
+                self._record(endpoint, time.monotonic() - started, error=True)
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise requests.ConnectionError(str(e)) from e
+                logger.warning('%s request failed (%s), retrying', endpoint, e)
+                self._record(endpoint, retry=True)
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            latency = time.monotonic() - started
+            self._record_outcome(response.status_code)
+            if response.status_code == 304 and cached_body is not None:
+                self._record(endpoint, latency, not_modified=True)
+                return json.loads(cached_body)
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                self._record(endpoint, latency, error=True)
+                logger.warning('%s returned %s, retrying', endpoint, response.status_code)
+                self._record(endpoint, retry=True)
+                await asyncio.sleep(self._backoff(attempt, response))
+                continue
+
+            self._record(endpoint, latency, error=not response.is_success)
+            if not response.is_success:
+                raise requests.HTTPError(f'{response.status_code} Error for url: {response.url}')
+            data = response.json()
+            self._remember(key, response)
+            return data
+
+
+client = UpstreamClient()
+
+
+def get_json(path, params=None, endpoint=None):
+    return client.get_json(path, params=params, endpoint=endpoint)
+
+
+async def aget_json(path, params=None, endpoint=None):
+    return await client.aget_json(path, params=params, endpoint=endpoint)
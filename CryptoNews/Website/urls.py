@@ -1,22 +1,38 @@
 from django.urls import path
 from django.conf.urls.static import static
 from django.conf import settings
-from .views import register_view, login_view, logout_view, home_view, get_crypto_data, CustomLoginView, register, portfolio_view, settings_view, CustomLogoutView, ajax_login_view, get_crypto_list_data
+from .views import register_view, login_view, logout_view, home_view, get_crypto_data, CustomLoginView, register, portfolio_view, settings_view, CustomLogoutView, ajax_login_view
 from . import views
 
+if getattr(settings, 'ASYNC_VIEWS', False):
+    from . import async_views
+    get_crypto_data = async_views.get_crypto_data
+    get_portfolio_data = async_views.get_portfolio_data
+    portfolio_view = async_views.portfolio_view
+    price_stream = async_views.price_stream
+else:
+    get_portfolio_data = views.get_portfolio_data
+    price_stream = views.price_stream
+
 urlpatterns = [
     path('', home_view, name='home'),
     path('register/', register_view, name='register'),
     path('login/', CustomLoginView.as_view(), name='login'),
     path('ajax_login/', ajax_login_view, name='ajax_login'),
     path('api/crypto-data/', get_crypto_data, name='crypto-data'),
-    path('api/crypto-list-data/', get_crypto_list_data, name='crypto-list-data'),
+    path('api/crypto-list-data/', get_crypto_data, name='crypto-list-data'),
+    path('api/stream/prices/', price_stream, name='price-stream'),
+    path('api/portfolio/', get_portfolio_data, name='portfolio-data'),
+    path('api/coins/search', views.coin_search, name='coin-search'),
     path('portfolio/', portfolio_view, name='portfolio'),
+    path('portfolio/chart/<str:kind>/<str:key>.png', views.portfolio_chart, name='portfolio_chart'),
+    path('api/portfolio/chart-data/', views.portfolio_chart_data, name='portfolio_chart_data'),
     path('add_to_portfolio/', views.add_to_portfolio, name='add_to_portfolio'),
     path('delete_portfolio/<int:portfolio_id>/', views.delete_portfolio, name='delete_portfolio'),
     path('settings/', settings_view, name='settings'),
     path('logout/', CustomLogoutView.as_view(), name='logout'),
     path('check_duplicate/', views.check_duplicate, name='check_duplicate'),
+    path('metrics', views.metrics, name='metrics'),
 ]
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
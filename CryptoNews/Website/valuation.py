@@ -0,0 +1,161 @@
+"""Portfolio valuation: every figure a view shows, computed in one pass over a user's lots.
+
+value_portfolio() takes rows of LOT_FIELDS and a {symbol: price} mapping,
+loads amounts, cost bases and current prices into NumPy arrays, and derives
+value, P/L, P/L %, weights, per-symbol allocation and totals with array
+operations. Money leaves the engine as Decimal rounded to cents, whichever
+view asks for it.
+
+The rows are either the user's lots (lots_query) or, where no view lists
+individual lots, one row per coin summed by the database (positions_query),
+so the work then grows with the number of coins held rather than of lots.
+"""
+import logging
+from decimal import Decimal
+from functools import cached_property
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Max, Sum
+
+logger = logging.getLogger('CryptoNews')
+
+LOT_FIELDS = ('id', 'crypto_name', 'crypto_symbol', 'amount_owned', 'purchase_price', 'cost_basis')
+COST_BASIS = ExpressionWrapper(
+    F('amount_owned') * F('purchase_price'), output_field=DecimalField(max_digits=30, decimal_places=10))
+CENT = Decimal('0.01')
+
+
+def to_money(value):
+    return Decimal('%.2f' % value)
+
+
+def money_column(values):
+    """to_money() for a whole array: NumPy rounds to whole cents, and each Decimal is built from an int.
+
+    NaN (a lot with no cost basis) comes back as None.
+    """
+    import numpy as np
+
+    missing = np.isnan(values)
+    cents = np.rint(np.where(missing, 0, values) * 100).astype(np.int64).tolist()
+    column = [Decimal(cent) * CENT for cent in cents]
+    for i in np.flatnonzero(missing).tolist():
+        column[i] = None
+    return column
+
+
+def lots_query(holdings):
+    """LOT_FIELDS tuples for a queryset of Portfolio lots, without building model instances."""
+    return holdings.annotate(cost_basis=COST_BASIS).values_list(*LOT_FIELDS)
+
+
+def positions_query(holdings):
+    """(symbol, name, amount, cost basis) per coin in `holdings`, summed in SQL."""
+    return (holdings.order_by().values('crypto_symbol')
+            .annotate(name=Max('crypto_name'), amount=Sum('amount_owned'), cost=Sum(COST_BASIS))
+            .values_list('crypto_symbol', 'name', 'amount', 'cost'))
+
+
+def position_rows(positions):
+    # One LOT_FIELDS row per coin; the purchase price shown is the average paid.
+    return [
+        (None, name, symbol, amount, (cost / amount).quantize(Decimal('0.01')) if amount else Decimal('0.00'), cost)
+        for symbol, name, amount, cost in positions
+    ]
+
+
+def lot_rows(holdings):
+    return list(lots_query(holdings))
+
+
+def holding_rows(holdings):
+    return position_rows(positions_query(holdings))
+
+
+class PortfolioValuation:
+    def __init__(self, lots, prices):
+        import numpy as np
+
+        priced = [lot for lot in lots if lot[2] in prices]
+        self.missing = sorted({lot[2] for lot in lots} - {lot[2] for lot in priced})
+        for symbol in self.missing:
+            logger.error("No current price available for %s", symbol)
+        # Coins priced from a stale snapshot or the stored history while CoinGecko is down.
+        self.stale = sorted(set(getattr(prices, 'stale', ())) & {lot[2] for lot in priced})
+
+        # Symbols become small integer codes, so prices are converted once per coin, not per lot.
+        codes = {}
+        self.codes = np.fromiter((codes.setdefault(lot[2], len(codes)) for lot in priced), dtype=np.intp, count=len(priced))
+        self.symbols = list(codes)
+        coin_prices = np.fromiter((prices[symbol] for symbol in self.symbols), dtype=np.float64, count=len(codes))
+
+        self._lots = priced
+        self._prices = prices
+        self.amounts = np.fromiter((lot[3] for lot in priced), dtype=np.float64, count=len(priced))
+        self.costs = np.fromiter((lot[5] for lot in priced), dtype=np.float64, count=len(priced))
+
+        self.values = self.amounts * coin_prices[self.codes]
+        self.profit_loss = self.values - self.costs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.profit_loss_percentages = np.where(self.costs != 0, self.profit_loss / self.costs * 100, np.nan)
+
+        total_value = self.values.sum()
+        total_cost = self.costs.sum()
+        self.weights = self.values / total_value if total_value else np.zeros_like(self.values)
+        self.total_value = to_money(total_value)
+        self.total_cost = to_money(total_cost)
+        self.total_profit_loss = to_money(total_value - total_cost)
+        self.total_profit_loss_percentage = (
+            to_money((total_value - total_cost) / total_cost * 100) if total_cost else Decimal('0.00'))
+
+        # Positions per symbol, largest first.
+        position_values = np.bincount(self.codes, weights=self.values, minlength=len(codes))
+        position_amounts = np.bincount(self.codes, weights=self.amounts, minlength=len(codes))
+        self.positions = [
+            {
+                'symbol': self.symbols[i],
+                'amount': position_amounts[i],
+                'value': position_values[i],
+                'weight': position_values[i] / total_value if total_value else 0.0,
+            }
+            for i in np.argsort(-position_values, kind='stable').tolist()
+        ]
+
+    def __len__(self):
+        return len(self._lots)
+
+    @cached_property
+    def entries(self):
+        """One dict per priced lot, largest current value first, as the templates and APIs use them."""
+        import numpy as np
+
+        order = np.argsort(-self.values, kind='stable')
+        lots = map(self._lots.__getitem__, order.tolist())
+        columns = zip(
+            lots, money_column(self.values[order]), money_column(self.costs[order]),
+            money_column(self.profit_loss[order]), money_column(self.profit_loss_percentages[order]),
+            self.weights[order].tolist())
+        prices = self._prices
+        return [
+            {
+                'id': lot_id,
+                'crypto_name': name,
+                'crypto_symbol': symbol,
+                'amount_owned': amount,
+                'purchase_price': purchase_price,
+                'current_price': prices[symbol],
+                'current_value': value,
+                'cost_basis': cost,
+                'profit_loss': profit_loss,
+                'profit_loss_percentage': percentage,
+                'weight': weight,
+            }
+            for (lot_id, name, symbol, amount, purchase_price, _), value, cost, profit_loss, percentage, weight in columns
+        ]
+
+    def allocation(self):
+        return [{'symbol': position['symbol'], 'value': round(float(position['value']), 2)} for position in self.positions]
+
+
+def value_portfolio(rows, prices):
+    """Value LOT_FIELDS `rows` (lots or positions) at `prices` ({symbol: price})."""
+    return PortfolioValuation(rows, prices)